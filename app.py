@@ -4,7 +4,12 @@ import pandas as pd
 from datetime import datetime
 import time
 from image_processor import process_image_folder, process_single_image
-from utils import get_all_image_files, is_valid_image
+from ingest_pipeline import IngestPipeline
+from ingest_jobs import (
+    create_folder_job, get_job_progress, format_eta, start_background_run, get_background_run, running_job_ids,
+    get_job_state, get_recent_results, stop_job, start_tree_job
+)
+from utils import scan_folder, is_valid_image
 import database as db
 from history_page import show_history_page
 from search_page import show_search_page
@@ -12,7 +17,16 @@ from dashboard_page import show_dashboard_page
 from onboarding_tour import show_onboarding_tour
 from clustering_page import show_clustering_page
 from comparison_page import show_comparison_page
+from map_page import show_map_page
+from performance_page import show_performance_page
+from vision_providers import available_providers, default_provider_name
+from upload_staging import start_upload_job
 from export_utils import export_to_csv, export_to_excel, export_to_pdf_simple, export_to_pdf_detailed
+import metrics
+
+# Expose Prometheus metrics when a port is configured (started once per server process)
+if os.environ.get("METRICS_PORT"):
+    metrics.start_http_server(int(os.environ["METRICS_PORT"]))
 
 # Set page config
 st.set_page_config(
@@ -42,6 +56,16 @@ if 'tour_step' not in st.session_state:
     st.session_state.tour_step = 1
 if 'tour_completed' not in st.session_state:
     st.session_state.tour_completed = False
+if 'uploader_key' not in st.session_state:
+    st.session_state.uploader_key = 0
+if 'analyze_workers' not in st.session_state:
+    st.session_state.analyze_workers = 4
+if 'metadata_workers' not in st.session_state:
+    st.session_state.metadata_workers = min(4, os.cpu_count() or 1)
+if 'images_per_request' not in st.session_state:
+    st.session_state.images_per_request = 1
+if 'vision_provider' not in st.session_state:
+    st.session_state.vision_provider = default_provider_name()
     
 # Check if first launch - show onboarding
 first_launch = 'first_launch' not in st.session_state
@@ -86,7 +110,7 @@ with col4:
         st.rerun()
 
 # Second row for additional features
-col1, col2, col3 = st.columns(3)
+col1, col2, col3, col4, col5 = st.columns(5)
 with col1:
     if st.button("Image Clusters", use_container_width=True):
         st.session_state.current_page = "clusters"
@@ -96,6 +120,14 @@ with col2:
         st.session_state.current_page = "compare"
         st.rerun()
 with col3:
+    if st.button("Photo Map", use_container_width=True):
+        st.session_state.current_page = "map"
+        st.rerun()
+with col4:
+    if st.button("Performance", use_container_width=True):
+        st.session_state.current_page = "performance"
+        st.rerun()
+with col5:
     if st.button("Download Code", use_container_width=True):
         # Redirect to the code download page
         import streamlit as st
@@ -118,35 +150,24 @@ with st.sidebar:
             "Upload Images", 
             accept_multiple_files=True,
             type=["jpg", "jpeg", "png", "bmp", "gif", "webp", "heic", "heif"],
-            help="Select multiple images to analyze"
+            help="Select multiple images to analyze",
+            # A new key empties the uploader, so Streamlit can let go of files once they are staged
+            key=f"uploader_{st.session_state.uploader_key}"
         )
         
         if uploaded_files:
             st.info(f"Selected {len(uploaded_files)} images for processing")
             
-            # Create a temporary directory to store uploaded files if needed
-            if 'upload_dir' not in st.session_state:
-                import tempfile
-                st.session_state.upload_dir = tempfile.mkdtemp()
-                st.session_state.current_folder = st.session_state.upload_dir
-            
             # Process button for uploaded files
             if st.button("Process Uploaded Images", use_container_width=True, disabled=st.session_state.processing):
-                # Save uploaded files to temp directory
-                saved_files = []
-                for uploaded_file in uploaded_files:
-                    file_path = os.path.join(st.session_state.upload_dir, uploaded_file.name)
-                    with open(file_path, "wb") as f:
-                        f.write(uploaded_file.getbuffer())
-                    saved_files.append(file_path)
-                
-                if saved_files:
-                    st.session_state.processing = True
-                    st.session_state.results = None
-                    st.session_state.processed_images = {}
-                    st.session_state.selected_image = None
-                    st.session_state.upload_files = saved_files
-                    st.rerun()
+                # Staged to disk and analyzed in the background once processing starts
+                st.session_state.upload_batch = list(uploaded_files)
+                st.session_state.uploader_key += 1
+                st.session_state.processing = True
+                st.session_state.results = None
+                st.session_state.processed_images = {}
+                st.session_state.selected_image = None
+                st.rerun()
                     
     else:  # Select Directory method
         # Option to select parent directory
@@ -169,18 +190,33 @@ with st.sidebar:
 
                 if selected_folder:
                     folder_path = os.path.join(parent_dir, selected_folder)
+                    include_subfolders = st.checkbox(
+                        "Include subfolders",
+                        value=False,
+                        help="Also process every folder inside this one, keeping the folder structure"
+                    )
 
-                    # Count images in the folder
-                    image_files = get_all_image_files(folder_path)
+                    # Count images in the folder (rescanned only when the folder changes)
+                    manifest = scan_folder(folder_path)
+                    image_files = manifest["image_files"] if manifest else ()
 
-                    if image_files:
-                        st.info(f"Found {len(image_files)} images in this folder")
+                    if image_files or include_subfolders:
+                        if include_subfolders:
+                            st.info(f"Found {len(image_files)} images in this folder; "
+                                    "subfolders are read when processing starts")
+                        else:
+                            st.info(f"Found {len(image_files)} images in this folder")
 
                         # Store current folder
                         st.session_state.current_folder = parent_dir
 
                         # Process button
                         if st.button("Process Folder", use_container_width=True, disabled=st.session_state.processing):
+                            if include_subfolders:
+                                st.session_state.selected_tree_root = os.path.abspath(folder_path)
+                            else:
+                                # Processing takes this folder's manifest instead of scanning again
+                                st.session_state.selected_folder_path = manifest["path"]
                             st.session_state.processing = True
                             st.session_state.results = None
                             st.session_state.processed_images = {}
@@ -194,6 +230,32 @@ with st.sidebar:
             if parent_dir:
                 st.error("Directory not found. Please enter a valid path")
 
+    # Per-stage concurrency for the ingest pipeline
+    with st.expander("Performance Settings"):
+        providers = available_providers()
+        st.session_state.vision_provider = st.selectbox(
+            "Vision provider", providers,
+            index=providers.index(st.session_state.vision_provider) if st.session_state.vision_provider in providers else 0,
+            help="openai uses the hosted API, local an OpenAI-compatible server (LOCAL_VISION_BASE_URL), "
+                 "offline a CPU classifier or basic image properties"
+        )
+        st.session_state.analyze_workers = st.number_input(
+            "Parallel AI requests", min_value=1, max_value=32,
+            value=st.session_state.analyze_workers,
+            help="Number of images analyzed concurrently"
+        )
+        st.session_state.images_per_request = st.number_input(
+            "Images per AI request", min_value=1, max_value=16,
+            value=st.session_state.images_per_request,
+            help="Send several downscaled images from a folder in each request, sharing the instructions. "
+                 "Uses fewer tokens per image; best for large folders of similar images"
+        )
+        st.session_state.metadata_workers = st.number_input(
+            "Metadata worker processes", min_value=0, max_value=os.cpu_count() or 1,
+            value=st.session_state.metadata_workers,
+            help="Processes extracting EXIF metadata (0 extracts in the pipeline threads)"
+        )
+
 # Add Tour button in sidebar if tour completed
 with st.sidebar:
     if st.session_state.tour_completed:
@@ -203,6 +265,150 @@ with st.sidebar:
             st.session_state.current_page = "onboarding"
             st.rerun()
 
+def load_job_results(job_id, pipeline=None):
+    """
+    Load every image of a job into the results view
+    """
+    # Build the results from the job table so resumed runs show every image
+    results = []
+    for item, image in db.get_ingest_job_results(job_id):
+        if image is not None and image.description is not None:
+            result = {
+                "file_path": image.file_path,
+                "file_name": image.file_name,
+                "object_name": image.object_name,
+                "description": image.description,
+                "confidence": image.confidence,
+                "metadata": {column: getattr(image, column) for column in db.METADATA_COLUMNS}
+            }
+            # Store in session state
+            st.session_state.processed_images[image.file_path] = result
+        else:
+            result = {
+                "file_path": item.file_path,
+                "file_name": os.path.basename(item.file_path),
+                "object_name": "Error" if item.status == db.JOB_ITEM_FAILED else "Pending",
+                "description": f"Failed to process: {item.last_error}" if item.last_error else "Not processed yet",
+                "confidence": 0
+            }
+        results.append(result)
+
+    # Convert results to DataFrame
+    df = pd.DataFrame([{
+        "file_path": result["file_path"],
+        "file_name": result["file_name"],
+        "object_name": result["object_name"],
+        "description": result["description"],
+        "confidence": result["confidence"]
+    } for result in results])
+
+    # Store results in session state
+    st.session_state.results = df
+    st.session_state.current_job_id = job_id
+    if pipeline is not None:
+        st.session_state.pipeline_metrics = pipeline.metrics()
+        st.session_state.pipeline_bottleneck = pipeline.bottleneck()
+    else:
+        # Ran on an ingest worker, whose stage metrics stay in that process
+        st.session_state.pop("pipeline_metrics", None)
+        st.session_state.pop("pipeline_bottleneck", None)
+
+@st.fragment(run_every=2)
+def show_live_run(job_id):
+    """
+    Show the progress and latest results of a job running in the background or
+    on an ingest worker, refreshing every couple of seconds without rerunning
+    the rest of the page
+    """
+    state = get_job_state(job_id)
+    if not state["active"]:
+        if state["error"]:
+            st.session_state.run_error = state["error"]
+        run = get_background_run(job_id)
+        load_job_results(job_id, run.pipeline if run is not None else None)
+        del st.session_state.active_job_id
+        st.rerun()
+
+    progress = state["progress"]
+    finished = progress["done"] + progress["failed"]
+    st.subheader("Processing")
+    if state["runner"] is None:
+        st.caption("Waiting for an ingest worker to pick up the job...")
+    elif len(state["nodes"]) > 1:
+        st.caption(f"Running on {len(state['nodes'])} ingest workers")
+    elif state["runner"] != "app":
+        st.caption(f"Running on ingest worker {state['runner']}")
+    st.progress(min(finished / max(progress["total"], 1), 1.0),
+                text=f"{finished} of {progress['total']} images processed")
+
+    col1, col2, col3, col4, col5 = st.columns(5)
+    with col1:
+        st.metric("Done", progress["done"])
+    with col2:
+        st.metric("Failed", progress["failed"])
+    with col3:
+        st.metric("Images/s", f"{progress['items_per_second']:.2f}")
+    with col4:
+        st.metric("ETA", format_eta(progress["eta_seconds"]))
+    with col5:
+        if st.button("Stop", disabled=state["stopping"], use_container_width=True,
+                     help="Finish the images already being analyzed, then stop. Resume from Unfinished Jobs."):
+            stop_job(job_id)
+    if state["stopping"]:
+        st.caption("Stopping after the images already in progress...")
+    if len(state["nodes"]) > 1:
+        st.dataframe(
+            pd.DataFrame(state["nodes"]),
+            use_container_width=True,
+            column_config={
+                "node": "Worker",
+                "in_flight": "In progress",
+                "done": "Done",
+                "failed": "Failed",
+                "items_per_second": st.column_config.NumberColumn("Images/s", format="%.2f"),
+            },
+            hide_index=True
+        )
+
+    recent = get_recent_results(job_id)
+    if recent:
+        st.markdown("**Latest results** (newest first; browse other pages while processing continues)")
+        st.dataframe(
+            pd.DataFrame([{
+                "file_name": result["file_name"],
+                "object_name": result["object_name"],
+                "confidence": result["confidence"],
+                "description": result["description"],
+            } for result in recent]),
+            use_container_width=True,
+            column_config={
+                "file_name": "File Name",
+                "object_name": "Object",
+                "confidence": st.column_config.ProgressColumn("Confidence", min_value=0, max_value=1, format="%.2f"),
+                "description": "Description",
+            },
+            hide_index=True,
+            height=400
+        )
+
+@st.fragment(run_every=5)
+def show_background_runs():
+    """
+    Show the ingest workers online and a one-line status for each job in progress
+    """
+    workers = db.get_active_ingest_workers()
+    if workers:
+        st.caption(f"🖥️ {len(workers)} ingest worker{'s' if len(workers) != 1 else ''} online")
+    job_ids = running_job_ids() | {job.id for job in db.get_queued_ingest_jobs()}
+    for job_id in sorted(job_ids):
+        state = get_job_state(job_id)
+        progress = state["progress"]
+        where = "queued" if state["runner"] is None else f"ETA {format_eta(progress['eta_seconds'])}"
+        st.caption(f"⏳ Job {job_id}: {progress['done'] + progress['failed']} of {progress['total']} images, {where}")
+
+with st.sidebar:
+    show_background_runs()
+
 # Show the appropriate page based on selection
 if st.session_state.current_page == "history":
     show_history_page()
@@ -214,120 +420,115 @@ elif st.session_state.current_page == "clusters":
     show_clustering_page()
 elif st.session_state.current_page == "compare":
     show_comparison_page()
+elif st.session_state.current_page == "map":
+    show_map_page()
+elif st.session_state.current_page == "performance":
+    show_performance_page()
 elif st.session_state.current_page == "onboarding":
     show_onboarding_tour()
 else:  # Process page (default)
+    # Offer to resume jobs that were interrupted or had failures
+    if not st.session_state.processing:
+        incomplete_jobs = db.get_incomplete_ingest_jobs()
+        running = running_job_ids() | {job.id for job in db.get_queued_ingest_jobs()}
+        if incomplete_jobs:
+            with st.expander(f"Unfinished Jobs ({len(incomplete_jobs)})"):
+                for job in incomplete_jobs:
+                    progress = get_job_progress(job.id)
+                    cols = st.columns([3, 1, 1])
+                    with cols[0]:
+                        st.markdown(f"**{job.name}** ({job.created_at.strftime('%Y-%m-%d %H:%M')}): "
+                                    f"{progress['done']} of {progress['total']} done, "
+                                    f"{progress['remaining']} remaining, {progress['failed']} failed")
+                    if job.id in running:
+                        cols[1].caption("Queued" if job.status == 'queued' else "Running")
+                        if job.id != st.session_state.get('active_job_id') and cols[2].button("Watch", key=f"watch_job_{job.id}"):
+                            st.session_state.active_job_id = job.id
+                            st.rerun()
+                        continue
+                    with cols[1]:
+                        if progress['remaining'] and st.button("Resume", key=f"resume_job_{job.id}"):
+                            st.session_state.resume_job_id = job.id
+                            st.session_state.retry_failed = False
+                            st.session_state.processing = True
+                            st.rerun()
+                    with cols[2]:
+                        if progress['failed'] and st.button("Retry Failed", key=f"retry_job_{job.id}"):
+                            st.session_state.resume_job_id = job.id
+                            st.session_state.retry_failed = True
+                            st.session_state.processing = True
+                            st.rerun()
+
     # Main content area for processing
-    if st.session_state.processing and st.session_state.current_folder:
-        # Check if we have uploaded files to process
-        if 'upload_files' in st.session_state and st.session_state.upload_files:
-            image_files = st.session_state.upload_files
-            folder_name = "Uploaded_Images"
-            full_folder_path = st.session_state.upload_dir
+    if st.session_state.processing and ('selected_folder_path' in st.session_state or 'resume_job_id' in st.session_state
+                                        or 'upload_batch' in st.session_state
+                                        or 'selected_tree_root' in st.session_state):
+        retry_failed = False
+        options = {
+            "metadata_workers": st.session_state.metadata_workers,
+            "analyze_workers": st.session_state.analyze_workers,
+            "provider": st.session_state.vision_provider,
+            "images_per_request": st.session_state.images_per_request,
+        }
+        if 'upload_batch' in st.session_state:
+            # Uploads are staged on this server, so they are analyzed here even when
+            # ingest workers are online; analysis starts as the first file lands
+            job = start_upload_job(st.session_state.pop('upload_batch'), pipeline=IngestPipeline(**options))
+            st.session_state.active_job_id = job.id
+            job_id = None
+        elif 'selected_tree_root' in st.session_state:
+            # The tree is walked in the background. Run here, analysis starts with the
+            # first directory read; ingest workers get the job once the walk is done
+            tree_root = st.session_state.pop('selected_tree_root')
+            if db.get_active_ingest_workers():
+                job = start_tree_job(tree_root, enqueue_options={**options, "retry_failed": False, "max_retries": 3})
+            else:
+                job = start_tree_job(tree_root, pipeline=IngestPipeline(**options))
+            st.session_state.active_job_id = job.id
+            job_id = None
+        elif 'resume_job_id' in st.session_state:
+            # Continue a persisted job where it stopped
+            job_id = st.session_state.resume_job_id
+            retry_failed = st.session_state.get('retry_failed', False)
+            del st.session_state.resume_job_id
         else:
-            # Find folder with images from directory selection
-            selected_folder = ""
-            for d in os.listdir(st.session_state.current_folder):
-                if os.path.isdir(os.path.join(st.session_state.current_folder, d)):
-                    if get_all_image_files(os.path.join(st.session_state.current_folder, d)):
-                        selected_folder = d
-                        break
-
-            if not selected_folder:
-                st.error("Could not find a folder with valid images")
-                st.session_state.processing = False
-                st.rerun()
+            # The folder chosen in the sidebar; its scan is reused unless the folder changed since
+            manifest = scan_folder(st.session_state.pop('selected_folder_path'))
+            image_files = manifest["image_files"] if manifest else ()
 
-            full_folder_path = os.path.join(st.session_state.current_folder, selected_folder)
-            folder_name = selected_folder
-            # Get all images in the folder
-            image_files = get_all_image_files(full_folder_path)
-
-        # Display processing status
-        with st.spinner("Processing images... This may take a while depending on the number of images."):
-            # Create progress bar
-            progress_bar = st.progress(0)
-            status_text = st.empty()
-
-            total_images = len(image_files)
-
-            if total_images > 0:
-                results = []
-
-                # Process each image
-                # Add folder to database
-                db_folder = db.add_folder(folder_name, full_folder_path)
-
-                for i, img_path in enumerate(image_files):
-                    try:
-                        # Update progress
-                        progress = (i + 1) / total_images
-                        progress_bar.progress(progress)
-                        status_text.text(f"Processing image {i+1} of {total_images}: {os.path.basename(img_path)}")
-
-                        # Check if image already exists in database
-                        existing_image = db.get_image_by_path(img_path)
-                        if existing_image:
-                            # Use existing result
-                            result = {
-                                "object_name": existing_image.object_name,
-                                "description": existing_image.description,
-                                "confidence": existing_image.confidence
-                            }
-                        else:
-                            # Process the image
-                            result = process_single_image(img_path)
-
-                            # Save to database
-                            db.add_image_result(
-                                folder_id=db_folder.id,
-                                file_name=os.path.basename(img_path),
-                                file_path=img_path,
-                                object_name=result.get("object_name", "Unknown"),
-                                description=result.get("description", "No description available"),
-                                confidence=result.get("confidence", 0),
-                                metadata=result.get("metadata", {})
-                            )
-
-                        # Store result
-                        result_with_path = {
-                            "file_path": img_path,
-                            "file_name": os.path.basename(img_path),
-                            "object_name": result.get("object_name", "Unknown"),
-                            "description": result.get("description", "No description available"),
-                            "confidence": result.get("confidence", 0)
-                        }
-                        results.append(result_with_path)
-
-                        # Store in session state
-                        st.session_state.processed_images[img_path] = result
-
-                    except Exception as e:
-                        st.error(f"Error processing {os.path.basename(img_path)}: {str(e)}")
-                        # Add error entry
-                        results.append({
-                            "file_path": img_path,
-                            "file_name": os.path.basename(img_path),
-                            "object_name": "Error",
-                            "description": f"Failed to process: {str(e)}",
-                            "confidence": 0
-                        })
-
-                # Convert results to DataFrame
-                df = pd.DataFrame(results)
-
-                # Store results in session state
-                st.session_state.results = df
-            else:
+            # Persist the work list so the run can be resumed if the session dies
+            job_id = create_folder_job([(manifest["name"], manifest["path"], image_files)]).id if image_files else None
+            if job_id is None:
                 st.warning("No valid images found in the selected folder")
 
+        if job_id is not None:
+            max_retries = None if retry_failed else 3
+            try:
+                if db.get_active_ingest_workers():
+                    # Ingest workers own processing; the app only follows progress
+                    db.enqueue_ingest_job(job_id, {**options, "retry_failed": retry_failed, "max_retries": max_retries})
+                else:
+                    # No workers running: process in this server, off the script thread so
+                    # other pages stay usable. Scan -> metadata -> analyze -> persist, each
+                    # stage with its own workers
+                    start_background_run(job_id, pipeline=IngestPipeline(**options), retry_failed=retry_failed,
+                                         max_retries=max_retries)
+                st.session_state.active_job_id = job_id
+                st.session_state.results = None
+            except ValueError as e:
+                st.error(str(e))
+
         # Reset processing flag
         st.session_state.processing = False
-        # Clean up upload files reference if it exists
-        if 'upload_files' in st.session_state:
-            del st.session_state.upload_files
         st.rerun()
 
+    # Live progress and results of a run in progress
+    if 'active_job_id' in st.session_state:
+        show_live_run(st.session_state.active_job_id)
+
+    if 'run_error' in st.session_state:
+        st.error(f"Processing stopped: {st.session_state.pop('run_error')}")
+
     # Display results
     if st.session_state.results is not None:
         # Create tabs for different views
@@ -377,6 +578,12 @@ else:  # Process page (default)
                     st.session_state.selected_image = clicked_path
                     st.rerun()
 
+                # Per-stage throughput of the last run
+                if st.session_state.get('pipeline_metrics'):
+                    with st.expander("Pipeline Performance"):
+                        st.dataframe(pd.DataFrame(st.session_state.pipeline_metrics), hide_index=True)
+                        st.caption(f"Slowest stage: {st.session_state.pipeline_bottleneck}")
+
                 # Export options
                 st.subheader("Export Results")
 
@@ -0,0 +1,252 @@
+import os
+import json
+import time
+import datetime
+import tempfile
+import image_processor
+from image_processor import encode_image_to_base64, build_analysis_request, normalize_analysis_result
+from utils import extract_metadata_parallel
+from semantic_search import index_images
+import database as db
+
+# Batch API limits are 50,000 requests and 200 MB per input file
+MAX_REQUESTS_PER_BATCH = 1000
+MAX_BYTES_PER_BATCH = 180 * 1024 * 1024
+
+# Batch states after which no more results will arrive
+TERMINAL_STATUSES = {"completed", "failed", "expired", "cancelled"}
+
+def _custom_id(item_id):
+    return f"item-{item_id}"
+
+def _item_id(custom_id):
+    return int(custom_id.split("-", 1)[1])
+
+def _submit_file(job_id, file_path, item_ids):
+    """
+    Upload a JSONL request file and start a batch for it
+    """
+    client = image_processor.openai_client
+    with open(file_path, "rb") as f:
+        input_file = client.files.create(file=f, purpose="batch")
+
+    batch = client.batches.create(
+        input_file_id=input_file.id,
+        endpoint="/v1/chat/completions",
+        completion_window="24h",
+        metadata={"ingest_job_id": str(job_id)}
+    )
+
+    record = db.add_analysis_batch(job_id, batch.id, input_file.id, batch.status, item_ids)
+    db.mark_job_items_in_flight(item_ids)
+    return record
+
+def submit_job_batches(job_id, max_requests=MAX_REQUESTS_PER_BATCH, max_bytes=MAX_BYTES_PER_BATCH):
+    """
+    Pack the pending items of an ingest job into JSONL files and submit them to the Batch API
+
+    Each line carries the same chat completion request as the synchronous analysis,
+    tagged with the job item ID so results can be matched back to files.
+
+    Args:
+        job_id (int): ID of the ingest job
+        max_requests (int): Maximum number of requests per batch file
+        max_bytes (int): Maximum size of a batch file in bytes
+
+    Returns:
+        list: The AnalysisBatch records that were submitted
+    """
+    pending = db.get_pending_job_items(job_id)
+    if not pending:
+        return []
+
+    db.update_ingest_job_status(job_id, 'running')
+
+    submitted = []
+    failed = []
+    item_ids = []
+    size = 0
+    handle, file_path = tempfile.mkstemp(prefix=f"batch_job_{job_id}_", suffix=".jsonl")
+    f = os.fdopen(handle, "w")
+
+    try:
+        for item_id, _, image_path in pending:
+            try:
+                line = json.dumps({
+                    "custom_id": _custom_id(item_id),
+                    "method": "POST",
+                    "url": "/v1/chat/completions",
+                    "body": build_analysis_request(encode_image_to_base64(image_path))
+                }) + "\n"
+            except Exception as e:
+                failed.append((item_id, f"encode: {str(e)}"))
+                continue
+
+            if item_ids and (len(item_ids) >= max_requests or size + len(line) > max_bytes):
+                f.close()
+                submitted.append(_submit_file(job_id, file_path, item_ids))
+                f = open(file_path, "w")
+                item_ids = []
+                size = 0
+
+            f.write(line)
+            item_ids.append(item_id)
+            size += len(line)
+
+        f.close()
+        if item_ids:
+            submitted.append(_submit_file(job_id, file_path, item_ids))
+    finally:
+        f.close()
+        os.remove(file_path)
+        db.complete_job_items([], failed)
+
+    return submitted
+
+def _parse_result_line(record):
+    """
+    Turn one line of a batch output or error file into (item_id, result, error)
+    """
+    item_id = _item_id(record["custom_id"])
+    response = record.get("response") or {}
+
+    if record.get("error"):
+        return item_id, None, f"Batch API error: {record['error'].get('message', record['error'])}"
+    if response.get("status_code") != 200:
+        body = response.get("body") or {}
+        message = (body.get("error") or {}).get("message", "unknown error")
+        return item_id, None, f"Batch API error ({response.get('status_code')}): {message}"
+
+    try:
+        content = response["body"]["choices"][0]["message"]["content"]
+        return item_id, normalize_analysis_result(content), None
+    except Exception as e:
+        return item_id, None, f"Invalid batch response: {str(e)}"
+
+def ingest_batch_results(batch, metadata_workers=None):
+    """
+    Download the results of a finished batch and store them as Image rows
+
+    Metadata is extracted locally for the successful items; requests missing from
+    the output (e.g. when a batch expired) are marked failed so they can be retried.
+
+    Args:
+        batch (AnalysisBatch): A batch that has reached a terminal status
+        metadata_workers (int): Processes used for metadata extraction
+
+    Returns:
+        dict: Number of items done and failed
+    """
+    client = image_processor.openai_client
+    results = {}
+    errors = {}
+
+    for file_id in (batch.output_file_id, batch.error_file_id):
+        if not file_id:
+            continue
+        for line in client.files.content(file_id).text.splitlines():
+            if not line.strip():
+                continue
+            item_id, result, error = _parse_result_line(json.loads(line))
+            if result is not None:
+                results[item_id] = result
+            else:
+                errors[item_id] = error
+
+    submitted_ids = json.loads(batch.item_ids_json)
+    for item_id in submitted_ids:
+        if item_id not in results and item_id not in errors:
+            errors[item_id] = f"No result returned (batch {batch.status})"
+
+    items = {item_id: (folder_id, file_path) for item_id, folder_id, file_path in db.get_job_items_by_ids(submitted_ids)}
+    done_paths = {items[item_id][1]: item_id for item_id in results if item_id in items}
+
+    done = []
+    indexed = []
+    failed = list(errors.items())
+    for file_path, metadata in extract_metadata_parallel(list(done_paths), max_workers=metadata_workers):
+        item_id = done_paths[file_path]
+        result = results[item_id]
+        try:
+            image = db.add_image_result(
+                folder_id=items[item_id][0],
+                file_name=os.path.basename(file_path),
+                file_path=file_path,
+                object_name=result.get("object_name", "Unknown"),
+                description=result.get("description", "No description available"),
+                confidence=result.get("confidence", 0),
+                metadata=metadata
+            )
+            done.append((item_id, image.id))
+            indexed.append((image.id, image.object_name, image.description))
+        except Exception as e:
+            failed.append((item_id, f"persist: {str(e)}"))
+
+    db.complete_job_items(done, failed)
+    index_images(indexed)
+    db.update_analysis_batch(batch.id, ingested_at=datetime.datetime.utcnow())
+
+    counts = db.get_ingest_job_counts(batch.job_id)
+    if counts[db.JOB_ITEM_PENDING] == 0 and counts[db.JOB_ITEM_IN_FLIGHT] == 0:
+        db.update_ingest_job_status(batch.job_id, 'completed')
+
+    return {"done": len(done), "failed": len(failed)}
+
+def poll_batches(job_id=None, on_status=None):
+    """
+    Check all open batches and ingest the ones that have finished
+
+    Args:
+        job_id (int): Optionally restrict to the batches of one job
+        on_status (callable): Called as on_status(batch, ingested) for each batch;
+            ingested is None while the batch is still running
+
+    Returns:
+        int: Number of batches still running
+    """
+    client = image_processor.openai_client
+    running = 0
+
+    for batch in db.get_open_analysis_batches(job_id):
+        remote = client.batches.retrieve(batch.openai_batch_id)
+        fields = {
+            "status": remote.status,
+            "output_file_id": remote.output_file_id,
+            "error_file_id": remote.error_file_id,
+        }
+        if remote.status in TERMINAL_STATUSES:
+            fields["completed_at"] = datetime.datetime.utcnow()
+        batch = db.update_analysis_batch(batch.id, **fields)
+
+        ingested = None
+        if batch.status in TERMINAL_STATUSES:
+            ingested = ingest_batch_results(batch)
+        else:
+            running += 1
+
+        if on_status:
+            on_status(batch, ingested)
+
+    return running
+
+def wait_for_batches(job_id=None, poll_interval=60, timeout=None, on_status=None):
+    """
+    Poll open batches until all of them have been ingested
+
+    Args:
+        job_id (int): Optionally restrict to the batches of one job
+        poll_interval (float): Seconds between polls
+        timeout (float): Give up after this many seconds (None waits indefinitely)
+        on_status (callable): Passed to poll_batches
+
+    Returns:
+        int: Number of batches still running (0 unless the timeout was hit)
+    """
+    start = time.monotonic()
+    while True:
+        running = poll_batches(job_id, on_status=on_status)
+        if running == 0:
+            return 0
+        if timeout is not None and time.monotonic() - start + poll_interval > timeout:
+            return running
+        time.sleep(poll_interval)
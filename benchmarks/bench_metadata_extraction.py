@@ -0,0 +1,102 @@
+"""
+Benchmark serial vs. process-pool metadata extraction on synthetic EXIF images
+
+Usage:
+    python -m benchmarks.bench_metadata_extraction --count 2000 --workers 1,2,4,8
+
+Pass --database to also time the batched metadata writes (requires DATABASE_URL).
+"""
+import os
+import json
+import time
+import shutil
+import argparse
+import tempfile
+from benchmarks.synthetic_images import generate_images
+from utils import extract_image_metadata, extract_metadata_parallel
+
+def run_serial(paths):
+    """
+    Extract metadata one file at a time, the way the processing loop does
+    """
+    start = time.perf_counter()
+    for file_path in paths:
+        extract_image_metadata(file_path)
+    return time.perf_counter() - start
+
+def run_parallel(paths, workers, chunksize):
+    """
+    Extract metadata with a process pool of the given size
+    """
+    start = time.perf_counter()
+    for _ in extract_metadata_parallel(paths, max_workers=workers, chunksize=chunksize):
+        pass
+    return time.perf_counter() - start
+
+def run_database_write(paths, workers, batch_size):
+    """
+    Extract metadata in parallel and persist it with batched writes
+    """
+    import database as db
+
+    folder_path = os.path.dirname(paths[0])
+    folder = db.add_folder("metadata_benchmark", folder_path)
+
+    start = time.perf_counter()
+    written = db.bulk_upsert_image_metadata(
+        folder.id,
+        extract_metadata_parallel(paths, max_workers=workers),
+        batch_size=batch_size
+    )
+    elapsed = time.perf_counter() - start
+
+    # Remove the benchmark rows again
+    session = db.get_db()
+    session.delete(session.get(db.Folder, folder.id))
+    session.commit()
+
+    return elapsed, written
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--count", type=int, default=1000, help="Number of synthetic images")
+    parser.add_argument("--workers", default="1,2,4", help="Comma separated worker counts to try")
+    parser.add_argument("--chunksize", type=int, default=32, help="Files handed to a worker at a time")
+    parser.add_argument("--size", type=int, nargs=2, default=(640, 480), help="Image width and height")
+    parser.add_argument("--database", action="store_true", help="Also time batched database writes")
+    parser.add_argument("--batch-size", type=int, default=500, help="Images per database batch")
+    parser.add_argument("--output", help="Write results as JSON to this file")
+    args = parser.parse_args()
+
+    corpus_dir = tempfile.mkdtemp(prefix="metadata_bench_")
+    try:
+        print(f"Generating {args.count} synthetic images in {corpus_dir}...")
+        paths = generate_images(corpus_dir, args.count, size=tuple(args.size))
+
+        results = {"count": args.count, "cpu_count": os.cpu_count(), "runs": []}
+
+        serial_time = run_serial(paths)
+        results["runs"].append({"mode": "serial", "workers": 1, "seconds": serial_time})
+        print(f"serial            {serial_time:8.2f}s  {args.count / serial_time:10.1f} img/s")
+
+        for workers in [int(w) for w in args.workers.split(",") if w.strip()]:
+            elapsed = run_parallel(paths, workers, args.chunksize)
+            results["runs"].append({"mode": "parallel", "workers": workers, "seconds": elapsed})
+            print(f"parallel x{workers:<3}     {elapsed:8.2f}s  {args.count / elapsed:10.1f} img/s  "
+                  f"speedup {serial_time / elapsed:5.2f}x")
+
+        if args.database:
+            workers = max(int(w) for w in args.workers.split(","))
+            elapsed, written = run_database_write(paths, workers, args.batch_size)
+            results["runs"].append({"mode": "database", "workers": workers, "seconds": elapsed, "written": written})
+            print(f"extract+write x{workers:<3} {elapsed:8.2f}s  {written / elapsed:10.1f} img/s")
+
+        if args.output:
+            with open(args.output, "w") as f:
+                json.dump(results, f, indent=2)
+            print(f"Results written to {args.output}")
+    finally:
+        shutil.rmtree(corpus_dir, ignore_errors=True)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+"""
+In-process stand-in for the OpenAI client used by image_processor
+
+Returns the same canned analyses as fake_openai_server, without HTTP, and
+simulates latency, failures and the client's automatic retries. Latency and
+failures are derived from the request content and seed, so a run is
+reproducible regardless of thread scheduling.
+
+Usage:
+    from benchmarks.fake_openai_client import FakeOpenAIClient, use_client
+    with use_client(FakeOpenAIClient(latency=0.5, error_rate=0.05)):
+        analyze_image_with_openai(base64_image)
+"""
+import json
+import time
+import random
+import hashlib
+import threading
+from types import SimpleNamespace
+from contextlib import contextmanager
+import openai
+from openai.types.chat import ChatCompletion
+from benchmarks.fake_openai_server import fake_completion
+
+class _RawResponse:
+    """
+    The part of openai's raw response wrapper that image_processor uses
+    """
+    def __init__(self, completion, retries_taken):
+        self._completion = completion
+        self.retries_taken = retries_taken
+
+    def parse(self):
+        return self._completion
+
+class _Completions:
+    def __init__(self, client):
+        self._client = client
+        self.with_raw_response = SimpleNamespace(create=self._create_raw)
+
+    def create(self, **body):
+        return self._create_raw(**body).parse()
+
+    def _create_raw(self, **body):
+        return self._client._complete(body)
+
+class FakeOpenAIClient:
+    """
+    Deterministic fake of openai.OpenAI's chat completions
+
+    Args:
+        latency (float): Mean seconds per attempt
+        jitter (float): Latency varies uniformly by +/- this fraction
+        error_rate (float): Probability that an attempt fails
+        max_retries (int): Failed attempts retried before the error is raised, like the real client
+        seed (int): Changes which requests are slow or fail
+    """
+    def __init__(self, latency=0.0, jitter=0.0, error_rate=0.0, max_retries=2, seed=0):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.max_retries = max_retries
+        self.seed = seed
+        self.chat = SimpleNamespace(completions=_Completions(self))
+        self.requests = 0
+        self.attempts = 0
+        self.failures = 0
+        self.prompt_tokens = 0
+        self._lock = threading.Lock()
+
+    def _complete(self, body):
+        digest = hashlib.sha256(json.dumps(body, sort_keys=True).encode()).hexdigest()
+        with self._lock:
+            self.requests += 1
+
+        for attempt in range(self.max_retries + 1):
+            rng = random.Random(f"{self.seed}:{digest}:{attempt}")
+            delay = self.latency * (1 + self.jitter * (2 * rng.random() - 1))
+            if delay > 0:
+                time.sleep(delay)
+            failed = rng.random() < self.error_rate
+            with self._lock:
+                self.attempts += 1
+                self.failures += failed
+            if not failed:
+                completion = fake_completion(body)
+                with self._lock:
+                    self.prompt_tokens += completion["usage"]["prompt_tokens"]
+                return _RawResponse(ChatCompletion.model_validate(completion), retries_taken=attempt)
+
+        raise openai.OpenAIError(f"Simulated server error after {self.max_retries} retries")
+
+    def stats(self):
+        with self._lock:
+            return {"requests": self.requests, "attempts": self.attempts, "failures": self.failures,
+                    "prompt_tokens": self.prompt_tokens}
+
+@contextmanager
+def use_client(client):
+    """
+    Route image_processor's API calls (and everything built on them) through a client
+    """
+    import image_processor
+
+    original = image_processor.openai_client
+    image_processor.openai_client = client
+    try:
+        yield client
+    finally:
+        image_processor.openai_client = original
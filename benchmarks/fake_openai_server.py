@@ -0,0 +1,250 @@
+"""
+Local stand-in for the OpenAI API endpoints used by the app
+
+Implements chat completions, file upload/download and the Batch API with
+deterministic canned analyses, so batch mode and the ingest pipeline can be
+exercised without network access or an API key.
+
+Usage:
+    python -m benchmarks.fake_openai_server --port 8765
+    OPENAI_BASE_URL=http://127.0.0.1:8765/v1 OPENAI_API_KEY=test python ingest_cli.py ...
+"""
+import re
+import json
+import time
+import uuid
+import hashlib
+import argparse
+import threading
+from email.parser import BytesParser
+from email.policy import default as default_policy
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+OBJECTS = ["Pocket watch", "Typewriter", "Vase", "Camera", "Teapot", "Globe", "Lantern", "Compass"]
+
+def fake_analysis(request_body):
+    """
+    Build a deterministic analysis for a chat completion request body
+    """
+    digest = hashlib.sha256(json.dumps(request_body, sort_keys=True).encode()).digest()
+    object_name = OBJECTS[digest[0] % len(OBJECTS)]
+    return {
+        "object_name": object_name,
+        "description": f"A {object_name.lower()} photographed for the archive. Synthetic description {digest[:4].hex()}.",
+        "confidence": round(0.5 + digest[1] / 512, 2),
+    }
+
+TRIAGE_CATEGORIES = ["photo"] * 6 + ["screenshot", "document", "blank", "artwork"]
+
+def fake_triage(request_body):
+    """
+    Build a deterministic triage for a request body: mostly photos, with
+    some screenshots, documents and low-quality images
+    """
+    analysis = fake_analysis(request_body)
+    digest = hashlib.sha256(json.dumps(request_body, sort_keys=True).encode()).digest()
+    return {
+        "category": TRIAGE_CATEGORIES[digest[2] % len(TRIAGE_CATEGORIES)],
+        "object_name": analysis["object_name"],
+        "summary": f"A {analysis['object_name'].lower()}.",
+        "quality": round(digest[3] / 255, 2),
+        "interest": round(digest[4] / 255, 2),
+        "confidence": analysis["confidence"],
+    }
+
+def _is_triage(request_body):
+    messages = request_body.get("messages", [])
+    return bool(messages) and str(messages[0].get("content", "")).startswith("You triage")
+
+def _image_parts(request_body):
+    return [
+        part for message in request_body.get("messages", []) if isinstance(message.get("content"), list)
+        for part in message["content"] if part.get("type") == "image_url"
+    ]
+
+def fake_completion(request_body):
+    """
+    Build a chat completion response for a request body
+
+    Requests with several images get a "results" list with one numbered
+    analysis per image, as asked for by multi-image prompts, and triage
+    prompts get a triage.
+    """
+    images = _image_parts(request_body)
+    if _is_triage(request_body):
+        content = json.dumps(fake_triage(request_body))
+    elif len(images) > 1:
+        content = json.dumps({"results": [
+            {"image": number, **fake_analysis(part)} for number, part in enumerate(images, start=1)
+        ]})
+    else:
+        content = json.dumps(fake_analysis(request_body))
+    # Roughly what the API charges: 85 tokens per low detail image, 765 for a 1024px high
+    # detail one, and 33x as many on gpt-4o-mini
+    scale = 33 if request_body.get("model") == "gpt-4o-mini" else 1
+    prompt_tokens = 80 + scale * sum(85 if part["image_url"].get("detail") == "low" else 765 for part in images)
+    return {
+        "id": f"chatcmpl-{uuid.uuid4().hex[:12]}",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": request_body.get("model", "gpt-4o"),
+        "choices": [{
+            "index": 0,
+            "finish_reason": "stop",
+            "message": {"role": "assistant", "content": content},
+        }],
+        "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": len(content) // 4,
+                  "total_tokens": prompt_tokens + len(content) // 4},
+    }
+
+class FakeOpenAIState:
+    """
+    In-memory files and batches shared by all request handlers
+    """
+    def __init__(self, batch_delay=0.0, latency=0.0):
+        self.batch_delay = batch_delay
+        self.latency = latency
+        self.files = {}
+        self.batches = {}
+        self.lock = threading.Lock()
+
+    def add_file(self, content, filename, purpose):
+        file_id = f"file-{uuid.uuid4().hex[:24]}"
+        with self.lock:
+            self.files[file_id] = {
+                "id": file_id,
+                "object": "file",
+                "bytes": len(content),
+                "created_at": int(time.time()),
+                "filename": filename,
+                "purpose": purpose,
+                "status": "processed",
+                "content": content,
+            }
+        return file_id
+
+    def create_batch(self, params):
+        batch_id = f"batch_{uuid.uuid4().hex[:24]}"
+        batch = {
+            "id": batch_id,
+            "object": "batch",
+            "endpoint": params["endpoint"],
+            "input_file_id": params["input_file_id"],
+            "completion_window": params.get("completion_window", "24h"),
+            "status": "in_progress",
+            "created_at": int(time.time()),
+            "metadata": params.get("metadata"),
+            "output_file_id": None,
+            "error_file_id": None,
+            "request_counts": {"total": 0, "completed": 0, "failed": 0},
+        }
+        with self.lock:
+            self.batches[batch_id] = batch
+        return batch
+
+    def get_batch(self, batch_id):
+        batch = self.batches[batch_id]
+        if batch["status"] == "in_progress" and time.time() - batch["created_at"] >= self.batch_delay:
+            self._complete_batch(batch)
+        return batch
+
+    def _complete_batch(self, batch):
+        lines = self.files[batch["input_file_id"]]["content"].decode().splitlines()
+        output = []
+        for line in lines:
+            if not line.strip():
+                continue
+            request = json.loads(line)
+            output.append(json.dumps({
+                "id": f"batch_req_{uuid.uuid4().hex[:12]}",
+                "custom_id": request["custom_id"],
+                "response": {"status_code": 200, "request_id": uuid.uuid4().hex, "body": fake_completion(request["body"])},
+                "error": None,
+            }))
+
+        batch["output_file_id"] = self.add_file(("\n".join(output) + "\n").encode(), "batch_output.jsonl", "batch_output")
+        batch["request_counts"] = {"total": len(output), "completed": len(output), "failed": 0}
+        batch["status"] = "completed"
+        batch["completed_at"] = int(time.time())
+
+def make_handler(state):
+    class Handler(BaseHTTPRequestHandler):
+        def _send(self, status, payload, raw=False):
+            body = payload if raw else json.dumps(payload).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/octet-stream" if raw else "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def _body(self):
+            return self.rfile.read(int(self.headers.get("Content-Length", 0)))
+
+        def do_POST(self):
+            if self.path.endswith("/chat/completions"):
+                if state.latency:
+                    time.sleep(state.latency)
+                return self._send(200, fake_completion(json.loads(self._body())))
+
+            if self.path.endswith("/files"):
+                message = BytesParser(policy=default_policy).parsebytes(
+                    f"Content-Type: {self.headers['Content-Type']}\r\n\r\n".encode() + self._body()
+                )
+                fields = {}
+                for part in message.iter_parts():
+                    name = part.get_param("name", header="content-disposition")
+                    fields[name] = (part.get_filename(), part.get_payload(decode=True))
+                filename, content = fields["file"]
+                file_id = state.add_file(content, filename, fields["purpose"][1].decode())
+                info = {k: v for k, v in state.files[file_id].items() if k != "content"}
+                return self._send(200, info)
+
+            if self.path.endswith("/batches"):
+                return self._send(200, state.create_batch(json.loads(self._body())))
+
+            self._send(404, {"error": {"message": f"Unknown endpoint {self.path}"}})
+
+        def do_GET(self):
+            match = re.search(r"/files/([^/]+)/content$", self.path)
+            if match and match.group(1) in state.files:
+                return self._send(200, state.files[match.group(1)]["content"], raw=True)
+
+            match = re.search(r"/batches/([^/?]+)$", self.path)
+            if match and match.group(1) in state.batches:
+                return self._send(200, state.get_batch(match.group(1)))
+
+            self._send(404, {"error": {"message": f"Unknown endpoint {self.path}"}})
+
+        def log_message(self, format, *args):
+            pass
+
+    return Handler
+
+def start_server(port=0, batch_delay=0.0, latency=0.0):
+    """
+    Start the stand-in server on a background thread
+
+    Returns:
+        tuple: (server, base_url) -- call server.shutdown() to stop it
+    """
+    state = FakeOpenAIState(batch_delay=batch_delay, latency=latency)
+    server = ThreadingHTTPServer(("127.0.0.1", port), make_handler(state))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}/v1"
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--batch-delay", type=float, default=0.0, help="Seconds before a batch completes")
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds added to each chat completion")
+    args = parser.parse_args()
+
+    server, base_url = start_server(args.port, args.batch_delay, args.latency)
+    print(f"Fake OpenAI API listening on {base_url}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,349 @@
+"""
+Offline benchmark suite: every scenario runs against a synthetic corpus, a
+temporary database and a fake vision backend, so no API key or network is needed
+
+Usage:
+    python -m benchmarks.run_benchmarks --count 300 --output results.json
+    python -m benchmarks.run_benchmarks --scenarios ingest,search --latency 0.5 --error-rate 0.05
+    python -m benchmarks.run_benchmarks --output new.json --compare results.json
+
+Scenarios: scan, metadata, ingest, search, dashboard, clustering, export.
+Results are written as JSON; --compare prints the change against an earlier
+results file and flags scenarios that got slower than --regression-threshold.
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import platform
+import argparse
+import tempfile
+import subprocess
+import statistics
+from benchmarks.synthetic_images import generate_images, FORMATS
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+SCENARIOS = ["scan", "metadata", "ingest", "search", "dashboard", "clustering", "export"]
+
+# Scenarios that read analyzed images from the database
+NEEDS_INGEST = {"search", "dashboard", "clustering", "export"}
+
+def summarize(samples, items=1):
+    """
+    Summarize repeated timings of one operation
+
+    Args:
+        samples (list): Seconds taken by each repetition
+        items (int): Items handled per repetition
+    """
+    ordered = sorted(samples)
+    seconds = statistics.median(ordered)
+    return {
+        "repeat": len(ordered),
+        "items": items,
+        "seconds": round(seconds, 6),
+        "p95_seconds": round(ordered[min(len(ordered) - 1, int(0.95 * len(ordered)))], 6),
+        "items_per_second": round(items / seconds, 3) if seconds > 0 else None,
+    }
+
+def measure(func, repeat=3, items=1):
+    """
+    Time func() repeat times
+    """
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        samples.append(time.perf_counter() - start)
+    return summarize(samples, items)
+
+# Scenarios
+
+def bench_scan(ctx):
+    from utils import get_all_image_files
+
+    files = get_all_image_files(ctx["corpus_dir"])
+    return {"list_folder": measure(lambda: get_all_image_files(ctx["corpus_dir"]), ctx["repeat"], len(files))}
+
+def bench_metadata(ctx):
+    from utils import extract_image_metadata, extract_metadata_parallel
+
+    paths = ctx["paths"]
+    results = {
+        "serial": measure(lambda: [extract_image_metadata(path) for path in paths], 1, len(paths)),
+        "parallel": measure(lambda: list(extract_metadata_parallel(paths, max_workers=ctx["workers"])), 1, len(paths)),
+    }
+
+    # How much of the EXIF written into each format is read back
+    coverage = {}
+    for image_format, (_, extension, _) in FORMATS.items():
+        sample = [path for path in paths if path.endswith(extension)][:50]
+        if sample:
+            extracted = [extract_image_metadata(path) for path in sample]
+            coverage[image_format] = {
+                "files": len(sample),
+                "camera": round(sum(bool(m["camera_make"]) for m in extracted) / len(sample), 3),
+                "date": round(sum(m["date_taken"] is not None for m in extracted) / len(sample), 3),
+                "gps": round(sum(m["gps_latitude"] is not None for m in extracted) / len(sample), 3),
+            }
+    results["exif_coverage"] = coverage
+    return results
+
+def run_ingest(ctx):
+    """
+    Ingest the corpus through the pipeline with the fake vision backend
+    """
+    from ingest_pipeline import IngestPipeline
+    from vision_providers import OpenAIProvider
+    from benchmarks.fake_openai_client import FakeOpenAIClient, use_client
+
+    client = FakeOpenAIClient(latency=ctx["latency"], jitter=0.5, error_rate=ctx["error_rate"], seed=ctx["seed"])
+    # Let every analyze worker call the fake API at once
+    provider = OpenAIProvider(max_concurrency=ctx["analyze_workers"])
+    pipeline = IngestPipeline(analyze_workers=ctx["analyze_workers"], metadata_workers=ctx["workers"],
+                              skip_existing=False, provider=provider,
+                              images_per_request=ctx["images_per_request"])
+    with use_client(client):
+        start = time.perf_counter()
+        results = pipeline.run([("benchmark", ctx["corpus_dir"], ctx["paths"])])
+        elapsed = time.perf_counter() - start
+
+    failed = sum("error" in result for result in results)
+    return {
+        "pipeline": {**summarize([elapsed], len(results)), "failed": failed},
+        "bottleneck": pipeline.bottleneck(),
+        "stages": pipeline.metrics(),
+        "api": client.stats(),
+    }
+
+def bench_ingest(ctx):
+    return run_ingest(ctx)
+
+def bench_search(ctx):
+    import database as db
+    from semantic_search import semantic_search, sync_index
+    from benchmarks.fake_openai_server import OBJECTS
+
+    queries = [name.split()[-1].lower() for name in OBJECTS]
+    camera = db.get_db().query(db.Image.camera_make).filter(db.Image.camera_make != "").first()
+    sync_index()
+    return {
+        "keyword": measure(lambda: [db.search_images(query) for query in queries], ctx["repeat"], len(queries)),
+        "faceted": measure(lambda: db.search_images_faceted(camera_make=[camera[0]] if camera else None),
+                           ctx["repeat"]),
+        "semantic": measure(lambda: [semantic_search(query, k=20) for query in queries], ctx["repeat"], len(queries)),
+    }
+
+def _render_page(page):
+    """
+    Render one page of the app in-process with Streamlit's test runner
+    """
+    from streamlit.testing.v1 import AppTest
+
+    app = AppTest.from_file(os.path.join(REPO_ROOT, "app.py"), default_timeout=300)
+    app.session_state["current_page"] = page
+    app.session_state["first_launch"] = False
+    app.run()
+    if app.exception:
+        raise RuntimeError(f"{page} page failed: {app.exception[0].value}")
+    return app
+
+def bench_dashboard(ctx):
+    # The app reads custom_styles.css relative to the working directory
+    cwd = os.getcwd()
+    os.chdir(REPO_ROOT)
+    try:
+        app = _render_page("dashboard")
+        return {"render": measure(app.run, ctx["repeat"])}
+    finally:
+        os.chdir(cwd)
+
+def bench_clustering(ctx):
+    import database as db
+    from image_clustering import cluster_images
+
+    images = db.get_db().query(db.Image).filter(db.Image.description.isnot(None)).all()
+    return {"cluster": measure(lambda: cluster_images(images, n_clusters=5), 1, len(images))}
+
+def bench_export(ctx):
+    import pandas as pd
+    import database as db
+    from export_utils import export_to_csv, export_to_excel, export_to_pdf_simple, export_to_pdf_detailed
+
+    results_df = pd.DataFrame([{
+        "file_name": img.file_name,
+        "file_path": img.file_path,
+        "object_name": img.object_name,
+        "description": img.description,
+        "confidence": img.confidence,
+    } for img in db.get_db().query(db.Image).filter(db.Image.description.isnot(None))])
+
+    # Exports are written to the working directory
+    cwd = os.getcwd()
+    os.chdir(ctx["work_dir"])
+    try:
+        return {
+            "csv": measure(lambda: export_to_csv(results_df, "benchmark"), ctx["repeat"], len(results_df)),
+            "excel": measure(lambda: export_to_excel(results_df, "benchmark"), 1, len(results_df)),
+            "pdf_simple": measure(lambda: export_to_pdf_simple(results_df, "benchmark"), 1, len(results_df)),
+            "pdf_detailed": measure(lambda: export_to_pdf_detailed(results_df, "benchmark", include_images=False),
+                                    1, len(results_df)),
+        }
+    finally:
+        os.chdir(cwd)
+
+BENCHMARKS = {
+    "scan": bench_scan,
+    "metadata": bench_metadata,
+    "ingest": bench_ingest,
+    "search": bench_search,
+    "dashboard": bench_dashboard,
+    "clustering": bench_clustering,
+    "export": bench_export,
+}
+
+# Reporting
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_ROOT,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except Exception:
+        return None
+
+def timed_operations(results):
+    """
+    Yield (scenario, operation, summary) for every timed operation in a results file
+    """
+    for scenario, operations in results.get("scenarios", {}).items():
+        for operation, summary in operations.items():
+            if isinstance(summary, dict) and "seconds" in summary:
+                yield scenario, operation, summary
+
+def compare(results, baseline, threshold):
+    """
+    Print each operation's change against a baseline
+
+    Returns:
+        list: (scenario, operation) pairs that are slower by more than threshold
+    """
+    previous = {(scenario, operation): summary for scenario, operation, summary in timed_operations(baseline)}
+    regressions = []
+    print(f"\nCompared with {baseline.get('git_commit') or 'baseline'} ({baseline.get('started_at')}):")
+    for scenario, operation, summary in timed_operations(results):
+        before = previous.get((scenario, operation))
+        if not before or not before["seconds"]:
+            continue
+        change = summary["seconds"] / before["seconds"] - 1
+        flag = ""
+        if change > threshold:
+            flag = "  REGRESSION"
+            regressions.append((scenario, operation))
+        print(f"  {scenario + '.' + operation:<24} {before['seconds']:10.4f}s -> {summary['seconds']:10.4f}s  "
+              f"{change:+7.1%}{flag}")
+    return regressions
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS), help="Comma separated scenarios to run")
+    parser.add_argument("--count", type=int, default=300, help="Number of synthetic images")
+    parser.add_argument("--formats", default="jpeg,png,heic", help="Image formats in the corpus")
+    parser.add_argument("--size", type=int, nargs=2, default=(640, 480), help="Image width and height")
+    parser.add_argument("--corpus-dir", help="Reuse (or create) the corpus here instead of a temporary directory")
+    parser.add_argument("--seed", type=int, default=42, help="Seed for the corpus and the fake backend")
+    parser.add_argument("--repeat", type=int, default=5, help="Repetitions of the quick operations")
+    parser.add_argument("--workers", type=int, default=min(4, os.cpu_count() or 1), help="Metadata processes")
+    parser.add_argument("--analyze-workers", type=int, default=8, help="Concurrent fake API requests")
+    parser.add_argument("--images-per-request", type=int, default=1, help="Images packed into each fake API request")
+    parser.add_argument("--latency", type=float, default=0.05, help="Mean seconds per fake API request")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Probability a fake API attempt fails")
+    parser.add_argument("--database-url", help="Database to use (defaults to a temporary SQLite file)")
+    parser.add_argument("--output", help="Write results as JSON to this file")
+    parser.add_argument("--compare", metavar="RESULTS", help="Earlier results file to compare against")
+    parser.add_argument("--regression-threshold", type=float, default=0.2,
+                        help="Fractional slowdown reported as a regression")
+    args = parser.parse_args(argv)
+
+    scenarios = [name.strip() for name in args.scenarios.split(",") if name.strip()]
+    unknown = set(scenarios) - set(BENCHMARKS)
+    if unknown:
+        parser.error(f"unknown scenarios: {', '.join(sorted(unknown))}")
+    formats = tuple(name.strip() for name in args.formats.split(",") if name.strip())
+
+    work_dir = tempfile.mkdtemp(prefix="ai_imager_bench_")
+    # Point the app at throwaway storage before any app module is imported
+    os.environ["DATABASE_URL"] = args.database_url or f"sqlite:///{os.path.join(work_dir, 'bench.db')}"
+    os.environ["SEMANTIC_INDEX_DIR"] = os.path.join(work_dir, "semantic_index")
+    os.environ.setdefault("OPENAI_API_KEY", "offline-benchmark")
+    if REPO_ROOT not in sys.path:
+        sys.path.insert(0, REPO_ROOT)
+
+    corpus_dir = args.corpus_dir or os.path.join(work_dir, "corpus")
+    try:
+        existing = sorted(os.listdir(corpus_dir)) if os.path.isdir(corpus_dir) else []
+        if len(existing) >= args.count:
+            paths = [os.path.join(corpus_dir, name) for name in existing[:args.count]]
+            print(f"Reusing {len(paths)} images in {corpus_dir}", file=sys.stderr)
+        else:
+            print(f"Generating {args.count} synthetic images ({', '.join(formats)}) in {corpus_dir}...", file=sys.stderr)
+            start = time.perf_counter()
+            paths = generate_images(corpus_dir, args.count, size=tuple(args.size), seed=args.seed,
+                                    formats=formats, scenes=True)
+            print(f"Generated in {time.perf_counter() - start:.1f}s", file=sys.stderr)
+
+        ctx = {
+            "corpus_dir": corpus_dir,
+            "paths": paths,
+            "work_dir": work_dir,
+            "repeat": args.repeat,
+            "workers": args.workers,
+            "analyze_workers": args.analyze_workers,
+            "images_per_request": args.images_per_request,
+            "latency": args.latency,
+            "error_rate": args.error_rate,
+            "seed": args.seed,
+        }
+        results = {
+            "started_at": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "git_commit": git_commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "config": {key: value for key, value in vars(args).items() if key not in ("output", "compare")},
+            "scenarios": {},
+        }
+
+        if NEEDS_INGEST & set(scenarios) and "ingest" not in scenarios:
+            print("Ingesting the corpus for the database scenarios...", file=sys.stderr)
+            run_ingest(ctx)
+
+        for name in scenarios:
+            print(f"Running {name}...", file=sys.stderr)
+            try:
+                results["scenarios"][name] = BENCHMARKS[name](ctx)
+            except Exception as e:
+                results["scenarios"][name] = {"error": str(e)}
+                print(f"Error in {name} benchmark: {str(e)}", file=sys.stderr)
+
+        for scenario, operation, summary in timed_operations(results):
+            rate = f"{summary['items_per_second']:10.1f} items/s" if summary["items_per_second"] else ""
+            print(f"{scenario + '.' + operation:<24} {summary['seconds']:10.4f}s  p95 {summary['p95_seconds']:10.4f}s  {rate}")
+
+        if args.output:
+            with open(args.output, "w") as f:
+                json.dump(results, f, indent=2, default=str)
+            print(f"Results written to {args.output}")
+
+        if args.compare:
+            with open(args.compare) as f:
+                regressions = compare(results, json.load(f), args.regression_threshold)
+            if regressions:
+                return 1
+        return 0
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,145 @@
+import os
+import random
+import datetime
+from PIL import Image, ImageDraw
+from PIL.TiffImagePlugin import IFDRational
+from pillow_heif import register_heif_opener
+
+# Lets Pillow write (and read) HEIC files
+register_heif_opener()
+
+# EXIF tag ids
+TAG_MAKE = 0x010F
+TAG_MODEL = 0x0110
+TAG_EXIF_IFD = 0x8769
+TAG_GPS_IFD = 0x8825
+TAG_DATE_TIME_ORIGINAL = 0x9003
+TAG_FOCAL_LENGTH = 0x920A
+TAG_F_NUMBER = 0x829D
+TAG_ISO_SPEED = 0x8827
+TAG_EXPOSURE_TIME = 0x829A
+TAG_GPS_LATITUDE_REF = 1
+TAG_GPS_LATITUDE = 2
+TAG_GPS_LONGITUDE_REF = 3
+TAG_GPS_LONGITUDE = 4
+
+CAMERAS = [
+    ("Canon", "Canon EOS 5D Mark IV"),
+    ("NIKON CORPORATION", "NIKON D850"),
+    ("SONY", "ILCE-7M3"),
+    ("Apple", "iPhone 14 Pro"),
+    ("Google", "Pixel 7"),
+]
+
+# Output format -> (Pillow format name, file extension, save options)
+FORMATS = {
+    "jpeg": ("JPEG", ".jpg", {"quality": 85}),
+    "png": ("PNG", ".png", {}),
+    "heic": ("HEIF", ".heic", {"quality": 80}),
+}
+
+def _to_dms(value):
+    """
+    Convert decimal degrees to an EXIF degrees/minutes/seconds rational triple
+    """
+    value = abs(value)
+    degrees = int(value)
+    minutes = int((value - degrees) * 60)
+    seconds = round((value - degrees - minutes / 60) * 3600 * 100)
+    return (IFDRational(degrees, 1), IFDRational(minutes, 1), IFDRational(seconds, 100))
+
+def build_exif(rng, with_gps=True):
+    """
+    Build a realistic EXIF block with camera, exposure, date and GPS tags
+
+    Args:
+        rng: random.Random instance used to pick the values
+        with_gps (bool): Whether to include GPS coordinates
+
+    Returns:
+        PIL.Image.Exif: EXIF data ready to be passed to Image.save
+    """
+    exif = Image.Exif()
+    make, model = rng.choice(CAMERAS)
+    exif[TAG_MAKE] = make
+    exif[TAG_MODEL] = model
+
+    taken = datetime.datetime(2015, 1, 1) + datetime.timedelta(seconds=rng.randrange(10 * 365 * 24 * 3600))
+    exif_ifd = exif.get_ifd(TAG_EXIF_IFD)
+    exif_ifd[TAG_DATE_TIME_ORIGINAL] = taken.strftime('%Y:%m:%d %H:%M:%S')
+    exif_ifd[TAG_FOCAL_LENGTH] = IFDRational(rng.choice([24, 35, 50, 85, 135]), 1)
+    exif_ifd[TAG_F_NUMBER] = IFDRational(rng.choice([14, 18, 28, 40, 56, 80]), 10)
+    exif_ifd[TAG_ISO_SPEED] = rng.choice([100, 200, 400, 800, 1600])
+    exif_ifd[TAG_EXPOSURE_TIME] = IFDRational(1, rng.choice([30, 60, 125, 250, 1000]))
+
+    if with_gps:
+        latitude = rng.uniform(-80, 80)
+        longitude = rng.uniform(-180, 180)
+        gps_ifd = exif.get_ifd(TAG_GPS_IFD)
+        gps_ifd[TAG_GPS_LATITUDE_REF] = 'N' if latitude >= 0 else 'S'
+        gps_ifd[TAG_GPS_LATITUDE] = _to_dms(latitude)
+        gps_ifd[TAG_GPS_LONGITUDE_REF] = 'E' if longitude >= 0 else 'W'
+        gps_ifd[TAG_GPS_LONGITUDE] = _to_dms(longitude)
+
+    return exif
+
+def draw_scene(rng, size):
+    """
+    Draw a background gradient with a few random shapes, so images differ in
+    structure (and perceptual hash) rather than only in colour
+    """
+    width, height = size
+    start = [rng.randrange(256) for _ in range(3)]
+    end = [rng.randrange(256) for _ in range(3)]
+    gradient = Image.linear_gradient("L").resize(size)
+    img = Image.merge("RGB", [
+        gradient.point(lambda v, a=a, b=b: a + (b - a) * v // 255) for a, b in zip(start, end)
+    ])
+
+    draw = ImageDraw.Draw(img)
+    for _ in range(rng.randint(2, 6)):
+        x0, x1 = sorted(rng.randrange(width) for _ in range(2))
+        y0, y1 = sorted(rng.randrange(height) for _ in range(2))
+        fill = (rng.randrange(256), rng.randrange(256), rng.randrange(256))
+        shape = draw.ellipse if rng.random() < 0.5 else draw.rectangle
+        shape((x0, y0, x1 + 1, y1 + 1), fill=fill)
+    return img
+
+def generate_images(output_dir, count, size=(640, 480), seed=42, gps_ratio=0.8, formats=("jpeg",), scenes=False):
+    """
+    Write a corpus of synthetic EXIF-bearing images
+
+    Args:
+        output_dir (str): Directory the images are written to (created if needed)
+        count (int): Number of images to generate
+        size (tuple): Width and height of each image
+        seed (int): Seed for the random generator so corpora are reproducible
+        gps_ratio (float): Fraction of images that carry GPS coordinates
+        formats (tuple): Formats to write, in rotation (see FORMATS)
+        scenes (bool): Draw gradients and shapes instead of a flat colour
+
+    Returns:
+        list: Paths of the generated images
+    """
+    for image_format in formats:
+        if image_format not in FORMATS:
+            raise ValueError(f"Unsupported synthetic image format: {image_format}")
+
+    os.makedirs(output_dir, exist_ok=True)
+    rng = random.Random(seed)
+    paths = []
+
+    for i in range(count):
+        if scenes:
+            img = draw_scene(rng, size)
+        else:
+            color = (rng.randrange(256), rng.randrange(256), rng.randrange(256))
+            img = Image.new("RGB", size, color)
+        exif = build_exif(rng, with_gps=rng.random() < gps_ratio)
+
+        pil_format, extension, options = FORMATS[formats[i % len(formats)]]
+        file_path = os.path.join(output_dir, f"synthetic_{i:06d}{extension}")
+        img.save(file_path, pil_format, exif=exif.tobytes(), **options)
+        paths.append(file_path)
+
+    return paths
@@ -1,25 +1,7 @@
-import streamlit as st
+from comparison_tool import show_comparison_page as show_comparison_tool
 
 def show_comparison_page():
     """
-    Display image comparison functionality (placeholder for future implementation)
+    Display the image comparison tool
     """
-    st.markdown("""
-    <div class="card">
-        <div class="card-header">
-            <h2>Image Comparison</h2>
-            <p>This feature is coming soon!</p>
-        </div>
-    </div>
-    """, unsafe_allow_html=True)
-    
-    st.info("Image comparison functionality will be available in a future update.")
-    
-    st.markdown("""
-    ### Upcoming Features:
-    
-    * Compare two or more images side by side
-    * Highlight similarities and differences between images
-    * Compare metadata and AI analysis results
-    * Generate comparison reports
-    """)
\ No newline at end of file
+    show_comparison_tool()
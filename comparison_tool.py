@@ -1,9 +1,16 @@
 
 import streamlit as st
 import os
+import re
+import threading
+from collections import OrderedDict
+from functools import lru_cache
+import numpy as np
 import pandas as pd
+import altair as alt
 from database import get_db, Image, Folder
-import difflib
+from image_similarity import DEFAULT_WEIGHTS, analyze_similarity, ensure_dhashes
+from query_cache import QueryCache
 
 def show_comparison_page():
     """
@@ -19,8 +26,8 @@ def show_comparison_page():
     """, unsafe_allow_html=True)
     
     # Get all images from database
-    db_session = next(get_db())
-    all_images = db_session.query(Image).all()
+    db_session = get_db()
+    all_images = db_session.query(Image).filter(Image.description.isnot(None)).all()
     
     if not all_images:
         st.info("No images available for comparison. Process some images first.")
@@ -29,6 +36,13 @@ def show_comparison_page():
     # Get images by folders for better organization
     folders = db_session.query(Folder).all()
     
+    # Comparison mode
+    batch_mode = st.radio(
+        "Comparison mode",
+        ["Side by side (2-4 images)", "Batch (groups of near-identical images)"],
+        horizontal=True
+    ) != "Side by side (2-4 images)"
+    
     # Image selection
     st.subheader("Select Images to Compare")
     
@@ -37,15 +51,15 @@ def show_comparison_page():
     
     if use_folder_filter and folders:
         # Create folder selection
-        folder_options = [(f.id, f.name) for f in folders]
+        folder_names = {f.id: f.name for f in folders}
         selected_folder_id = st.selectbox(
             "Select Folder",
-            options=[f[0] for f in folder_options],
-            format_func=lambda x: next((f[1] for f in folder_options if f[0] == x), "")
+            options=list(folder_names),
+            format_func=lambda x: folder_names[x]
         )
         
         # Filter images by folder
-        available_images = db_session.query(Image).filter(Image.folder_id == selected_folder_id).all()
+        available_images = [img for img in all_images if img.folder_id == selected_folder_id]
     else:
         available_images = all_images
     
@@ -75,50 +89,221 @@ def show_comparison_page():
         hide_index=True
     )
     
-    # Multi-select images
-    selected_image_ids = st.multiselect(
-        "Select 2-4 images to compare",
-        options=image_df["id"].tolist(),
-        format_func=lambda x: f"{image_df[image_df['id'] == x]['file_name'].iloc[0]} ({image_df[image_df['id'] == x]['object_name'].iloc[0]})",
-        max_selections=4
-    )
+    image_labels = {img["id"]: f"{img['file_name']} ({img['object_name']})" for img in image_data}
+    images_by_id = {img.id: img for img in available_images}
+    
+    if batch_mode:
+        if st.checkbox("Compare all images in the selection", value=True):
+            selected_image_ids = list(image_labels)[:MAX_BATCH_IMAGES]
+            if len(image_labels) > MAX_BATCH_IMAGES:
+                st.warning(f"Only the first {MAX_BATCH_IMAGES} images are compared")
+        else:
+            selected_image_ids = st.multiselect(
+                f"Select 2-{MAX_BATCH_SELECTION} images to compare",
+                options=list(image_labels),
+                format_func=lambda x: image_labels[x],
+                max_selections=MAX_BATCH_SELECTION
+            )
+    else:
+        # Multi-select images
+        selected_image_ids = st.multiselect(
+            "Select 2-4 images to compare",
+            options=list(image_labels),
+            format_func=lambda x: image_labels[x],
+            max_selections=4
+        )
     
     # Proceed with comparison
     if len(selected_image_ids) >= 2:
-        # Get selected images
-        selected_images = [
-            db_session.query(Image).filter(Image.id == img_id).first()
-            for img_id in selected_image_ids
-        ]
+        selected_images = [images_by_id[img_id] for img_id in selected_image_ids]
         
-        show_image_comparison(selected_images)
+        if batch_mode:
+            show_batch_comparison(selected_images)
+        else:
+            show_image_comparison(selected_images)
     elif selected_image_ids:
         st.warning("Please select at least 2 images to compare.")
 
-def find_differences(text1, text2):
+# Pair comparisons are reused across reruns and between the N-way views
+_pair_cache = OrderedDict()
+_pair_cache_lock = threading.Lock()
+MAX_CACHED_PAIRS = 4096
+
+# Batch comparison limits for picking images by hand and for whole folders
+MAX_BATCH_SELECTION = 50
+MAX_BATCH_IMAGES = 10000
+
+# Files that could not be fingerprinted, so they are not retried on every rerun
+_unhashable = set()
+
+# All-pairs results are reused while the weights and threshold stay the same
+similarity_cache = QueryCache(max_entries=8, ttl_seconds=600, name="similarity")
+
+_TOKEN_PATTERN = re.compile(r"\S+")
+_STRIP_CHARS = ".,;:!?\"'()[]{}"
+
+@lru_cache(maxsize=2048)
+def tokenize(text):
     """
-    Find and highlight differences between two text strings
+    Split a description into words once
+    
+    Returns:
+        tuple: (spans, words) where spans are the (start, end) offsets of each word
+            in the text and words are their normalized forms ('' for punctuation-only words)
+    """
+    spans = []
+    words = []
+    for match in _TOKEN_PATTERN.finditer(text or ""):
+        spans.append(match.span())
+        words.append(match.group().strip(_STRIP_CHARS).lower())
+    return tuple(spans), tuple(words)
+
+def _token_ids(word_lists):
+    """
+    Number the words of the texts being compared, so they can be counted as integers
+    
+    The vocabulary only covers these texts, so count vectors are sized to the
+    comparison rather than to every description seen before.
+    
+    Returns:
+        tuple: (token ID array per text, -1 for punctuation-only words; vocabulary size)
+    """
+    vocabulary = {}
+    token_ids = [
+        np.array([vocabulary.setdefault(word, len(vocabulary)) if word else -1 for word in words], dtype=np.int64)
+        for words in word_lists
+    ]
+    return token_ids, len(vocabulary)
+
+def _counts(ids, minlength):
+    return np.bincount(ids[ids >= 0], minlength=minlength)
+
+def _compare_tokens(text1, text2):
+    """
+    Compare two descriptions as word multisets in linear time
+    
+    Returns:
+        dict: similarity (Dice coefficient of the word multisets) and, for each text,
+            a boolean mask of the words that have no counterpart in the other text
+    """
+    (ids1, ids2), size = _token_ids([tokenize(text1)[1], tokenize(text2)[1]])
+    counts1 = _counts(ids1, size)
+    counts2 = _counts(ids2, size)
+    
+    shared = np.minimum(counts1, counts2)
+    total = counts1.sum() + counts2.sum()
+    similarity = 2.0 * shared.sum() / total if total else 1.0
+    
+    return {
+        "similarity": float(similarity),
+        "unmatched1": _unmatched(ids1, shared),
+        "unmatched2": _unmatched(ids2, shared),
+    }
+
+def _unmatched(ids, shared):
+    """
+    Mark the words in excess of the shared count, leaving the first occurrences matched
+    """
+    unmatched = np.zeros(len(ids), dtype=bool)
+    if len(ids) == 0:
+        return unmatched
+    valid = ids >= 0
+    # Occurrence number of each word within the text (0 for the first)
+    order = np.argsort(ids, kind="stable")
+    sorted_ids = ids[order]
+    starts = np.r_[0, np.flatnonzero(np.diff(sorted_ids)) + 1]
+    run_start = np.repeat(starts, np.diff(np.r_[starts, len(ids)]))
+    occurrence = np.empty(len(ids), dtype=np.int64)
+    occurrence[order] = np.arange(len(ids)) - run_start
+    unmatched[valid] = occurrence[valid] >= shared[ids[valid]]
+    return unmatched
+
+def compare_descriptions(text1, text2, key=None):
+    """
+    Compare two descriptions, caching the result for the pair
+    
+    Args:
+        text1: First description
+        text2: Second description
+        key: Optional pair identifier (e.g. the two image IDs) used for the cache
+        
+    Returns:
+        dict: similarity, unmatched1 and unmatched2 (see _compare_tokens)
     """
-    d = difflib.Differ()
-    diff = list(d.compare(text1.split(), text2.split()))
+    cache_key = (key, hash(text1), hash(text2))
+    with _pair_cache_lock:
+        result = _pair_cache.get(cache_key)
+        if result is not None:
+            _pair_cache.move_to_end(cache_key)
+            return result
     
-    added = [word[2:] for word in diff if word.startswith('+ ')]
-    removed = [word[2:] for word in diff if word.startswith('- ')]
+    result = _compare_tokens(text1, text2)
+    with _pair_cache_lock:
+        _pair_cache[cache_key] = result
+        while len(_pair_cache) > MAX_CACHED_PAIRS:
+            _pair_cache.popitem(last=False)
+    return result
+
+def find_differences(text1, text2):
+    """
+    Find and highlight differences between two text strings
     
+    Returns:
+        tuple: (added, removed) -- words of text2 missing from text1, and words of text1 missing from text2
+    """
+    result = compare_descriptions(text1, text2)
+    spans1, _ = tokenize(text1)
+    spans2, _ = tokenize(text2)
+    added = [text2[start:end] for (start, end), unmatched in zip(spans2, result["unmatched2"]) if unmatched]
+    removed = [text1[start:end] for (start, end), unmatched in zip(spans1, result["unmatched1"]) if unmatched]
     return added, removed
 
-def highlight_differences(text1, text2):
+def highlight_differences(text1, text2, key=None):
     """
     Return text1 with differences highlighted
+    
+    Built in a single pass over text1's words; words of three characters or
+    fewer are not highlighted.
+    """
+    result = compare_descriptions(text1, text2, key)
+    spans, _ = tokenize(text1)
+    
+    parts = []
+    position = 0
+    for (start, end), unmatched in zip(spans, result["unmatched1"]):
+        if unmatched and end - start > 3:  # Avoid highlighting short words
+            parts.append(text1[position:start])
+            parts.append(f"<span style='background-color: #FFCCCB'>{text1[start:end]}</span>")
+            position = end
+    parts.append(text1[position:])
+    return "".join(parts)
+
+def description_similarity(text1, text2, key=None):
     """
-    added, removed = find_differences(text1, text2)
+    Similarity of two descriptions between 0 and 1 (Dice coefficient of their words)
+    """
+    return compare_descriptions(text1, text2, key)["similarity"]
+
+def similarity_matrix(descriptions):
+    """
+    Pairwise description similarity for many descriptions at once
     
-    highlighted_text = text1
-    for word in removed:
-        if len(word) > 3:  # Avoid highlighting short words
-            highlighted_text = highlighted_text.replace(f" {word} ", f" <span style='background-color: #FFCCCB'>{word}</span> ")
+    Args:
+        descriptions: List of description strings
+        
+    Returns:
+        numpy.ndarray: n x n matrix of Dice similarities
+    """
+    token_ids, size = _token_ids([tokenize(text or "")[1] for text in descriptions])
+    counts = np.stack([_counts(ids, size) for ids in token_ids]) if token_ids else np.zeros((0, 0))
+    totals = counts.sum(axis=1)
     
-    return highlighted_text
+    matrix = np.ones((len(descriptions), len(descriptions)))
+    for i in range(len(descriptions)):
+        shared = np.minimum(counts[i], counts).sum(axis=1)
+        denominator = totals[i] + totals
+        matrix[i] = np.where(denominator > 0, 2.0 * shared / np.maximum(denominator, 1), 1.0)
+    return matrix
 
 def show_image_comparison(images):
     """
@@ -177,18 +362,24 @@ def show_image_comparison(images):
             
             if highlight_diffs and i > 0:
                 # Highlight differences compared to previous description
-                highlighted_desc = highlight_differences(img.description, images[i-1].description)
+                highlighted_desc = highlight_differences(img.description, images[i-1].description,
+                                                         key=(img.id, images[i-1].id))
                 st.markdown(highlighted_desc, unsafe_allow_html=True)
             else:
                 st.markdown(img.description)
             
             st.markdown("---")
         
-        # Show similarity score
+        # Show similarity scores
         if len(images) == 2:
-            from difflib import SequenceMatcher
-            similarity = SequenceMatcher(None, images[0].description, images[1].description).ratio()
+            similarity = description_similarity(images[0].description, images[1].description,
+                                                key=(images[0].id, images[1].id))
             st.metric("Description Similarity", f"{similarity:.2%}")
+        else:
+            labels = [f"Image {i+1}" for i in range(len(images))]
+            matrix = similarity_matrix([img.description for img in images])
+            st.markdown("**Description Similarity**")
+            st.dataframe(pd.DataFrame(matrix, index=labels, columns=labels).style.format("{:.0%}"))
     
     with tab3:
         # Compare metadata if available
@@ -219,3 +410,97 @@ def show_image_comparison(images):
             st.dataframe(pd.DataFrame(metadata_rows))
         else:
             st.info("No metadata available for comparison")
+
+def show_batch_comparison(images):
+    """
+    Display all-pairs similarity and groups of near-identical images for a batch
+    """
+    st.subheader(f"Batch Comparison ({len(images)} images)")
+    
+    col1, col2, col3, col4 = st.columns(4)
+    weights = {
+        "description": col1.slider("Description weight", 0.0, 1.0, DEFAULT_WEIGHTS["description"], 0.05),
+        "metadata": col2.slider("Metadata weight", 0.0, 1.0, DEFAULT_WEIGHTS["metadata"], 0.05),
+        "visual": col3.slider("Visual weight", 0.0, 1.0, DEFAULT_WEIGHTS["visual"], 0.05),
+    }
+    threshold = col4.slider("Group threshold", 0.5, 1.0, 0.9, 0.01)
+    
+    if not any(weights.values()):
+        st.warning("Set at least one weight above zero")
+        return
+    
+    # Images analyzed before perceptual hashes were stored need them computed once
+    missing = [img for img in images if not img.dhash and img.file_path not in _unhashable]
+    if missing and weights["visual"]:
+        with st.spinner(f"Computing visual fingerprints for {len(missing)} images..."):
+            ensure_dhashes(missing)
+        _unhashable.update(img.file_path for img in missing if not img.dhash)
+    
+    # Keep similar descriptions next to each other in the heatmap
+    images = sorted(images, key=lambda img: (img.object_name or "", img.file_name))
+    names = [img.file_name for img in images]
+    
+    key = (tuple(img.id for img in images), tuple(sorted(weights.items())), threshold)
+    with st.spinner("Comparing images..."):
+        result = similarity_cache.get_or_compute(key, lambda: analyze_similarity(images, weights, threshold))
+    
+    # Heatmap; large batches are averaged into tiles of neighbouring images
+    tile_starts = list(result["tile_starts"]) + [len(images)]
+    labels = [
+        f"{start + 1}. {names[start]}" if end - start == 1 else f"{start + 1}-{end}. {names[start]} ..."
+        for start, end in zip(tile_starts, tile_starts[1:])
+    ]
+    heatmap = result["heatmap"]
+    heatmap_df = pd.DataFrame({
+        "Image A": np.repeat(labels, len(labels)),
+        "Image B": np.tile(labels, len(labels)),
+        "Similarity": heatmap.ravel(),
+    })
+    chart = alt.Chart(heatmap_df).mark_rect().encode(
+        x=alt.X("Image A:N", sort=labels, axis=alt.Axis(labels=len(labels) <= 20)),
+        y=alt.Y("Image B:N", sort=labels, axis=alt.Axis(labels=len(labels) <= 20)),
+        color=alt.Color("Similarity:Q", scale=alt.Scale(domain=[0, 1], scheme="blues")),
+        tooltip=["Image A", "Image B", alt.Tooltip("Similarity:Q", format=".0%")]
+    ).properties(height=max(300, min(12 * len(labels), 800)))
+    st.altair_chart(chart, use_container_width=True)
+    if len(labels) < len(images):
+        st.caption(f"Each cell averages about {len(images) // len(labels)} x {len(images) // len(labels)} image pairs")
+    
+    # Groups of near-identical images
+    groups = result["groups"]
+    st.markdown(f"**Near-Identical Groups** ({len(groups)} groups at {threshold:.0%} similarity or more)")
+    if groups:
+        st.dataframe(
+            pd.DataFrame([{
+                "Group": number,
+                "Images": len(group),
+                "Files": ", ".join(names[i] for i in group[:10]) + (" ..." if len(group) > 10 else ""),
+                "Objects": ", ".join(sorted({images[i].object_name or "Unknown" for i in group})),
+            } for number, group in enumerate(groups, start=1)]),
+            use_container_width=True,
+            hide_index=True
+        )
+    else:
+        st.info("No near-identical images found. Lower the threshold to group looser matches.")
+    
+    # Most similar pairs
+    pairs_df = pd.DataFrame([{
+        "Image A": names[i],
+        "Object A": images[i].object_name,
+        "Image B": names[j],
+        "Object B": images[j].object_name,
+        "Similarity": similarity,
+    } for similarity, i, j in result["pairs"][:25]])
+    
+    st.markdown("**Most Similar Pairs**")
+    st.dataframe(
+        pairs_df,
+        use_container_width=True,
+        column_config={"Similarity": st.column_config.NumberColumn("Similarity", format="%.2f")},
+        hide_index=True
+    )
+    
+    # Object types across the batch
+    object_counts = pd.Series([img.object_name for img in images]).value_counts()
+    st.markdown("**Objects in Batch**")
+    st.dataframe(object_counts.rename_axis("Object").reset_index(name="Images"), hide_index=True)
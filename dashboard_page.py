@@ -2,7 +2,7 @@ import streamlit as st
 import os
 import pandas as pd
 from database import get_all_favorites, get_favorite_by_id, update_favorite_details
-from database import update_favorite_order, remove_from_favorites
+from database import update_favorite_order, remove_from_favorites, bulk_update_favorite_orders
 import database as db
 from export_utils import export_to_csv, export_to_excel, export_to_pdf_simple, export_to_pdf_detailed
 
@@ -61,6 +61,18 @@ def show_image_dashboard_page():
     with st.expander("Dashboard Management"):
         export_dashboard_data(favorites)
         
+        # Remove several items at once
+        favorite_labels = {fav.id: fav.custom_label or fav.image.object_name for fav in favorites}
+        remove_ids = st.multiselect(
+            "Remove items from dashboard",
+            options=list(favorite_labels),
+            format_func=lambda x: favorite_labels[x]
+        )
+        if remove_ids and st.button("Remove Selected"):
+            removed = db.remove_favorites_bulk(remove_ids)
+            st.success(f"Removed {removed} items from dashboard")
+            st.rerun()
+        
         if st.button("Reorder Favorites"):
             show_reorder_dialog(favorites)
             return
@@ -331,19 +343,8 @@ def show_add_favorite_dialog():
     """
     st.subheader("Add to Dashboard")
     
-    # Get all images not in favorites
-    db_session = next(db.get_db())
-    all_images = db_session.query(db.Image).all()
-    
-    # Filter to images not in favorites
-    non_favorite_images = []
-    for image in all_images:
-        is_favorite = db_session.query(db.FavoriteImage).filter(
-            db.FavoriteImage.image_id == image.id
-        ).first()
-        
-        if not is_favorite:
-            non_favorite_images.append(image)
+    # Get all images not in favorites (single anti-join query)
+    non_favorite_images = db.get_non_favorite_images()
     
     if not non_favorite_images:
         st.info("All images are already in your dashboard")
@@ -371,23 +372,37 @@ def show_add_favorite_dialog():
         hide_index=True
     )
     
+    # Labels looked up by ID, rather than filtering the dataframe per option
+    image_labels = {img["id"]: f"{img['file_name']} ({img['object_name']})" for img in image_data}
+    
     # Select image
     selected_image_id = st.selectbox(
         "Select an image to add",
-        options=image_df["id"].tolist(),
-        format_func=lambda x: f"{image_df[image_df['id'] == x]['file_name'].iloc[0]} ({image_df[image_df['id'] == x]['object_name'].iloc[0]})"
+        options=list(image_labels),
+        format_func=lambda x: image_labels[x]
     )
     
     if selected_image_id:
         # Show add form for the selected image
         show_create_favorite_form(selected_image_id)
+    
+    # Add several images at once
+    bulk_image_ids = st.multiselect(
+        "Or add several images at once",
+        options=list(image_labels),
+        format_func=lambda x: image_labels[x]
+    )
+    if bulk_image_ids and st.button("Add Selected to Dashboard"):
+        added = db.add_favorites_bulk(bulk_image_ids)
+        st.success(f"Added {added} images to dashboard")
+        st.rerun()
 
 def show_create_favorite_form(image_id):
     """
     Show form to create a new favorite
     """
     # Get image details
-    db_session = next(db.get_db())
+    db_session = db.get_db()
     image = db_session.query(db.Image).filter(db.Image.id == image_id).first()
     
     if not image:
@@ -468,11 +483,10 @@ def show_reorder_dialog(favorites):
             except Exception as e:
                 st.error(f"Error updating order: {e}")
     
-    # Batch update - reorder all sequentially
+    # Batch update - reorder all sequentially in one statement
     if st.button("Reset All Orders (Sequential)"):
         try:
-            for i, fav_id in enumerate(df["id"].tolist()):
-                update_favorite_order(fav_id, i)
+            bulk_update_favorite_orders({fav_id: i for i, fav_id in enumerate(df["id"].tolist())})
             st.success("All items reordered sequentially!")
             st.rerun()
         except Exception as e:
@@ -648,8 +662,10 @@ def show_analytics_dashboard():
     """, unsafe_allow_html=True)
 
     # Get database statistics
-    db_session = next(get_db())
-    image_count = db_session.query(func.count(Image.id)).scalar()
+    db_session = get_db()
+    # Metadata-only rows (not analyzed yet) are left out of the analysis statistics
+    analyzed = Image.description.isnot(None)
+    image_count = db_session.query(func.count(Image.id)).filter(analyzed).scalar()
     folder_count = db_session.query(func.count(Folder.id)).scalar()
 
     if image_count == 0:
@@ -693,7 +709,7 @@ def show_analytics_dashboard():
         top_objects = db_session.query(
             Image.object_name, 
             func.count(Image.id).label('count')
-        ).group_by(Image.object_name).order_by(desc('count')).limit(10).all()
+        ).filter(analyzed).group_by(Image.object_name).order_by(desc('count')).limit(10).all()
 
         if top_objects:
             # Convert to DataFrame
@@ -720,7 +736,7 @@ def show_analytics_dashboard():
         processing_dates = db_session.query(
             func.date(Image.processed_at).label('date'),
             func.count(Image.id).label('count')
-        ).group_by('date').order_by('date').all()
+        ).filter(analyzed).group_by('date').order_by('date').all()
 
         if processing_dates:
             # Convert to DataFrame
@@ -763,7 +779,7 @@ def show_analytics_dashboard():
         with col1:
             if camera_data:
                 df_cameras = pd.DataFrame(camera_data)
-                chart = alt.Chart(df_cameras).mark_pie().encode(
+                chart = alt.Chart(df_cameras).mark_arc().encode(
                     theta=alt.Theta(field="count", type="quantitative"),
                     color=alt.Color(field="camera", type="nominal"),
                     tooltip=['camera', 'count']
@@ -793,7 +809,7 @@ def show_analytics_dashboard():
 
             if file_types:
                 df_types = pd.DataFrame(file_types)
-                chart = alt.Chart(df_types).mark_pie().encode(
+                chart = alt.Chart(df_types).mark_arc().encode(
                     theta=alt.Theta(field="count", type="quantitative"),
                     color=alt.Color(field="type", type="nominal"),
                     tooltip=['type', 'count']
@@ -824,7 +840,7 @@ def show_analytics_dashboard():
         most_active_folder = db_session.query(
             Folder.name,
             func.count(Image.id).label('count')
-        ).join(Image).group_by(Folder.id).order_by(desc('count')).first()
+        ).join(Image).filter(analyzed).group_by(Folder.id).order_by(desc('count')).first()
 
         if most_active_folder:
             st.metric("Most Active Folder", most_active_folder[0], f"{most_active_folder[1]} images")
@@ -836,7 +852,7 @@ def show_analytics_dashboard():
         highest_conf_image = db_session.query(
             Image.file_name,
             Image.confidence
-        ).order_by(desc(Image.confidence)).first()
+        ).filter(analyzed).order_by(desc(Image.confidence)).first()
 
         if highest_conf_image:
             st.metric("Highest Confidence", f"{highest_conf_image[1]:.2f}", highest_conf_image[0])
@@ -1,12 +1,15 @@
 import os
 import sqlalchemy as sa
 import json
-from sqlalchemy import create_engine, Column, Integer, String, Float, Text, DateTime, ForeignKey
+from sqlalchemy import create_engine, Column, Integer, String, Float, Text, DateTime, ForeignKey, Boolean
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker, relationship
+from sqlalchemy.orm import sessionmaker, relationship, joinedload
 import datetime
 import os
+import threading
+from contextlib import contextmanager
 from dotenv import load_dotenv
+from geo import encode_geohash, geohash_bounds, haversine_km, bbox_around
 from urllib.parse import urlparse
 import psycopg2
 
@@ -53,10 +56,16 @@ class Folder(Base):
     name = Column(String(255), nullable=False)
     path = Column(String(512), nullable=False, unique=True)
     processed_at = Column(DateTime, default=datetime.datetime.utcnow)
+    # Containing folder, for folders imported as part of a tree (None for top-level folders)
+    parent_id = Column(Integer, ForeignKey('folders.id'), nullable=True, index=True)
     
     # Relationship with images
     images = relationship("Image", back_populates="folder", cascade="all, delete-orphan")
     
+    # Relationships within the folder tree
+    parent = relationship("Folder", remote_side=[id], back_populates="children")
+    children = relationship("Folder", back_populates="parent")
+    
     def __repr__(self):
         return f"<Folder(name='{self.name}', path='{self.path}')>"
 
@@ -67,7 +76,7 @@ class Image(Base):
     __tablename__ = 'images'
     
     id = Column(Integer, primary_key=True)
-    folder_id = Column(Integer, ForeignKey('folders.id'), nullable=False)
+    folder_id = Column(Integer, ForeignKey('folders.id'), nullable=False, index=True)
     file_name = Column(String(255), nullable=False)
     file_path = Column(String(512), nullable=False, unique=True)
     object_name = Column(String(255))
@@ -81,7 +90,7 @@ class Image(Base):
     height = Column(Integer, nullable=True)
     camera_make = Column(String(255), nullable=True)
     camera_model = Column(String(255), nullable=True)
-    date_taken = Column(DateTime, nullable=True)
+    date_taken = Column(DateTime, nullable=True, index=True)
     focal_length = Column(Float, nullable=True)
     exposure_time = Column(String(50), nullable=True)
     aperture = Column(Float, nullable=True)
@@ -89,13 +98,24 @@ class Image(Base):
     gps_latitude = Column(Float, nullable=True)
     gps_longitude = Column(Float, nullable=True)
     file_size = Column(Integer, nullable=True)
-    file_type = Column(String(50), nullable=True)
+    file_type = Column(String(50), nullable=True, index=True)
+    geohash = Column(String(12), nullable=True)  # Derived from the GPS coordinates for spatial queries
+    dhash = Column(String(16), nullable=True)  # Perceptual difference hash (hex)
     
     # Relationship with folder
     folder = relationship("Folder", back_populates="images")
     # Relationship with favorites
     favorites = relationship("FavoriteImage", back_populates="image", cascade="all, delete-orphan")
     
+    # Indexes backing the faceted search filters
+    __table_args__ = (
+        sa.Index('ix_images_camera', 'camera_make', 'camera_model'),
+        sa.Index('ix_images_gps', 'gps_latitude', 'gps_longitude'),
+        sa.Index('ix_images_confidence', 'confidence'),
+        # Covers the map clustering query, which groups on geohash prefixes
+        sa.Index('ix_images_geohash', 'geohash', 'gps_latitude', 'gps_longitude', 'id'),
+    )
+    
     def __repr__(self):
         return f"<Image(file_name='{self.file_name}', object_name='{self.object_name}')>"
 
@@ -118,9 +138,191 @@ class FavoriteImage(Base):
     def __repr__(self):
         return f"<FavoriteImage(image_id='{self.image_id}', custom_label='{self.custom_label}')>"
 
+# Ingest job item statuses
+JOB_ITEM_PENDING = 'pending'
+JOB_ITEM_IN_FLIGHT = 'in_flight'
+JOB_ITEM_DONE = 'done'
+JOB_ITEM_FAILED = 'failed'
+
+# A job whose worker has not sent a heartbeat for this long is treated as abandoned
+WORKER_HEARTBEAT_TIMEOUT = 60
+
+# In-flight items whose lease is not renewed for this long go back to other workers
+ITEM_LEASE_SECONDS = 60
+
+class IngestJob(Base):
+    """
+    Represents a persistent batch job processing one or more folders
+    """
+    __tablename__ = 'ingest_jobs'
+    
+    id = Column(Integer, primary_key=True)
+    name = Column(String(255), nullable=False)
+    status = Column(String(20), nullable=False, default='queued')  # queued, running, stopped, completed
+    created_at = Column(DateTime, default=datetime.datetime.utcnow)
+    started_at = Column(DateTime, nullable=True)
+    finished_at = Column(DateTime, nullable=True)
+    updated_at = Column(DateTime, default=datetime.datetime.utcnow)
+    
+    # Set when the job is handed to ingest workers (see ingest_worker.py)
+    enqueued_at = Column(DateTime, nullable=True, index=True)
+    options = Column(Text, nullable=True)  # JSON pipeline options for the worker
+    worker_id = Column(String(64), nullable=True)  # Worker running the job
+    heartbeat_at = Column(DateTime, nullable=True)
+    stop_requested = Column(Boolean, nullable=True)
+    
+    # Relationship with job items
+    items = relationship("IngestJobItem", back_populates="job", cascade="all, delete-orphan")
+    
+    def __repr__(self):
+        return f"<IngestJob(name='{self.name}', status='{self.status}')>"
+
+class IngestJobItem(Base):
+    """
+    Represents a single image file within an ingest job and its processing status
+    """
+    __tablename__ = 'ingest_job_items'
+    __table_args__ = (
+        sa.UniqueConstraint('job_id', 'file_path', name='uq_ingest_job_items_job_path'),
+        sa.Index('ix_ingest_job_items_job_status', 'job_id', 'status'),
+    )
+    
+    id = Column(Integer, primary_key=True)
+    job_id = Column(Integer, ForeignKey('ingest_jobs.id'), nullable=False)
+    folder_id = Column(Integer, ForeignKey('folders.id'), nullable=False)
+    file_path = Column(String(512), nullable=False)
+    status = Column(String(20), nullable=False, default=JOB_ITEM_PENDING)
+    retry_count = Column(Integer, nullable=False, default=0)  # Times the item went back to pending after failing
+    last_error = Column(Text, nullable=True)
+    image_id = Column(Integer, ForeignKey('images.id'), nullable=True)
+    updated_at = Column(DateTime, default=datetime.datetime.utcnow)
+    
+    # Worker (or app process) that leased the item; kept once it finishes so
+    # progress can be broken down per node
+    lease_owner = Column(String(64), nullable=True)
+    lease_expires_at = Column(DateTime, nullable=True)
+    
+    # Relationship with job
+    job = relationship("IngestJob", back_populates="items")
+    
+    def __repr__(self):
+        return f"<IngestJobItem(file_path='{self.file_path}', status='{self.status}')>"
+
+class IngestWorker(Base):
+    """
+    Represents a running ingest worker process
+    """
+    __tablename__ = 'ingest_workers'
+    
+    id = Column(String(64), primary_key=True)  # hostname:pid:random
+    hostname = Column(String(255), nullable=False)
+    pid = Column(Integer, nullable=False)
+    started_at = Column(DateTime, default=datetime.datetime.utcnow)
+    heartbeat_at = Column(DateTime, default=datetime.datetime.utcnow, index=True)
+    current_job_id = Column(Integer, nullable=True)
+    
+    def __repr__(self):
+        return f"<IngestWorker(id='{self.id}', current_job_id={self.current_job_id})>"
+
+class AnalysisBatch(Base):
+    """
+    Represents an OpenAI Batch API submission analyzing items of an ingest job
+    """
+    __tablename__ = 'analysis_batches'
+    
+    id = Column(Integer, primary_key=True)
+    job_id = Column(Integer, ForeignKey('ingest_jobs.id'), nullable=False)
+    openai_batch_id = Column(String(100), nullable=False, unique=True)
+    input_file_id = Column(String(100), nullable=False)
+    output_file_id = Column(String(100), nullable=True)
+    error_file_id = Column(String(100), nullable=True)
+    status = Column(String(30), nullable=False)  # Batch API status (validating, in_progress, completed, ...)
+    request_count = Column(Integer, nullable=False, default=0)
+    item_ids_json = Column(Text, nullable=False)  # JSON list of the IngestJobItem IDs in the batch
+    created_at = Column(DateTime, default=datetime.datetime.utcnow)
+    completed_at = Column(DateTime, nullable=True)
+    ingested_at = Column(DateTime, nullable=True)
+    
+    def __repr__(self):
+        return f"<AnalysisBatch(openai_batch_id='{self.openai_batch_id}', status='{self.status}')>"
+
+class PipelineTiming(Base):
+    """
+    Represents the stage timings and API usage of one image going through the ingest pipeline
+    """
+    __tablename__ = 'pipeline_timings'
+    
+    id = Column(Integer, primary_key=True)
+    run_id = Column(String(32), nullable=False, index=True)  # One pipeline run
+    recorded_at = Column(DateTime, default=datetime.datetime.utcnow, index=True)
+    image_id = Column(Integer, nullable=True)
+    status = Column(String(20), nullable=False)  # analyzed, failed
+    provider = Column(String(20), nullable=True)  # Vision provider that analyzed the image
+    metadata_seconds = Column(Float, nullable=True)
+    encode_seconds = Column(Float, nullable=True)
+    api_seconds = Column(Float, nullable=True)
+    db_write_seconds = Column(Float, nullable=True)
+    index_seconds = Column(Float, nullable=True)
+    total_seconds = Column(Float, nullable=True)  # From leaving the scan stage to leaving the pipeline
+    encoded_bytes = Column(Integer, nullable=True)
+    prompt_tokens = Column(Integer, nullable=True)
+    completion_tokens = Column(Integer, nullable=True)
+    retries = Column(Integer, nullable=True)
+    images_per_request = Column(Integer, nullable=True)  # Images sharing the vision request (NULL: one)
+    cost_usd = Column(Float, nullable=True)  # Estimated cost of the full analysis
+    tier = Column(String(10), nullable=True)  # Tiered analysis: triage (not escalated) or full
+    triage_seconds = Column(Float, nullable=True)
+    triage_tokens = Column(Integer, nullable=True)
+    triage_cost_usd = Column(Float, nullable=True)
+    
+    def __repr__(self):
+        return f"<PipelineTiming(run_id='{self.run_id}', status='{self.status}')>"
+
+class CacheSample(Base):
+    """
+    Represents the hits and misses of one cache over a sampling interval
+    """
+    __tablename__ = 'cache_samples'
+    
+    id = Column(Integer, primary_key=True)
+    recorded_at = Column(DateTime, default=datetime.datetime.utcnow, index=True)
+    cache = Column(String(50), nullable=False)
+    hits = Column(Integer, nullable=False, default=0)
+    misses = Column(Integer, nullable=False, default=0)
+    
+    def __repr__(self):
+        return f"<CacheSample(cache='{self.cache}', hits={self.hits}, misses={self.misses})>"
+
 # Create all tables in the database
 Base.metadata.create_all(engine)
 
+def _ensure_columns():
+    """
+    Add columns that were added to models after their table already existed
+    
+    Only suitable for nullable columns without defaults; existing rows get NULL.
+    """
+    inspector = sa.inspect(engine)
+    for table in Base.metadata.sorted_tables:
+        existing = {column['name'] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name not in existing:
+                column_type = column.type.compile(dialect=engine.dialect)
+                with engine.begin() as conn:
+                    conn.execute(sa.text(f'ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}'))
+
+_ensure_columns()
+
+def _ensure_indexes():
+    """
+    Create indexes that were added to models after their table already existed
+    """
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(bind=engine, checkfirst=True)
+
+_ensure_indexes()
+
 # Create a session factory
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
@@ -134,6 +336,36 @@ def get_db():
     finally:
         db.close()
 
+@contextmanager
+def session_scope():
+    """
+    Get a database session that is closed (returning its connection to the pool) on exit
+    
+    Sessions do not expire objects on commit, so rows returned from inside the
+    block keep their loaded attributes after it closes.
+    """
+    db = SessionLocal(expire_on_commit=False)
+    try:
+        yield db
+    finally:
+        db.close()
+
+# Incremented on every write that changes image results or favorites, so
+# cached query results can tell they are stale
+_data_generation = 0
+_data_generation_lock = threading.Lock()
+
+def get_data_generation():
+    """
+    Get the current data generation
+    """
+    return _data_generation
+
+def _bump_data_generation():
+    global _data_generation
+    with _data_generation_lock:
+        _data_generation += 1
+
 # Database operations
 def get_all_folders():
     """
@@ -142,6 +374,104 @@ def get_all_folders():
     db = get_db()
     return db.query(Folder).order_by(Folder.processed_at.desc()).all()
 
+def get_folder_summaries():
+    """
+    Get every folder with aggregated statistics about its images in a single query
+    
+    Avoids loading the images of each folder just to count them. Only analyzed
+    images are counted; metadata-only rows (see bulk_upsert_image_metadata)
+    are left out, as in the folder's image list.
+    
+    Returns:
+        List of dictionaries with id, name, path, processed_at, parent_id,
+        image_count, last_image_processed_at, total_bytes and avg_confidence,
+        most recent first
+    """
+    with session_scope() as db:
+        rows = db.query(
+            Folder.id,
+            Folder.name,
+            Folder.path,
+            Folder.processed_at,
+            Folder.parent_id,
+            sa.func.count(Image.id),
+            sa.func.max(Image.processed_at),
+            sa.func.coalesce(sa.func.sum(Image.file_size), 0),
+            sa.func.avg(Image.confidence)
+        ).outerjoin(
+            # Filtered in the join, so folders with no analyzed images still appear
+            Image, (Image.folder_id == Folder.id) & Image.description.isnot(None)
+        ).group_by(
+            Folder.id, Folder.name, Folder.path, Folder.processed_at, Folder.parent_id
+        ).order_by(Folder.processed_at.desc()).all()
+    
+    return [{
+        "id": folder_id,
+        "name": name,
+        "path": path,
+        "processed_at": processed_at,
+        "parent_id": parent_id,
+        "image_count": image_count,
+        "last_image_processed_at": last_image_processed_at,
+        "total_bytes": int(total_bytes or 0),
+        "avg_confidence": float(avg_confidence) if avg_confidence is not None else None
+    } for folder_id, name, path, processed_at, parent_id, image_count, last_image_processed_at, total_bytes,
+          avg_confidence in rows]
+
+def get_folder_tree_summaries():
+    """
+    Get every folder with its own statistics and roll-ups over its subtree
+    
+    Builds on get_folder_summaries (one query) and adds the totals of each
+    folder's descendants in Python, so the roll-ups count analyzed images only.
+    
+    Returns:
+        List of dictionaries in tree order (each folder followed by its
+        subfolders by name; top-level folders most recent first). Each has the
+        get_folder_summaries keys plus depth, subfolder_count,
+        subtree_image_count, subtree_total_bytes and subtree_avg_confidence
+    """
+    folders = get_folder_summaries()
+    by_id = {folder["id"]: folder for folder in folders}
+    children = {}
+    roots = []
+    for folder in folders:
+        parent_id = folder["parent_id"]
+        if parent_id in by_id:
+            children.setdefault(parent_id, []).append(folder)
+        else:
+            roots.append(folder)
+    
+    ordered = []
+    # Iterative depth-first walk, so deep trees do not hit the recursion limit
+    stack = [(folder, 0) for folder in reversed(roots)]
+    while stack:
+        folder, depth = stack.pop()
+        folder["depth"] = depth
+        ordered.append(folder)
+        for child in sorted(children.get(folder["id"], []), key=lambda f: f["name"].lower(), reverse=True):
+            stack.append((child, depth + 1))
+    
+    # Roll up from the deepest folders, so children are totalled before their parents
+    for folder in reversed(ordered):
+        subfolders = children.get(folder["id"], [])
+        confidence_sum = (folder["avg_confidence"] or 0) * folder["image_count"]
+        folder["subfolder_count"] = len(subfolders)
+        folder["subtree_image_count"] = folder["image_count"]
+        folder["subtree_total_bytes"] = folder["total_bytes"]
+        for child in subfolders:
+            folder["subfolder_count"] += child["subfolder_count"]
+            folder["subtree_image_count"] += child["subtree_image_count"]
+            folder["subtree_total_bytes"] += child["subtree_total_bytes"]
+            confidence_sum += child["_confidence_sum"]
+        folder["_confidence_sum"] = confidence_sum
+        folder["subtree_avg_confidence"] = (
+            confidence_sum / folder["subtree_image_count"] if folder["subtree_image_count"] else None
+        )
+    for folder in ordered:
+        del folder["_confidence_sum"]
+    return ordered
+
 def get_folder_by_path(path):
     """
     Get a folder by its path
@@ -149,23 +479,60 @@ def get_folder_by_path(path):
     db = get_db()
     return db.query(Folder).filter(Folder.path == path).first()
 
-def add_folder(name, path):
+def add_folder(name, path, parent_id=None):
     """
     Add a new folder to the database
+    
+    Args:
+        name: Display name
+        path: Folder path
+        parent_id: ID of the containing folder, for folders imported as part of a tree
     """
-    db = get_db()
+    with session_scope() as db:
     
-    # Check if folder already exists
-    existing_folder = db.query(Folder).filter(Folder.path == path).first()
-    if existing_folder:
-        return existing_folder
+        # Check if folder already exists
+        existing_folder = db.query(Folder).filter(Folder.path == path).first()
+        if existing_folder:
+            if parent_id is not None and existing_folder.parent_id is None:
+                # Imported on its own before; now part of a tree
+                existing_folder.parent_id = parent_id
+                db.commit()
+                db.refresh(existing_folder)
+            return existing_folder
     
-    # Create new folder
-    folder = Folder(name=name, path=path)
-    db.add(folder)
-    db.commit()
-    db.refresh(folder)
-    return folder
+        # Create new folder
+        folder = Folder(name=name, path=path, parent_id=parent_id)
+        db.add(folder)
+        db.commit()
+        db.refresh(folder)
+        return folder
+
+METADATA_COLUMNS = [
+    'width', 'height', 'camera_make', 'camera_model', 'date_taken',
+    'focal_length', 'exposure_time', 'aperture', 'iso_speed',
+    'gps_latitude', 'gps_longitude', 'file_size', 'file_type', 'dhash'
+]
+
+def _image_metadata_columns(metadata):
+    """
+    Map a metadata dictionary (as returned by extract_image_metadata) onto Image column values
+    
+    Args:
+        metadata: Dictionary containing image metadata
+        
+    Returns:
+        Dictionary of Image column names to values
+    """
+    columns = {column: metadata.get(column) for column in METADATA_COLUMNS}
+    columns['geohash'] = encode_geohash(columns['gps_latitude'], columns['gps_longitude'])
+    
+    # extract_image_metadata already serializes the full metadata (with ISO dates)
+    metadata_json = metadata.get('metadata_json')
+    if not metadata_json:
+        metadata_json = json.dumps(metadata, default=str)
+    columns['metadata_json'] = metadata_json
+    
+    return columns
 
 def add_image_result(folder_id, file_name, file_path, object_name, description, confidence, metadata=None):
     """
@@ -180,125 +547,445 @@ def add_image_result(folder_id, file_name, file_path, object_name, description,
         confidence: Confidence score of the analysis
         metadata: Dictionary containing image metadata
     """
-    db = get_db()
+    with session_scope() as db:
     
-    # Process metadata
-    metadata_json = None
-    width = None
-    height = None
-    camera_make = None
-    camera_model = None
-    date_taken = None
-    focal_length = None
-    exposure_time = None
-    aperture = None
-    iso_speed = None
-    gps_latitude = None
-    gps_longitude = None
-    file_size = None
-    file_type = None
-    
-    if metadata:
-        metadata_json = json.dumps(metadata)
-        width = metadata.get('width')
-        height = metadata.get('height')
-        camera_make = metadata.get('camera_make')
-        camera_model = metadata.get('camera_model')
-        date_taken = metadata.get('date_taken')
-        focal_length = metadata.get('focal_length')
-        exposure_time = metadata.get('exposure_time')
-        aperture = metadata.get('aperture')
-        iso_speed = metadata.get('iso_speed')
-        gps_latitude = metadata.get('gps_latitude')
-        gps_longitude = metadata.get('gps_longitude')
-        file_size = metadata.get('file_size')
-        file_type = metadata.get('file_type')
-    
-    # Check if image already exists
-    existing_image = db.query(Image).filter(Image.file_path == file_path).first()
-    if existing_image:
-        # Update existing image
-        existing_image.object_name = object_name
-        existing_image.description = description
-        existing_image.confidence = confidence
-        existing_image.processed_at = datetime.datetime.utcnow()
-        
-        # Update metadata if provided
-        if metadata:
-            existing_image.metadata_json = metadata_json
-            existing_image.width = width
-            existing_image.height = height
-            existing_image.camera_make = camera_make
-            existing_image.camera_model = camera_model
-            existing_image.date_taken = date_taken
-            existing_image.focal_length = focal_length
-            existing_image.exposure_time = exposure_time
-            existing_image.aperture = aperture
-            existing_image.iso_speed = iso_speed
-            existing_image.gps_latitude = gps_latitude
-            existing_image.gps_longitude = gps_longitude
-            existing_image.file_size = file_size
-            existing_image.file_type = file_type
+        # Process metadata
+        metadata_columns = _image_metadata_columns(metadata) if metadata else {}
+    
+        # Check if image already exists
+        existing_image = db.query(Image).filter(Image.file_path == file_path).first()
+        if existing_image:
+            # Update existing image
+            existing_image.object_name = object_name
+            existing_image.description = description
+            existing_image.confidence = confidence
+            existing_image.processed_at = datetime.datetime.utcnow()
+        
+            # Update metadata if provided
+            for column, value in metadata_columns.items():
+                setattr(existing_image, column, value)
             
+            db.commit()
+            _bump_data_generation()
+            return existing_image
+    
+        # Create new image
+        image = Image(
+            folder_id=folder_id,
+            file_name=file_name,
+            file_path=file_path,
+            object_name=object_name,
+            description=description,
+            confidence=confidence,
+            **metadata_columns
+        )
+        db.add(image)
         db.commit()
-        return existing_image
-    
-    # Create new image
-    image = Image(
-        folder_id=folder_id,
-        file_name=file_name,
-        file_path=file_path,
-        object_name=object_name,
-        description=description,
-        confidence=confidence,
-        metadata_json=metadata_json,
-        width=width,
-        height=height,
-        camera_make=camera_make,
-        camera_model=camera_model,
-        date_taken=date_taken,
-        focal_length=focal_length,
-        exposure_time=exposure_time,
-        aperture=aperture,
-        iso_speed=iso_speed,
-        gps_latitude=gps_latitude,
-        gps_longitude=gps_longitude,
-        file_size=file_size,
-        file_type=file_type
-    )
-    db.add(image)
-    db.commit()
-    db.refresh(image)
-    return image
+        _bump_data_generation()
+        db.refresh(image)
+        return image
+
+def bulk_upsert_image_metadata(folder_id, metadata_items, batch_size=500):
+    """
+    Write extracted metadata for many images using batched statements
+    
+    Images that are not yet in the database are inserted as metadata-only rows
+    (no object name or description) so the analysis stage can fill them in later.
+    Existing rows only have their metadata columns updated.
+    
+    Args:
+        folder_id: ID of the folder containing the images
+        metadata_items: Iterable of (file_path, metadata) tuples
+        batch_size: Number of images written per statement batch
+        
+    Returns:
+        Number of images written
+    """
+    with session_scope() as db:
+        written = 0
+        batch = []
+    
+        def flush(batch):
+            # Later entries for the same path win
+            batch = dict(batch)
+            paths = list(batch)
+            existing_ids = dict(
+                db.query(Image.file_path, Image.id).filter(Image.file_path.in_(paths)).all()
+            )
+        
+            inserts = []
+            updates = []
+            for file_path, metadata in batch.items():
+                columns = _image_metadata_columns(metadata)
+                if file_path in existing_ids:
+                    updates.append({'id': existing_ids[file_path], **columns})
+                else:
+                    inserts.append({
+                        'folder_id': folder_id,
+                        'file_name': os.path.basename(file_path),
+                        'file_path': file_path,
+                        **columns
+                    })
+        
+            if inserts:
+                db.execute(sa.insert(Image), inserts)
+            if updates:
+                db.execute(sa.update(Image), updates)
+            db.commit()
+            _bump_data_generation()
+            return len(inserts) + len(updates)
+    
+        for file_path, metadata in metadata_items:
+            batch.append((file_path, metadata))
+            if len(batch) >= batch_size:
+                written += flush(batch)
+                batch = []
+    
+        if batch:
+            written += flush(batch)
+    
+        return written
 
-def get_images_by_folder_id(folder_id):
+def get_images_by_folder_id(folder_id, analyzed_only=False):
     """
     Get all images for a specific folder
+    
+    Args:
+        folder_id: ID of the folder
+        analyzed_only: Leave out metadata-only rows (see bulk_upsert_image_metadata)
     """
-    db = get_db()
-    return db.query(Image).filter(Image.folder_id == folder_id).all()
+    with session_scope() as db:
+        query = db.query(Image).filter(Image.folder_id == folder_id)
+        if analyzed_only:
+            query = query.filter(Image.description.isnot(None))
+        return query.all()
 
 def get_image_by_path(file_path):
     """
     Get an image by its file path
     """
-    db = get_db()
-    return db.query(Image).filter(Image.file_path == file_path).first()
+    with session_scope() as db:
+        return db.query(Image).filter(Image.file_path == file_path).first()
+
+def get_images_by_ids(image_ids):
+    """
+    Get several images by ID in one query, with their folders loaded
+    
+    Args:
+        image_ids: IDs of the images to fetch
+        
+    Returns:
+        List of Image objects in the order of image_ids (missing IDs are skipped)
+    """
+    if not image_ids:
+        return []
+    with session_scope() as db:
+        images = db.query(Image).options(joinedload(Image.folder)).filter(Image.id.in_(list(image_ids))).all()
+    by_id = {image.id: image for image in images}
+    return [by_id[image_id] for image_id in image_ids if image_id in by_id]
+
+def get_image_count():
+    """
+    Get the number of analyzed images
+    """
+    with session_scope() as db:
+        return db.query(sa.func.count(Image.id)).filter(Image.description.isnot(None)).scalar()
+
+def get_image_texts():
+    """
+    Get the object name and description of every analyzed image
+    
+    Returns:
+        List of (image_id, object_name, description) tuples
+    """
+    with session_scope() as db:
+        return db.query(Image.id, Image.object_name, Image.description).filter(
+            Image.description.isnot(None)
+        ).order_by(Image.id).all()
 
 def search_images(query):
     """
-    Search for images by object name, description, or metadata fields
+    Search analyzed images by object name, description, or metadata fields
     """
     db = get_db()
-    return db.query(Image).filter(
+    return db.query(Image).options(joinedload(Image.folder)).filter(
         (Image.object_name.ilike(f"%{query}%")) | 
         (Image.description.ilike(f"%{query}%")) |
         (Image.camera_make.ilike(f"%{query}%")) |
         (Image.camera_model.ilike(f"%{query}%")) |
         (Image.file_type.ilike(f"%{query}%")) |
-        (Image.metadata_json.ilike(f"%{query}%"))
+        (Image.metadata_json.ilike(f"%{query}%")),
+        # Metadata-only rows have no analysis to show yet
+        Image.description.isnot(None)
     ).all()
 
+# Columns that can be drilled down by value in faceted search
+FACET_COLUMNS = {
+    'camera_make': Image.camera_make,
+    'camera_model': Image.camera_model,
+    'file_type': Image.file_type,
+}
+
+def _facet_conditions(query=None, camera_make=None, camera_model=None, file_type=None,
+                      date_from=None, date_to=None, bbox=None,
+                      min_confidence=None, max_confidence=None, exclude=None):
+    """
+    Build the WHERE conditions for a faceted search
+    
+    Args:
+        exclude: Name of a facet whose own filter is left out, so its counts
+            show what selecting other values would return
+        
+    Returns:
+        List of SQLAlchemy conditions (always limited to analyzed images)
+    """
+    # Metadata-only rows have no analysis yet and are not search results
+    conditions = [Image.description.isnot(None)]
+    if query:
+        conditions.append(Image.object_name.ilike(f"%{query}%") | Image.description.ilike(f"%{query}%"))
+    
+    for name, values in (('camera_make', camera_make), ('camera_model', camera_model), ('file_type', file_type)):
+        if not values or name == exclude:
+            continue
+        column = FACET_COLUMNS[name]
+        values = list(values)
+        condition = column.in_([value for value in values if value])
+        if None in values or '' in values:
+            # Missing metadata is stored as NULL or an empty string
+            condition = condition | column.is_(None) | (column == '')
+        conditions.append(condition)
+    
+    if date_from is not None:
+        conditions.append(Image.date_taken >= date_from)
+    if date_to is not None:
+        conditions.append(Image.date_taken <= date_to)
+    if bbox is not None:
+        conditions.extend(_bbox_conditions(bbox))
+    if min_confidence is not None:
+        conditions.append(Image.confidence >= min_confidence)
+    if max_confidence is not None:
+        conditions.append(Image.confidence <= max_confidence)
+    return conditions
+
+def search_images_faceted(query=None, camera_make=None, camera_model=None, file_type=None,
+                          date_from=None, date_to=None, bbox=None,
+                          min_confidence=None, max_confidence=None, limit=200, offset=0):
+    """
+    Search images with structured filters on the typed metadata columns
+    
+    Filters on different fields are combined with AND; the values given for one
+    field are combined with OR. Facet counts for each field apply every filter
+    except that field's own, and are computed together in a single query.
+    
+    Args:
+        query: Optional text matched against object names and descriptions
+        camera_make: Camera makes to include (None or '' matches images without one)
+        camera_model: Camera models to include
+        file_type: File types to include (e.g. 'jpg', 'heic')
+        date_from: Earliest date taken (datetime)
+        date_to: Latest date taken (datetime)
+        bbox: (min_lat, min_lon, max_lat, max_lon) GPS bounding box
+        min_confidence: Minimum analysis confidence
+        max_confidence: Maximum analysis confidence
+        limit: Maximum number of images to return
+        offset: Number of matching images to skip
+        
+    Returns:
+        Dictionary with 'total' (number of matches), 'images' (Image objects,
+        newest first) and 'facets' (field name -> list of (value, count), most
+        common first; None stands for images without a value)
+    """
+    filters = dict(query=query, camera_make=camera_make, camera_model=camera_model, file_type=file_type,
+                   date_from=date_from, date_to=date_to, bbox=bbox,
+                   min_confidence=min_confidence, max_confidence=max_confidence)
+    
+    # One UNION ALL query: the total plus a GROUP BY per facet
+    branches = [
+        sa.select(sa.literal('_total').label('facet'), sa.literal(None, sa.String).label('value'),
+                  sa.func.count(Image.id).label('count'))
+        .where(*_facet_conditions(**filters))
+    ]
+    for name, column in FACET_COLUMNS.items():
+        value = sa.func.nullif(column, '')
+        branches.append(
+            sa.select(sa.literal(name).label('facet'), value.label('value'), sa.func.count(Image.id).label('count'))
+            .where(*_facet_conditions(exclude=name, **filters))
+            .group_by(value)
+        )
+    
+    with session_scope() as db:
+        total = 0
+        facets = {name: [] for name in FACET_COLUMNS}
+        for facet, value, count in db.execute(sa.union_all(*branches)):
+            if facet == '_total':
+                total = count
+            else:
+                facets[facet].append((value, count))
+        for counts in facets.values():
+            counts.sort(key=lambda item: (-item[1], item[0] or ''))
+        
+        images = db.query(Image).options(joinedload(Image.folder)).filter(
+            *_facet_conditions(**filters)
+        ).order_by(Image.processed_at.desc(), Image.id.desc()).offset(offset).limit(limit).all()
+    
+    return {'total': total, 'images': images, 'facets': facets}
+
+def update_image_dhashes(dhashes):
+    """
+    Store perceptual hashes computed for existing images
+    
+    Args:
+        dhashes: Dictionary mapping image ID to hex dHash
+    """
+    if not dhashes:
+        return
+    with session_scope() as db:
+        db.execute(sa.update(Image), [{'id': image_id, 'dhash': value} for image_id, value in dhashes.items()])
+        db.commit()
+        _bump_data_generation()
+
+# Geospatial operations
+def _bbox_conditions(bbox):
+    """
+    Conditions selecting images inside a (min_lat, min_lon, max_lat, max_lon) box
+    """
+    min_lat, min_lon, max_lat, max_lon = bbox
+    conditions = [Image.gps_latitude.between(min_lat, max_lat)]
+    if min_lon <= max_lon:
+        conditions.append(Image.gps_longitude.between(min_lon, max_lon))
+    else:
+        # Box crossing the antimeridian
+        conditions.append((Image.gps_longitude >= min_lon) | (Image.gps_longitude <= max_lon))
+    return conditions
+
+def backfill_geohashes(batch_size=5000):
+    """
+    Compute the geohash of geotagged images stored before the column existed
+    
+    Args:
+        batch_size: Images updated per transaction
+        
+    Returns:
+        Number of images updated
+    """
+    updated = 0
+    with session_scope() as db:
+        while True:
+            rows = db.query(Image.id, Image.gps_latitude, Image.gps_longitude).filter(
+                Image.geohash.is_(None),
+                Image.gps_latitude.isnot(None),
+                Image.gps_longitude.isnot(None)
+            ).order_by(Image.id).limit(batch_size).all()
+            if not rows:
+                break
+            
+            # Out-of-range coordinates get an empty geohash so they are not retried
+            db.execute(sa.update(Image), [
+                {'id': image_id, 'geohash': encode_geohash(lat, lon) or ''} for image_id, lat, lon in rows
+            ])
+            db.commit()
+            _bump_data_generation()
+            updated += len(rows)
+    return updated
+
+def count_images_missing_geohash():
+    """
+    Count geotagged images that have no geohash yet
+    """
+    with session_scope() as db:
+        return db.query(sa.func.count(Image.id)).filter(
+            Image.geohash.is_(None),
+            Image.gps_latitude.isnot(None),
+            Image.gps_longitude.isnot(None)
+        ).scalar()
+
+def get_images_in_bbox(bbox, limit=1000):
+    """
+    Get geotagged images inside a bounding box
+    
+    Args:
+        bbox: (min_lat, min_lon, max_lat, max_lon); min_lon > max_lon crosses the antimeridian
+        limit: Maximum number of images to return
+        
+    Returns:
+        List of Image objects with their folders loaded
+    """
+    with session_scope() as db:
+        return db.query(Image).options(joinedload(Image.folder)).filter(
+            *_bbox_conditions(bbox)
+        ).order_by(Image.id).limit(limit).all()
+
+def get_images_within_radius(latitude, longitude, radius_km, limit=1000):
+    """
+    Get geotagged images within a distance of a point, nearest first
+    
+    Candidates are selected with the (latitude, longitude) index using the
+    enclosing bounding box, then filtered by great-circle distance.
+    
+    Args:
+        latitude: Latitude of the centre in degrees
+        longitude: Longitude of the centre in degrees
+        radius_km: Search radius in kilometres
+        limit: Maximum number of images to return
+        
+    Returns:
+        List of (Image, distance_km) tuples
+    """
+    with session_scope() as db:
+        candidates = db.query(Image.id, Image.gps_latitude, Image.gps_longitude).filter(
+            *_bbox_conditions(bbox_around(latitude, longitude, radius_km))
+        ).all()
+    
+    distances = []
+    for image_id, lat, lon in candidates:
+        distance = haversine_km(latitude, longitude, lat, lon)
+        if distance <= radius_km:
+            distances.append((distance, image_id))
+    distances.sort()
+    distances = distances[:limit]
+    
+    images = {image.id: image for image in get_images_by_ids([image_id for _, image_id in distances])}
+    return [(images[image_id], distance) for distance, image_id in distances if image_id in images]
+
+def get_geo_clusters(precision, bbox=None):
+    """
+    Group geotagged images into geohash grid cells
+    
+    Clustering happens in the database with one GROUP BY on a geohash prefix,
+    so only one row per occupied cell is returned however many images there are.
+    
+    Args:
+        precision: Geohash prefix length (longer means smaller cells)
+        bbox: Optional (min_lat, min_lon, max_lat, max_lon) to restrict to
+        
+    Returns:
+        List of dictionaries with the cell's geohash, bounds, image count,
+        mean latitude/longitude and one sample image ID, largest first
+    """
+    cell = sa.func.substr(Image.geohash, 1, precision)
+    query = sa.select(
+        cell.label('cell'),
+        sa.func.count(Image.id),
+        sa.func.avg(Image.gps_latitude),
+        sa.func.avg(Image.gps_longitude),
+        sa.func.min(Image.id)
+    ).where(Image.geohash.isnot(None), Image.geohash != '')
+    if bbox is not None:
+        query = query.where(*_bbox_conditions(bbox))
+    query = query.group_by(cell).order_by(sa.func.count(Image.id).desc())
+    
+    with session_scope() as db:
+        rows = db.execute(query).all()
+    
+    return [{
+        'geohash': cell_hash,
+        'bounds': geohash_bounds(cell_hash),
+        'count': count,
+        'latitude': float(lat),
+        'longitude': float(lon),
+        'sample_image_id': sample_id,
+    } for cell_hash, count, lat, lon, sample_id in rows]
+
 # Favorites operations
 def add_to_favorites(image_id, custom_label=None, note=None, display_order=0):
     """
@@ -331,6 +1018,7 @@ def add_to_favorites(image_id, custom_label=None, note=None, display_order=0):
         if display_order is not None:
             existing.display_order = display_order
         db.commit()
+        _bump_data_generation()
         return existing
     
     # Create new favorite
@@ -342,6 +1030,7 @@ def add_to_favorites(image_id, custom_label=None, note=None, display_order=0):
     )
     db.add(favorite)
     db.commit()
+    _bump_data_generation()
     db.refresh(favorite)
     return favorite
 
@@ -362,6 +1051,7 @@ def remove_from_favorites(favorite_id):
     
     db.delete(favorite)
     db.commit()
+    _bump_data_generation()
     return True
 
 def get_all_favorites():
@@ -405,9 +1095,132 @@ def update_favorite_order(favorite_id, new_order):
     
     favorite.display_order = new_order
     db.commit()
+    _bump_data_generation()
     db.refresh(favorite)
     return favorite
 
+def get_non_favorite_images():
+    """
+    Get all analyzed images that are not in favorites using a single anti-join query
+    
+    Returns:
+        List of Image objects with their folder loaded
+    """
+    with session_scope() as db:
+        return db.query(Image).options(joinedload(Image.folder)).outerjoin(
+            FavoriteImage, FavoriteImage.image_id == Image.id
+        ).filter(FavoriteImage.id.is_(None), Image.description.isnot(None)).order_by(Image.id).all()
+
+def get_favorite_ids_for_images(image_ids):
+    """
+    Check favorite membership for many images at once
+    
+    Args:
+        image_ids: IDs of the images to check
+        
+    Returns:
+        Dictionary mapping image ID to favorite ID for the images that are favorited
+    """
+    image_ids = list(image_ids)
+    if not image_ids:
+        return {}
+    favorites = {}
+    with session_scope() as db:
+        # Chunked to stay under the database's limit on query parameters
+        for start in range(0, len(image_ids), 500):
+            favorites.update(db.query(FavoriteImage.image_id, FavoriteImage.id).filter(
+                FavoriteImage.image_id.in_(image_ids[start:start + 500])
+            ).all())
+    return favorites
+
+def add_favorites_bulk(image_ids):
+    """
+    Add many images to favorites in one transaction
+    
+    Images that are already favorited are skipped. New favorites are appended
+    after the current highest display order, in the given order.
+    
+    Args:
+        image_ids: IDs of the images to add
+        
+    Returns:
+        Number of favorites created
+    """
+    image_ids = list(dict.fromkeys(image_ids))
+    if not image_ids:
+        return 0
+    
+    with session_scope() as db:
+        existing = set()
+        valid = set()
+        # Chunked to stay under the database's limit on query parameters
+        for start in range(0, len(image_ids), 500):
+            chunk = image_ids[start:start + 500]
+            existing.update(image_id for (image_id,) in db.query(FavoriteImage.image_id).filter(
+                FavoriteImage.image_id.in_(chunk)
+            ))
+            valid.update(image_id for (image_id,) in db.query(Image.id).filter(Image.id.in_(chunk)))
+        next_order = (db.query(sa.func.max(FavoriteImage.display_order)).scalar() or 0) + 1
+        now = datetime.datetime.utcnow()
+        
+        rows = []
+        for image_id in image_ids:
+            if image_id in valid and image_id not in existing:
+                rows.append({'image_id': image_id, 'display_order': next_order + len(rows), 'added_at': now})
+        
+        if rows:
+            db.execute(sa.insert(FavoriteImage), rows)
+            db.commit()
+            _bump_data_generation()
+        return len(rows)
+
+def remove_favorites_bulk(favorite_ids):
+    """
+    Remove many favorites with a single statement
+    
+    Args:
+        favorite_ids: IDs of the favorites to remove
+        
+    Returns:
+        Number of favorites removed
+    """
+    favorite_ids = list(favorite_ids)
+    if not favorite_ids:
+        return 0
+    with session_scope() as db:
+        removed = 0
+        # Chunked to stay under the database's limit on query parameters
+        for start in range(0, len(favorite_ids), 500):
+            removed += db.query(FavoriteImage).filter(
+                FavoriteImage.id.in_(favorite_ids[start:start + 500])
+            ).delete(synchronize_session=False)
+        db.commit()
+        _bump_data_generation()
+        return removed
+
+def bulk_update_favorite_orders(orders):
+    """
+    Update the display order of many favorites with a single UPDATE statement
+    
+    Args:
+        orders: Dictionary mapping favorite ID to its new display order
+        
+    Returns:
+        Number of favorites updated
+    """
+    if not orders:
+        return 0
+    with session_scope() as db:
+        result = db.execute(
+            sa.update(FavoriteImage)
+            .where(FavoriteImage.id.in_(list(orders)))
+            .values(display_order=sa.case(orders, value=FavoriteImage.id))
+            .execution_options(synchronize_session=False)
+        )
+        db.commit()
+        _bump_data_generation()
+        return result.rowcount
+
 def update_favorite_details(favorite_id, custom_label=None, note=None):
     """
     Update the details of a favorite image
@@ -431,5 +1244,752 @@ def update_favorite_details(favorite_id, custom_label=None, note=None):
         favorite.note = note
     
     db.commit()
+    _bump_data_generation()
     db.refresh(favorite)
     return favorite
+
+# Ingest job operations
+def create_ingest_job(name, folders):
+    """
+    Create a persistent ingest job with one pending item per image file
+    
+    Images that already have analysis results are recorded as done, so the job
+    only processes new files.
+    
+    Args:
+        name: Display name of the job
+        folders: List of (folder_name, folder_path, image_files) tuples
+        
+    Returns:
+        The created IngestJob object
+    """
+    with session_scope() as db:
+        now = datetime.datetime.utcnow()
+    
+        job = IngestJob(name=name, status='queued', created_at=now, updated_at=now)
+        db.add(job)
+        db.flush()
+    
+        for folder_name, folder_path, image_files in folders:
+            folder = db.query(Folder).filter(Folder.path == folder_path).first()
+            if not folder:
+                folder = Folder(name=folder_name, path=folder_path)
+                db.add(folder)
+                db.flush()
+            _insert_job_items(db, job.id, folder.id, image_files, now)
+    
+        db.commit()
+        db.refresh(job)
+        return job
+
+def _insert_job_items(db, job_id, folder_id, image_files, now, skip=()):
+    """
+    Insert job items for image files, recording already analyzed images as done
+    
+    Returns:
+        Number of items inserted
+    """
+    # Look up already analyzed images for the whole folder at once
+    analyzed = dict(
+        db.query(Image.file_path, Image.id)
+        .filter(Image.folder_id == folder_id, Image.description.isnot(None))
+        .all()
+    )
+
+    items = []
+    for file_path in dict.fromkeys(image_files):
+        if file_path in skip:
+            continue
+        image_id = analyzed.get(file_path)
+        items.append({
+            'job_id': job_id,
+            'folder_id': folder_id,
+            'file_path': file_path,
+            'status': JOB_ITEM_DONE if image_id else JOB_ITEM_PENDING,
+            'retry_count': 0,
+            'image_id': image_id,
+            'updated_at': now
+        })
+    if items:
+        db.execute(sa.insert(IngestJobItem), items)
+    return len(items)
+
+def add_ingest_job_items(job_id, folder_path, image_files):
+    """
+    Add image files to an existing job, for jobs whose files arrive while it runs
+    
+    Files the job already has are skipped, and images analyzed before are
+    recorded as done.
+    
+    Args:
+        job_id: ID of the job
+        folder_path: Path of a folder already in the database
+        image_files: Paths of the files to add
+        
+    Returns:
+        Number of items added
+    """
+    image_files = list(image_files)
+    with session_scope() as db:
+        folder = db.query(Folder).filter(Folder.path == folder_path).first()
+        if not folder:
+            raise ValueError(f"Folder {folder_path} not found")
+        existing = set()
+        # Chunked to stay under the database's limit on query parameters
+        for start in range(0, len(image_files), 500):
+            existing.update(file_path for (file_path,) in db.query(IngestJobItem.file_path).filter(
+                IngestJobItem.job_id == job_id, IngestJobItem.file_path.in_(image_files[start:start + 500])
+            ))
+        added = _insert_job_items(db, job_id, folder.id, image_files, datetime.datetime.utcnow(), skip=existing)
+        db.commit()
+        return added
+
+def get_unfinished_job_item_paths(path_prefix):
+    """
+    Get the file paths under a directory that unfinished job items still need
+    
+    Returns:
+        Set of file paths of pending, in-flight and failed items
+    """
+    with session_scope() as db:
+        return {file_path for (file_path,) in db.query(IngestJobItem.file_path).filter(
+            IngestJobItem.status != JOB_ITEM_DONE,
+            IngestJobItem.file_path.startswith(path_prefix, autoescape=True)
+        ).distinct()}
+
+def get_ingest_job(job_id):
+    """
+    Get an ingest job by ID
+    """
+    with session_scope() as db:
+        return db.query(IngestJob).filter(IngestJob.id == job_id).first()
+
+def get_incomplete_ingest_jobs():
+    """
+    Get all jobs that still have pending, in-flight or failed items
+    
+    Returns:
+        List of IngestJob objects, most recent first
+    """
+    with session_scope() as db:
+        unfinished = db.query(IngestJobItem.job_id).filter(
+            IngestJobItem.status != JOB_ITEM_DONE
+        ).distinct()
+        return db.query(IngestJob).filter(
+            IngestJob.id.in_(unfinished)
+        ).order_by(IngestJob.created_at.desc()).all()
+
+def get_ingest_job_counts(job_id):
+    """
+    Get the number of job items in each status
+    
+    Returns:
+        Dictionary mapping status to item count (all statuses present)
+    """
+    with session_scope() as db:
+        counts = {JOB_ITEM_PENDING: 0, JOB_ITEM_IN_FLIGHT: 0, JOB_ITEM_DONE: 0, JOB_ITEM_FAILED: 0}
+        rows = db.query(IngestJobItem.status, sa.func.count(IngestJobItem.id)).filter(
+            IngestJobItem.job_id == job_id
+        ).group_by(IngestJobItem.status).all()
+        counts.update(dict(rows))
+        return counts
+
+def get_pending_job_items(job_id):
+    """
+    Get the pending items of a job as (item_id, folder_id, file_path) tuples ordered by ID
+    """
+    with session_scope() as db:
+        return db.query(IngestJobItem.id, IngestJobItem.folder_id, IngestJobItem.file_path).filter(
+            IngestJobItem.job_id == job_id,
+            IngestJobItem.status == JOB_ITEM_PENDING
+        ).order_by(IngestJobItem.id).all()
+
+def get_ingest_job_results(job_id):
+    """
+    Get every item of a job together with its analyzed image (if any)
+    
+    Returns:
+        List of (IngestJobItem, Image or None) tuples ordered by item ID
+    """
+    with session_scope() as db:
+        return db.query(IngestJobItem, Image).outerjoin(
+            Image, IngestJobItem.image_id == Image.id
+        ).filter(IngestJobItem.job_id == job_id).order_by(IngestJobItem.id).all()
+
+def reset_job_items(job_id, retry_failed=False, max_retries=None):
+    """
+    Return interrupted (and optionally failed) items of a job to pending
+    
+    In-flight items are only reset once their lease has expired (or if they
+    never had one), so resuming a job does not take items from a live worker.
+    
+    Args:
+        job_id: ID of the job
+        retry_failed: Whether failed items should be retried as well
+        max_retries: Only retry failed items that have been retried fewer times
+            than this, so an item is attempted at most max_retries + 1 times
+        
+    Returns:
+        Number of items reset
+    
+    Each failed item that is reset counts one retry in its retry_count;
+    abandoned in-flight items go back to pending without counting one.
+    """
+    with session_scope() as db:
+        now = datetime.datetime.utcnow()
+        # Items another worker holds a live lease on are still being processed
+        abandoned = (IngestJobItem.status == JOB_ITEM_IN_FLIGHT) & (
+            IngestJobItem.lease_expires_at.is_(None) | (IngestJobItem.lease_expires_at < now)
+        )
+        retryable = IngestJobItem.status == JOB_ITEM_FAILED
+        if max_retries is not None:
+            retryable = retryable & (IngestJobItem.retry_count < max_retries)
+    
+        reset = db.query(IngestJobItem).filter(IngestJobItem.job_id == job_id, abandoned).update(
+            {IngestJobItem.status: JOB_ITEM_PENDING, IngestJobItem.lease_expires_at: None, IngestJobItem.updated_at: now},
+            synchronize_session=False
+        )
+        if retry_failed:
+            reset += db.query(IngestJobItem).filter(IngestJobItem.job_id == job_id, retryable).update({
+                IngestJobItem.status: JOB_ITEM_PENDING,
+                IngestJobItem.retry_count: IngestJobItem.retry_count + 1,
+                IngestJobItem.lease_expires_at: None,
+                IngestJobItem.updated_at: now
+            }, synchronize_session=False)
+        db.commit()
+        return reset
+
+def mark_job_items_in_flight(item_ids):
+    """
+    Mark a batch of job items as handed to the pipeline
+    """
+    if not item_ids:
+        return
+    with session_scope() as db:
+        db.query(IngestJobItem).filter(IngestJobItem.id.in_(item_ids)).update(
+            {IngestJobItem.status: JOB_ITEM_IN_FLIGHT, IngestJobItem.updated_at: datetime.datetime.utcnow()},
+            synchronize_session=False
+        )
+        db.commit()
+
+def complete_job_items(done, failed):
+    """
+    Record the outcome of a batch of job items in one transaction
+    
+    A failure does not change an item's retry_count; reset_job_items counts
+    the retry when the failed item is put back to pending.
+    
+    Args:
+        done: List of (item_id, image_id) tuples for successfully processed items
+        failed: List of (item_id, error message) tuples for failed items
+    """
+    if not done and not failed:
+        return
+    with session_scope() as db:
+        now = datetime.datetime.utcnow()
+    
+        if done:
+            db.execute(sa.update(IngestJobItem), [
+                {'id': item_id, 'status': JOB_ITEM_DONE, 'image_id': image_id, 'last_error': None,
+                 'lease_expires_at': None, 'updated_at': now}
+                for item_id, image_id in done
+            ])
+    
+        for item_id, error in failed:
+            db.query(IngestJobItem).filter(IngestJobItem.id == item_id).update({
+                IngestJobItem.status: JOB_ITEM_FAILED,
+                IngestJobItem.last_error: error,
+                IngestJobItem.lease_expires_at: None,
+                IngestJobItem.updated_at: now
+            }, synchronize_session=False)
+    
+        db.commit()
+
+def _leasable(now):
+    """
+    Condition for items a worker may lease: pending, or in flight under an expired lease
+    """
+    return (IngestJobItem.status == JOB_ITEM_PENDING) | (
+        (IngestJobItem.status == JOB_ITEM_IN_FLIGHT) & (IngestJobItem.lease_expires_at < now)
+    )
+
+def lease_job_items(job_id, owner, limit, lease_seconds=ITEM_LEASE_SECONDS):
+    """
+    Lease the next items of a job to a worker
+    
+    On PostgreSQL the candidate rows are locked with SELECT ... FOR UPDATE SKIP
+    LOCKED, so workers leasing at the same time get different items without
+    waiting on each other. SQLite has no row locks but runs one write at a
+    time; the lease is a conditional update there, and rows another worker got
+    first are left out.
+    
+    Args:
+        job_id: ID of the job
+        owner: Worker ID recorded on the leased items
+        limit: Maximum number of items to lease
+        lease_seconds: Seconds until the lease expires unless renewed
+        
+    Returns:
+        List of (item_id, folder_id, file_path) tuples ordered by ID
+    """
+    with session_scope() as db:
+        while True:
+            now = datetime.datetime.utcnow()
+            expires = now + datetime.timedelta(seconds=lease_seconds)
+            item_ids = [row.id for row in db.query(IngestJobItem.id).filter(
+                IngestJobItem.job_id == job_id, _leasable(now)
+            ).order_by(IngestJobItem.id).limit(limit).with_for_update(skip_locked=True)]
+            if not item_ids:
+                db.commit()
+                return []
+    
+            db.query(IngestJobItem).filter(IngestJobItem.id.in_(item_ids), _leasable(now)).update({
+                IngestJobItem.status: JOB_ITEM_IN_FLIGHT,
+                IngestJobItem.lease_owner: owner,
+                IngestJobItem.lease_expires_at: expires,
+                IngestJobItem.updated_at: now
+            }, synchronize_session=False)
+            leased = db.query(IngestJobItem.id, IngestJobItem.folder_id, IngestJobItem.file_path).filter(
+                IngestJobItem.id.in_(item_ids),
+                IngestJobItem.lease_owner == owner,
+                IngestJobItem.lease_expires_at == expires
+            ).order_by(IngestJobItem.id).all()
+            db.commit()
+            if leased:
+                return leased
+            # Every candidate went to another worker in the meantime (SQLite); look again
+
+def renew_job_item_leases(job_id, owner, lease_seconds=ITEM_LEASE_SECONDS):
+    """
+    Extend the leases a worker holds on the in-flight items of a job
+    
+    Returns:
+        Number of leases renewed
+    """
+    with session_scope() as db:
+        now = datetime.datetime.utcnow()
+        renewed = db.query(IngestJobItem).filter(
+            IngestJobItem.job_id == job_id,
+            IngestJobItem.status == JOB_ITEM_IN_FLIGHT,
+            IngestJobItem.lease_owner == owner
+        ).update({
+            IngestJobItem.lease_expires_at: now + datetime.timedelta(seconds=lease_seconds)
+        }, synchronize_session=False)
+        db.commit()
+        return renewed
+
+def release_job_item_leases(job_id, owner):
+    """
+    Return the in-flight items a worker still holds to pending, for other workers to lease
+    
+    Returns:
+        Number of items released
+    """
+    with session_scope() as db:
+        released = db.query(IngestJobItem).filter(
+            IngestJobItem.job_id == job_id,
+            IngestJobItem.status == JOB_ITEM_IN_FLIGHT,
+            IngestJobItem.lease_owner == owner
+        ).update({
+            IngestJobItem.status: JOB_ITEM_PENDING,
+            IngestJobItem.lease_expires_at: None,
+            IngestJobItem.updated_at: datetime.datetime.utcnow()
+        }, synchronize_session=False)
+        db.commit()
+        return released
+
+def get_job_node_progress(job_id, window_seconds=60):
+    """
+    Break a job's progress down by the worker that leased each item
+    
+    Args:
+        job_id: ID of the job
+        window_seconds: Throughput is measured over items finished in this many seconds
+        
+    Returns:
+        List of dictionaries with node, in_flight (items under a live lease),
+        done, failed and items_per_second, ordered by node
+    """
+    with session_scope() as db:
+        now = datetime.datetime.utcnow()
+        cutoff = now - datetime.timedelta(seconds=window_seconds)
+        finished = IngestJobItem.status.in_([JOB_ITEM_DONE, JOB_ITEM_FAILED])
+        live = (IngestJobItem.status == JOB_ITEM_IN_FLIGHT) & (IngestJobItem.lease_expires_at >= now)
+        rows = db.query(
+            IngestJobItem.lease_owner,
+            sa.func.sum(sa.case((live, 1), else_=0)),
+            sa.func.sum(sa.case((IngestJobItem.status == JOB_ITEM_DONE, 1), else_=0)),
+            sa.func.sum(sa.case((IngestJobItem.status == JOB_ITEM_FAILED, 1), else_=0)),
+            sa.func.sum(sa.case((finished & (IngestJobItem.updated_at >= cutoff), 1), else_=0)),
+            sa.func.min(sa.case((finished & (IngestJobItem.updated_at >= cutoff), IngestJobItem.updated_at)),
+                        type_=DateTime)
+        ).filter(
+            IngestJobItem.job_id == job_id,
+            IngestJobItem.lease_owner.isnot(None)
+        ).group_by(IngestJobItem.lease_owner).order_by(IngestJobItem.lease_owner).all()
+        nodes = []
+        for owner, in_flight, done, failed, recent, first_recent in rows:
+            # A node that started within the window is measured from its first result
+            span = min(window_seconds, (now - first_recent).total_seconds()) if first_recent else window_seconds
+            nodes.append({
+                "node": owner,
+                "in_flight": int(in_flight or 0),
+                "done": int(done or 0),
+                "failed": int(failed or 0),
+                "items_per_second": round((recent or 0) / max(span, 1.0), 3),
+            })
+        return nodes
+
+def update_ingest_job_status(job_id, status):
+    """
+    Update the status of an ingest job, stamping start and finish times
+    
+    Returns:
+        The updated IngestJob object
+    """
+    with session_scope() as db:
+        job = db.query(IngestJob).filter(IngestJob.id == job_id).first()
+        if not job:
+            return None
+    
+        now = datetime.datetime.utcnow()
+        job.status = status
+        job.updated_at = now
+        if status == 'running' and job.started_at is None:
+            job.started_at = now
+        if status == 'completed':
+            job.finished_at = now
+    
+        db.commit()
+        db.refresh(job)
+        return job
+
+def enqueue_ingest_job(job_id, options=None):
+    """
+    Hand a job to the ingest workers
+    
+    Args:
+        job_id: ID of the job
+        options: Dictionary of pipeline options for the worker (see ingest_worker.py)
+        
+    Returns:
+        The updated IngestJob object, or None if it does not exist
+    """
+    with session_scope() as db:
+        job = db.query(IngestJob).filter(IngestJob.id == job_id).first()
+        if not job:
+            return None
+    
+        now = datetime.datetime.utcnow()
+        job.status = 'queued'
+        job.enqueued_at = now
+        job.updated_at = now
+        job.options = json.dumps(options or {})
+        job.worker_id = None
+        job.stop_requested = None
+    
+        db.commit()
+        db.refresh(job)
+        return job
+
+def claim_next_ingest_job(worker_id, exclude_ids=()):
+    """
+    Claim the oldest enqueued job that still has items to lease
+    
+    Jobs are shared: a job another worker is already running is joined as long
+    as it has pending items (or items whose lease expired), so several workers
+    can split one large job. The items themselves are leased one chunk at a
+    time with lease_job_items. Jobs with Batch API submissions whose results
+    are not ingested yet are skipped; run_ingest_job refuses them, and they
+    become claimable again once the batches are polled in.
+    
+    Args:
+        worker_id: ID of the claiming worker
+        exclude_ids: IDs of jobs the worker is already running
+        
+    Returns:
+        The claimed IngestJob object, or None if there is nothing to do
+    """
+    with session_scope() as db:
+        now = datetime.datetime.utcnow()
+        has_work = sa.exists().where(IngestJobItem.job_id == IngestJob.id, _leasable(now))
+        has_open_batch = sa.exists().where(AnalysisBatch.job_id == IngestJob.id, AnalysisBatch.ingested_at.is_(None))
+        query = db.query(IngestJob.id).filter(
+            IngestJob.status.in_(['queued', 'running']),
+            IngestJob.enqueued_at.isnot(None),
+            IngestJob.stop_requested.isnot(True),
+            has_work,
+            ~has_open_batch
+        )
+        if exclude_ids:
+            query = query.filter(IngestJob.id.notin_(list(exclude_ids)))
+    
+        for (job_id,) in query.order_by(IngestJob.enqueued_at).all():
+            claimed = db.query(IngestJob).filter(
+                IngestJob.id == job_id,
+                IngestJob.status.in_(['queued', 'running']),
+                IngestJob.stop_requested.isnot(True)
+            ).update({
+                IngestJob.status: 'running',
+                IngestJob.worker_id: worker_id,
+                IngestJob.heartbeat_at: now,
+                IngestJob.updated_at: now
+            }, synchronize_session=False)
+            db.commit()
+            if claimed:
+                return db.query(IngestJob).filter(IngestJob.id == job_id).first()
+        return None
+
+def heartbeat_ingest_job(job_id, worker_id):
+    """
+    Record that a worker is still running a job
+    
+    Returns:
+        True if a stop was requested for the job
+    """
+    with session_scope() as db:
+        now = datetime.datetime.utcnow()
+        db.query(IngestJob).filter(IngestJob.id == job_id).update({
+            IngestJob.heartbeat_at: now
+        }, synchronize_session=False)
+        db.commit()
+        return bool(db.query(IngestJob.stop_requested).filter(IngestJob.id == job_id).scalar())
+
+def request_ingest_job_stop(job_id):
+    """
+    Ask the workers running a job to stop it
+    
+    A job still waiting in the queue is stopped straight away.
+    """
+    with session_scope() as db:
+        now = datetime.datetime.utcnow()
+        db.query(IngestJob).filter(IngestJob.id == job_id, IngestJob.status == 'queued').update({
+            IngestJob.status: 'stopped',
+            IngestJob.updated_at: now
+        }, synchronize_session=False)
+        db.query(IngestJob).filter(IngestJob.id == job_id).update({
+            IngestJob.stop_requested: True
+        }, synchronize_session=False)
+        db.commit()
+
+def release_ingest_job(job_id, worker_id, status):
+    """
+    Detach a worker from a job, returning the items it still holds to pending
+    
+    Args:
+        job_id: ID of the job
+        worker_id: ID of the worker leaving the job
+        status: New job status; 'running' while other workers are still on it,
+            'queued' to let any worker pick it up again
+    """
+    release_job_item_leases(job_id, worker_id)
+    with session_scope() as db:
+        now = datetime.datetime.utcnow()
+        values = {IngestJob.status: status, IngestJob.updated_at: now}
+        if status == 'completed':
+            values[IngestJob.finished_at] = now
+        db.query(IngestJob).filter(IngestJob.id == job_id).update(values, synchronize_session=False)
+        db.query(IngestJob).filter(IngestJob.id == job_id, IngestJob.worker_id == worker_id).update({
+            IngestJob.worker_id: None
+        }, synchronize_session=False)
+        db.commit()
+
+def count_live_job_leases(job_id):
+    """
+    Count the items of a job that workers hold under a live lease
+    """
+    with session_scope() as db:
+        return db.query(sa.func.count(IngestJobItem.id)).filter(
+            IngestJobItem.job_id == job_id,
+            IngestJobItem.status == JOB_ITEM_IN_FLIGHT,
+            IngestJobItem.lease_expires_at >= datetime.datetime.utcnow()
+        ).scalar()
+
+def get_queued_ingest_jobs():
+    """
+    Get jobs waiting for or being run by live ingest workers, oldest first
+    """
+    cutoff = datetime.datetime.utcnow() - datetime.timedelta(seconds=WORKER_HEARTBEAT_TIMEOUT)
+    with session_scope() as db:
+        return db.query(IngestJob).filter(
+            IngestJob.enqueued_at.isnot(None),
+            (IngestJob.status == 'queued') | (
+                (IngestJob.status == 'running') & (IngestJob.heartbeat_at >= cutoff)
+            )
+        ).order_by(IngestJob.enqueued_at).all()
+
+def get_recent_job_results(job_id, limit=200):
+    """
+    Get the most recently finished items of a job with their analyzed images
+    
+    Returns:
+        List of (IngestJobItem, Image or None) tuples, newest first
+    """
+    with session_scope() as db:
+        return db.query(IngestJobItem, Image).outerjoin(
+            Image, IngestJobItem.image_id == Image.id
+        ).filter(
+            IngestJobItem.job_id == job_id,
+            IngestJobItem.status.in_([JOB_ITEM_DONE, JOB_ITEM_FAILED])
+        ).order_by(IngestJobItem.updated_at.desc(), IngestJobItem.id.desc()).limit(limit).all()
+
+def register_ingest_worker(worker_id, hostname, pid):
+    """
+    Record a worker process as running
+    """
+    with session_scope() as db:
+        db.merge(IngestWorker(id=worker_id, hostname=hostname, pid=pid,
+                              started_at=datetime.datetime.utcnow(), heartbeat_at=datetime.datetime.utcnow()))
+        db.commit()
+
+def heartbeat_ingest_worker(worker_id, current_job_id=None):
+    """
+    Record that a worker is alive and which job it is running
+    """
+    with session_scope() as db:
+        db.query(IngestWorker).filter(IngestWorker.id == worker_id).update({
+            IngestWorker.heartbeat_at: datetime.datetime.utcnow(),
+            IngestWorker.current_job_id: current_job_id
+        }, synchronize_session=False)
+        db.commit()
+
+def remove_ingest_worker(worker_id):
+    """
+    Remove a worker that is shutting down
+    """
+    with session_scope() as db:
+        db.query(IngestWorker).filter(IngestWorker.id == worker_id).delete(synchronize_session=False)
+        db.commit()
+
+def get_active_ingest_workers(max_age_seconds=30):
+    """
+    Get workers that sent a heartbeat within max_age_seconds
+    """
+    cutoff = datetime.datetime.utcnow() - datetime.timedelta(seconds=max_age_seconds)
+    with session_scope() as db:
+        return db.query(IngestWorker).filter(IngestWorker.heartbeat_at >= cutoff).order_by(IngestWorker.started_at).all()
+
+def get_job_items_by_ids(item_ids):
+    """
+    Get job items as (item_id, folder_id, file_path) tuples
+    """
+    if not item_ids:
+        return []
+    with session_scope() as db:
+        return db.query(IngestJobItem.id, IngestJobItem.folder_id, IngestJobItem.file_path).filter(
+            IngestJobItem.id.in_(item_ids)
+        ).all()
+
+# Batch API operations
+def add_analysis_batch(job_id, openai_batch_id, input_file_id, status, item_ids):
+    """
+    Record a submitted Batch API batch
+    
+    Args:
+        job_id: ID of the ingest job the items belong to
+        openai_batch_id: ID of the batch returned by the API
+        input_file_id: ID of the uploaded JSONL request file
+        status: Batch status reported by the API
+        item_ids: IDs of the job items submitted in the batch
+        
+    Returns:
+        The created AnalysisBatch object
+    """
+    with session_scope() as db:
+        batch = AnalysisBatch(
+            job_id=job_id,
+            openai_batch_id=openai_batch_id,
+            input_file_id=input_file_id,
+            status=status,
+            request_count=len(item_ids),
+            item_ids_json=json.dumps(list(item_ids))
+        )
+        db.add(batch)
+        db.commit()
+        return batch
+
+def get_open_analysis_batches(job_id=None):
+    """
+    Get batches whose results have not been ingested yet
+    
+    Args:
+        job_id: Optionally restrict to the batches of one job
+        
+    Returns:
+        List of AnalysisBatch objects, oldest first
+    """
+    with session_scope() as db:
+        query = db.query(AnalysisBatch).filter(AnalysisBatch.ingested_at.is_(None))
+        if job_id is not None:
+            query = query.filter(AnalysisBatch.job_id == job_id)
+        return query.order_by(AnalysisBatch.id).all()
+
+def update_analysis_batch(batch_id, **fields):
+    """
+    Update columns of a recorded batch (status, output_file_id, completed_at, ...)
+    
+    Returns:
+        The updated AnalysisBatch object
+    """
+    with session_scope() as db:
+        batch = db.query(AnalysisBatch).filter(AnalysisBatch.id == batch_id).first()
+        if not batch:
+            return None
+        for column, value in fields.items():
+            setattr(batch, column, value)
+        db.commit()
+        return batch
+
+# Performance timing operations
+def add_pipeline_timings(rows):
+    """
+    Record the stage timings of images that left the ingest pipeline
+    
+    Args:
+        rows: List of dictionaries with PipelineTiming column values
+    """
+    if not rows:
+        return
+    with session_scope() as db:
+        db.execute(sa.insert(PipelineTiming), rows)
+        db.commit()
+
+def add_cache_sample(cache, hits, misses):
+    """
+    Record a cache's hits and misses since its previous sample
+    """
+    with session_scope() as db:
+        db.add(CacheSample(cache=cache, hits=hits, misses=misses))
+        db.commit()
+
+def get_pipeline_timings(since=None):
+    """
+    Get recorded pipeline timings
+    
+    Args:
+        since: Only return timings recorded at or after this datetime (UTC)
+        
+    Returns:
+        List of dictionaries, oldest first
+    """
+    with session_scope() as db:
+        query = sa.select(*PipelineTiming.__table__.columns).order_by(PipelineTiming.recorded_at)
+        if since is not None:
+            query = query.where(PipelineTiming.recorded_at >= since)
+        return [dict(row) for row in db.execute(query).mappings()]
+
+def get_cache_samples(since=None):
+    """
+    Get recorded cache samples
+    
+    Args:
+        since: Only return samples recorded at or after this datetime (UTC)
+        
+    Returns:
+        List of dictionaries, oldest first
+    """
+    with session_scope() as db:
+        query = sa.select(*CacheSample.__table__.columns).order_by(CacheSample.recorded_at)
+        if since is not None:
+            query = query.where(CacheSample.recorded_at >= since)
+        return [dict(row) for row in db.execute(query).mappings()]
@@ -0,0 +1,124 @@
+import math
+
+_BASE32 = "0123456789bcdefghjkmnpqrstuvwxyz"
+_DECODE = {char: i for i, char in enumerate(_BASE32)}
+
+# Geohash precision used for clusters at each map zoom level (0 = whole world)
+_ZOOM_PRECISION = [2, 2, 2, 3, 3, 4, 4, 4, 5, 5, 6, 6, 6, 7, 7, 8]
+
+GEOHASH_PRECISION = 9
+EARTH_RADIUS_KM = 6371.0088
+
+def encode_geohash(latitude, longitude, precision=GEOHASH_PRECISION):
+    """
+    Encode a coordinate as a geohash
+
+    Points that share a geohash prefix lie in the same grid cell, so prefixes of
+    increasing length give a nested grid that can be grouped on in SQL.
+
+    Args:
+        latitude (float): Latitude in degrees
+        longitude (float): Longitude in degrees
+        precision (int): Number of characters (9 is about 5 m)
+
+    Returns:
+        str: The geohash, or None for missing or out-of-range coordinates
+    """
+    if latitude is None or longitude is None:
+        return None
+    if not (-90.0 <= latitude <= 90.0 and -180.0 <= longitude <= 180.0):
+        return None
+
+    lat_range = [-90.0, 90.0]
+    lon_range = [-180.0, 180.0]
+    chars = []
+    bits = 0
+    value = 0
+    even = True
+    while len(chars) < precision:
+        coord, bounds = (longitude, lon_range) if even else (latitude, lat_range)
+        middle = (bounds[0] + bounds[1]) / 2
+        value <<= 1
+        if coord >= middle:
+            value |= 1
+            bounds[0] = middle
+        else:
+            bounds[1] = middle
+        even = not even
+        bits += 1
+        if bits == 5:
+            chars.append(_BASE32[value])
+            bits = 0
+            value = 0
+    return "".join(chars)
+
+def geohash_bounds(geohash):
+    """
+    Get the bounding box of a geohash cell
+
+    Returns:
+        tuple: (min_lat, min_lon, max_lat, max_lon)
+    """
+    lat_range = [-90.0, 90.0]
+    lon_range = [-180.0, 180.0]
+    even = True
+    for char in geohash:
+        value = _DECODE[char]
+        for shift in range(4, -1, -1):
+            bounds = lon_range if even else lat_range
+            middle = (bounds[0] + bounds[1]) / 2
+            if value >> shift & 1:
+                bounds[0] = middle
+            else:
+                bounds[1] = middle
+            even = not even
+    return lat_range[0], lon_range[0], lat_range[1], lon_range[1]
+
+def precision_for_zoom(zoom):
+    """
+    Get the geohash precision to cluster on at a map zoom level
+    """
+    zoom = max(0, int(zoom))
+    return _ZOOM_PRECISION[min(zoom, len(_ZOOM_PRECISION) - 1)]
+
+def zoom_for_bbox(bbox):
+    """
+    Estimate the map zoom level that fits a bounding box
+    """
+    min_lat, min_lon, max_lat, max_lon = bbox
+    span = max(max_lat - min_lat, (max_lon - min_lon) % 360 or 360.0, 1e-6)
+    return max(0, min(15, int(math.log2(360.0 / span))))
+
+def haversine_km(lat1, lon1, lat2, lon2):
+    """
+    Great-circle distance between two coordinates in kilometres
+    """
+    phi1, phi2 = math.radians(lat1), math.radians(lat2)
+    dphi = phi2 - phi1
+    dlambda = math.radians(lon2 - lon1)
+    a = math.sin(dphi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(dlambda / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
+
+def bbox_around(latitude, longitude, radius_km):
+    """
+    Bounding box that contains every point within radius_km of a coordinate
+
+    Longitudes wrap, so min_lon may be greater than max_lon for boxes crossing
+    the antimeridian.
+
+    Returns:
+        tuple: (min_lat, min_lon, max_lat, max_lon)
+    """
+    dlat = math.degrees(radius_km / EARTH_RADIUS_KM)
+    min_lat = max(-90.0, latitude - dlat)
+    max_lat = min(90.0, latitude + dlat)
+    if min_lat <= -90.0 or max_lat >= 90.0:
+        # The circle contains a pole: every longitude is in range
+        return min_lat, -180.0, max_lat, 180.0
+
+    dlon = math.degrees(radius_km / (EARTH_RADIUS_KM * math.cos(math.radians(latitude))))
+    if dlon >= 180.0:
+        return min_lat, -180.0, max_lat, 180.0
+    min_lon = (longitude - dlon + 540.0) % 360.0 - 180.0
+    max_lon = (longitude + dlon + 540.0) % 360.0 - 180.0
+    return min_lat, min_lon, max_lat, max_lon
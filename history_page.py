@@ -2,7 +2,7 @@
 import streamlit as st
 import os
 import pandas as pd
-from database import get_all_folders, get_images_by_folder_id, FavoriteImage
+from database import get_folder_tree_summaries, get_images_by_folder_id, FavoriteImage
 import database as db
 from export_utils import export_to_csv, export_to_excel, export_to_pdf_simple, export_to_pdf_detailed
 
@@ -19,46 +19,53 @@ def show_history_page():
     </div>
     """, unsafe_allow_html=True)
     
-    # Get all folders from the database
-    folders = get_all_folders()
+    # Get all folders with their image statistics, subfolders under their parents
+    folder_data = get_folder_tree_summaries()
     
-    if not folders:
+    if not folder_data:
         st.info("No analyzed folders found in the database. Process some images first.")
         return
     
     # Convert to DataFrame for better display
-    folder_data = [{
-        "id": folder.id,
-        "name": folder.name, 
-        "path": folder.path, 
-        "processed_at": folder.processed_at,
-        "image_count": len(folder.images)
-    } for folder in folders]
-    
     folder_df = pd.DataFrame(folder_data)
-    
-    # Sort by most recent first
-    folder_df = folder_df.sort_values(by="processed_at", ascending=False)
+    folder_df["last_processed"] = folder_df["last_image_processed_at"].fillna(folder_df["processed_at"])
+    # Indent subfolders under their parents
+    folder_df["display_name"] = [
+        "\u2003" * depth + name for depth, name in zip(folder_df["depth"], folder_df["name"])
+    ]
+    
+    # Size and confidence cover each folder's subfolders too
+    folder_df["total_mb"] = folder_df["subtree_total_bytes"] / (1024 * 1024)
+    columns = ["display_name", "processed_at", "last_processed", "image_count"]
+    if folder_df["subfolder_count"].any():
+        columns += ["subtree_image_count", "subfolder_count"]
+    columns += ["total_mb", "subtree_avg_confidence"]
     
     # Display as a table
     st.markdown('<div class="card styled-table">', unsafe_allow_html=True)
     st.dataframe(
-        folder_df[["name", "processed_at", "image_count"]],
+        folder_df[columns],
         use_container_width=True,
         column_config={
-            "name": "Folder Name",
+            "display_name": "Folder Name",
             "processed_at": st.column_config.DatetimeColumn("Processed Date", format="MMM DD, YYYY, hh:mm A"),
-            "image_count": st.column_config.NumberColumn("Images")
+            "last_processed": st.column_config.DatetimeColumn("Last Image Processed", format="MMM DD, YYYY, hh:mm A"),
+            "image_count": st.column_config.NumberColumn("Images"),
+            "subtree_image_count": st.column_config.NumberColumn("Images incl. Subfolders"),
+            "subfolder_count": st.column_config.NumberColumn("Subfolders"),
+            "total_mb": st.column_config.NumberColumn("Size (MB)", format="%.1f"),
+            "subtree_avg_confidence": st.column_config.NumberColumn("Avg. Confidence", format="%.2f")
         },
         hide_index=True
     )
     st.markdown('</div>', unsafe_allow_html=True)
     
     # Let user select a folder to view details
+    folder_names = dict(zip(folder_df["id"].tolist(), folder_df["display_name"].tolist()))
     selected_folder_id = st.selectbox(
         "Select a folder to view images",
-        options=folder_df["id"].tolist(),
-        format_func=lambda x: folder_df[folder_df["id"] == x]["name"].iloc[0]
+        options=list(folder_names),
+        format_func=lambda x: folder_names[x]
     )
     
     if selected_folder_id:
@@ -69,7 +76,7 @@ def show_folder_images(folder_id):
     Display all images from a specific folder
     """
     # Get all images for the folder
-    images = get_images_by_folder_id(folder_id)
+    images = get_images_by_folder_id(folder_id, analyzed_only=True)
     
     if not images:
         st.warning("No images found for this folder")
@@ -195,8 +202,8 @@ def show_image_details(image_id):
     # Find the image in the database
     from database import get_db, Image
     
-    db = next(get_db())
-    image = db.query(Image).filter(Image.id == image_id).first()
+    db_session = get_db()
+    image = db_session.query(Image).filter(Image.id == image_id).first()
     
     if not image:
         st.error("Image not found")
@@ -232,7 +239,6 @@ def show_image_details(image_id):
         # Check if image is already in favorites
         existing_favorite = None
         try:
-            db_session = db.get_db()
             existing_favorite = db_session.query(db.FavoriteImage).filter(
                 db.FavoriteImage.image_id == image.id
             ).first()
@@ -17,15 +17,15 @@ def extract_features_from_metadata(metadata):
     """
     features = []
     
-    # Basic image dimensions
-    features.append(metadata.get('width', 0))
-    features.append(metadata.get('height', 0))
-    features.append(metadata.get('file_size', 0) / 1024)  # KB
+    # Basic image dimensions (missing values are stored as None)
+    features.append(metadata.get('width') or 0)
+    features.append(metadata.get('height') or 0)
+    features.append((metadata.get('file_size') or 0) / 1024)  # KB
     
     # Camera settings
-    features.append(metadata.get('focal_length', 0))
-    features.append(metadata.get('aperture', 0))
-    features.append(metadata.get('iso_speed', 0))
+    features.append(metadata.get('focal_length') or 0)
+    features.append(metadata.get('aperture') or 0)
+    features.append(metadata.get('iso_speed') or 0)
     
     return features
 
@@ -102,7 +102,7 @@ def show_clustering_page():
     
     # Get all images from database
     db_session = next(get_db())
-    all_images = db_session.query(Image).all()
+    all_images = db_session.query(Image).filter(Image.description.isnot(None)).all()
     
     if not all_images:
         st.info("No images available for clustering. Process some images first.")
@@ -133,7 +133,9 @@ def show_clustering_page():
         )
         
         # Filter images by folder
-        images = db_session.query(Image).filter(Image.folder_id == selected_folder_id).all()
+        images = db_session.query(Image).filter(
+            Image.folder_id == selected_folder_id, Image.description.isnot(None)
+        ).all()
     else:
         images = all_images
     
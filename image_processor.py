@@ -1,10 +1,12 @@
 import os
+import re
 import base64
 import json
-from PIL import Image
+from PIL import Image, ImageOps
 import io
 from openai import OpenAI
 from utils import is_valid_image, extract_image_metadata
+import metrics
 
 # Initialize OpenAI client
 # The newest OpenAI model is "gpt-4o" which was released May 13, 2024.
@@ -12,61 +14,449 @@ from utils import is_valid_image, extract_image_metadata
 OPENAI_API_KEY = os.environ.get("OPENAI_API_KEY", "")
 openai_client = OpenAI(api_key=OPENAI_API_KEY)
 
+ENCODE_BYTES = metrics.histogram("image_encode_bytes", "Size of base64-encoded images sent for analysis",
+                                 buckets=metrics.BYTES_BUCKETS)
+API_SECONDS = metrics.histogram("vision_api_seconds", "Latency of vision API requests, including client retries")
+API_TOKENS = metrics.counter("vision_api_tokens_total", "Tokens used by vision API requests")
+API_REQUEST_TOKENS = metrics.histogram("vision_api_request_tokens", "Tokens used by each vision API request",
+                                       buckets=metrics.TOKENS_BUCKETS)
+API_RETRIES = metrics.counter("vision_api_retries_total", "Vision API requests retried by the client")
+API_ERRORS = metrics.counter("vision_api_errors_total", "Vision API requests that failed")
+API_IMAGES = metrics.histogram("vision_api_images_per_request", "Images sent in each multi-image vision API request",
+                               buckets=(1, 2, 4, 8, 16, 32))
+
+def _record_tokens(model, prompt_tokens, completion_tokens):
+    """
+    Add a request's token usage to the token totals and the per-request distribution
+    """
+    for kind, tokens in (("prompt", prompt_tokens), ("completion", completion_tokens)):
+        API_TOKENS.inc(tokens, model=model, kind=kind)
+        API_REQUEST_TOKENS.observe(tokens, model=model, kind=kind)
+
 def encode_image_to_base64(image_path):
     """
     Encode an image file to base64 string
     """
     try:
         with open(image_path, "rb") as image_file:
-            return base64.b64encode(image_file.read()).decode('utf-8')
+            encoded = base64.b64encode(image_file.read()).decode('utf-8')
+        ENCODE_BYTES.observe(len(encoded))
+        return encoded
     except Exception as e:
         raise Exception(f"Failed to encode image: {str(e)}")
 
-def analyze_image_with_openai(base64_image):
+# Longest side of images packed into multi-image requests; at "low" detail the
+# API scales images to 512px anyway, so sending more only costs upload time
+MULTI_IMAGE_MAX_SIDE = 512
+MULTI_IMAGE_DETAIL = "low"
+
+def _encode_thumbnail(img, max_side):
+    # Let JPEG decode at reduced size
+    img.draft("RGB", (max_side, max_side))
+    img = ImageOps.exif_transpose(img).convert("RGB")
+    img.thumbnail((max_side, max_side))
+    buffer = io.BytesIO()
+    img.save(buffer, format="JPEG", quality=85)
+    return base64.b64encode(buffer.getvalue()).decode('utf-8')
+
+def encode_image_for_multi_request(image_path, max_side=MULTI_IMAGE_MAX_SIDE):
     """
-    Use OpenAI's vision capabilities to analyze an image
+    Downscale an image and encode it as a base64 JPEG for a multi-image request
     """
     try:
-        response = openai_client.chat.completions.create(
-            model="gpt-4o",
-            messages=[
-                {
-                    "role": "system",
-                    "content": "You are an expert object identifier and historian. First identify the main object in the image, then provide its name and a detailed description including historical context if relevant. Return your response as JSON with 'object_name', 'description', and 'confidence' fields."
+        with Image.open(image_path) as img:
+            encoded = _encode_thumbnail(img, max_side)
+        ENCODE_BYTES.observe(len(encoded))
+        return encoded
+    except Exception as e:
+        raise Exception(f"Failed to encode image: {str(e)}")
+
+def downscale_base64_image(base64_image, max_side=MULTI_IMAGE_MAX_SIDE):
+    """
+    Downscale an already encoded image, e.g. for a low-detail triage request
+    """
+    with Image.open(io.BytesIO(base64.b64decode(base64_image))) as img:
+        if max(img.size) <= max_side and img.format == "JPEG":
+            return base64_image
+        return _encode_thumbnail(img, max_side)
+
+# Model used for image analysis
+ANALYSIS_MODEL = "gpt-4o"
+
+# Cheaper model used to triage images before the full analysis
+TRIAGE_MODEL = "gpt-4o-mini"
+
+# USD per million prompt and completion tokens, for cost estimates
+MODEL_PRICES = {
+    "gpt-4o": (2.50, 10.00),
+    "gpt-4o-mini": (0.15, 0.60),
+}
+
+def estimate_cost(model, prompt_tokens, completion_tokens):
+    """
+    Estimate the cost of a request in USD
+
+    Returns:
+        float: Estimated cost, or None for models without a known price
+    """
+    prices = MODEL_PRICES.get(model)
+    if prices is None or prompt_tokens is None:
+        return None
+    return (prompt_tokens * prices[0] + (completion_tokens or 0) * prices[1]) / 1_000_000
+
+ANALYSIS_SYSTEM_PROMPT = "You are an expert object identifier and historian. First identify the main object in the image, then provide its name and a detailed description including historical context if relevant. Return your response as JSON with 'object_name', 'description', and 'confidence' fields."
+
+ANALYSIS_USER_PROMPT = "Identify the main object in this image. Provide the object name and a detailed description that includes historical or contextual information if relevant. Format your response as JSON."
+
+def build_analysis_request(base64_image, model=ANALYSIS_MODEL, json_mode=True):
+    """
+    Build the chat completion request body used to analyze an image
+    
+    Shared by the synchronous API calls and the Batch API submissions.
+    
+    Args:
+        base64_image (str): Base64-encoded image
+        model (str): Model to request
+        json_mode (bool): Ask for a JSON object response; some OpenAI-compatible
+            servers do not support response_format
+    """
+    request = {
+        "model": model,
+        "messages": [
+            {
+                "role": "system",
+                "content": ANALYSIS_SYSTEM_PROMPT
+            },
+            {
+                "role": "user",
+                "content": [
+                    {
+                        "type": "text",
+                        "text": ANALYSIS_USER_PROMPT
+                    },
+                    {
+                        "type": "image_url",
+                        "image_url": {"url": f"data:image/jpeg;base64,{base64_image}"}
+                    }
+                ]
+            }
+        ],
+        "max_tokens": 1000
+    }
+    if json_mode:
+        request["response_format"] = {"type": "json_object"}
+    return request
+
+MULTI_ANALYSIS_SYSTEM_PROMPT = "You are an expert object identifier and historian. You will be shown several numbered images. For each image, identify its main object, then provide its name and a detailed description including historical context if relevant. Return JSON with a 'results' list holding one entry per image, each with 'image' (the image number), 'object_name', 'description', and 'confidence' fields."
+
+# Structured output schema for multi-image responses
+MULTI_ANALYSIS_SCHEMA = {
+    "name": "image_analyses",
+    "strict": True,
+    "schema": {
+        "type": "object",
+        "properties": {
+            "results": {
+                "type": "array",
+                "items": {
+                    "type": "object",
+                    "properties": {
+                        "image": {"type": "integer"},
+                        "object_name": {"type": "string"},
+                        "description": {"type": "string"},
+                        "confidence": {"type": "number"},
+                    },
+                    "required": ["image", "object_name", "description", "confidence"],
+                    "additionalProperties": False,
                 },
-                {
-                    "role": "user",
-                    "content": [
-                        {
-                            "type": "text",
-                            "text": "Identify the main object in this image. Provide the object name and a detailed description that includes historical or contextual information if relevant. Format your response as JSON."
-                        },
-                        {
-                            "type": "image_url",
-                            "image_url": {"url": f"data:image/jpeg;base64,{base64_image}"}
-                        }
-                    ]
-                }
-            ],
-            response_format={"type": "json_object"},
-            max_tokens=1000
-        )
+            },
+        },
+        "required": ["results"],
+        "additionalProperties": False,
+    },
+}
+
+def build_multi_analysis_request(base64_images, model=ANALYSIS_MODEL, json_mode=True, detail=MULTI_IMAGE_DETAIL):
+    """
+    Build a chat completion request body that analyzes several images at once
+    
+    The instructions are sent once for all the images, and each image is
+    preceded by its number so results can be matched back to it.
+    
+    Args:
+        base64_images (list): Base64-encoded images (see encode_image_for_multi_request)
+        model (str): Model to request
+        json_mode (bool): Ask for a response matching MULTI_ANALYSIS_SCHEMA
+        detail (str): Image detail level: low, high or auto
+    """
+    content = [{
+        "type": "text",
+        "text": f"Identify the main object in each of these {len(base64_images)} images. "
+                "Return exactly one result per image, numbered as shown."
+    }]
+    for number, base64_image in enumerate(base64_images, start=1):
+        content.append({"type": "text", "text": f"Image {number}:"})
+        content.append({
+            "type": "image_url",
+            "image_url": {"url": f"data:image/jpeg;base64,{base64_image}", "detail": detail}
+        })
+
+    request = {
+        "model": model,
+        "messages": [
+            {"role": "system", "content": MULTI_ANALYSIS_SYSTEM_PROMPT},
+            {"role": "user", "content": content}
+        ],
+        "max_tokens": 400 * len(base64_images)
+    }
+    if json_mode:
+        request["response_format"] = {"type": "json_schema", "json_schema": MULTI_ANALYSIS_SCHEMA}
+    return request
+
+TRIAGE_SYSTEM_PROMPT = "You triage images before they are catalogued in detail. Look at the image briefly and return JSON with 'category' (one of photo, screenshot, document, artwork, blank, other), 'object_name' (the main object in a few words), 'summary' (one short sentence), 'quality' (0 to 1; low for blurry, dark or badly framed images), 'interest' (0 to 1; how much a detailed historical description would add) and 'confidence' (0 to 1) fields."
+
+TRIAGE_CATEGORIES = ("photo", "screenshot", "document", "artwork", "blank", "other")
+
+def build_triage_request(base64_image, model=TRIAGE_MODEL, json_mode=True):
+    """
+    Build a short, low-detail request that classifies and scores an image
+    """
+    request = {
+        "model": model,
+        "messages": [
+            {"role": "system", "content": TRIAGE_SYSTEM_PROMPT},
+            {
+                "role": "user",
+                "content": [{
+                    "type": "image_url",
+                    "image_url": {"url": f"data:image/jpeg;base64,{base64_image}", "detail": "low"}
+                }]
+            }
+        ],
+        "max_tokens": 150
+    }
+    if json_mode:
+        request["response_format"] = {"type": "json_object"}
+    return request
+
+def normalize_triage_result(result):
+    """
+    Fill in missing triage fields and clamp scores to 0-1
+    """
+    category = str(result.get("category", "other")).strip().lower()
+    triage = {
+        "category": category if category in TRIAGE_CATEGORIES else "other",
+        "object_name": result.get("object_name") or "Unknown object",
+        "summary": result.get("summary") or "No description available",
+    }
+    for field in ("quality", "interest", "confidence"):
+        try:
+            triage[field] = min(max(float(result.get(field, 0.5)), 0.0), 1.0)
+        except (TypeError, ValueError):
+            triage[field] = 0.5
+    return triage
+
+def _parse_json_object(content):
+    """
+    Parse a JSON object from a response, tolerating surrounding text or code fences
+    """
+    try:
+        return json.loads(content)
+    except json.JSONDecodeError:
+        start, end = content.find("{"), content.rfind("}")
+        if start == -1 or end <= start:
+            raise
+        return json.loads(content[start:end + 1])
+
+def normalize_analysis_result(content):
+    """
+    Parse the JSON content of an analysis response and fill in missing fields
+    """
+    return _fill_missing_fields(_parse_json_object(content))
+
+def _fill_missing_fields(result):
+    # Ensure all required fields are present
+    if 'object_name' not in result:
+        result['object_name'] = "Unknown object"
+    if 'description' not in result:
+        result['description'] = "No description available"
+    if 'confidence' not in result:
+        result['confidence'] = 0.5
+        
+    return result
+
+def _image_number(value):
+    """
+    Read an image number from a result, accepting 3, "3", "Image 3" or "#3"
+    """
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, (int, float)):
+        return int(value)
+    match = re.search(r"\d+", str(value or ""))
+    return int(match.group()) if match else None
+
+def parse_multi_analysis_result(content, count):
+    """
+    Parse a multi-image analysis response and match the results to the images
+    
+    Results are matched by the image number the model echoed. If no result has
+    a usable number but there is one result per image, they are matched in
+    order. Results with unknown or repeated numbers are ignored.
+    
+    Args:
+        content (str): Response content
+        count (int): Number of images in the request
+        
+    Returns:
+        dict: Position of the image in the request -> result; images the
+            response did not cover are missing
+    """
+    data = _parse_json_object(content)
+    entries = data.get("results") if isinstance(data, dict) else data
+    if not isinstance(entries, list):
+        raise ValueError("Response does not contain a list of results")
+
+    entries = [entry for entry in entries if isinstance(entry, dict)]
+    numbers = [_image_number(entry.get("image")) for entry in entries]
+    if all(number is None for number in numbers) and len(entries) == count:
+        numbers = list(range(1, count + 1))
+
+    results = {}
+    for number, entry in zip(numbers, entries):
+        if number is not None and 1 <= number <= count and number - 1 not in results:
+            entry = {key: value for key, value in entry.items() if key != "image"}
+            results[number - 1] = _fill_missing_fields(entry)
+    return results
+
+def analyze_image_with_openai(base64_image, trace_id=None, client=None, model=ANALYSIS_MODEL, json_mode=True):
+    """
+    Use OpenAI's vision capabilities to analyze an image
+    
+    Args:
+        base64_image (str): Base64-encoded image
+        trace_id (str): Trace the request belongs to (see metrics.new_trace_id)
+        client: OpenAI client to use (defaults to the module's client)
+        model (str): Model to request
+        json_mode (bool): Ask for a JSON object response
+        
+    Returns:
+        dict: object_name, description and confidence, plus the request's usage
+            (tokens, retries and seconds)
+    """
+    client = client or openai_client
+    try:
+        with API_SECONDS.time(trace_id=trace_id, model=model) as timing:
+            raw_response = client.chat.completions.with_raw_response.create(
+                **build_analysis_request(base64_image, model=model, json_mode=json_mode)
+            )
+        response = raw_response.parse()
+        if raw_response.retries_taken:
+            API_RETRIES.inc(raw_response.retries_taken, model=model)
+        
+        usage = {"retries": raw_response.retries_taken, "seconds": timing.seconds}
+        if response.usage is not None:
+            usage["prompt_tokens"] = response.usage.prompt_tokens
+            usage["completion_tokens"] = response.usage.completion_tokens
+            usage["cost"] = estimate_cost(model, usage["prompt_tokens"], usage["completion_tokens"])
+            _record_tokens(model, usage["prompt_tokens"], usage["completion_tokens"])
         
         # Parse the response
         content = response.choices[0].message.content
-        result = json.loads(content)
-        
-        # Ensure all required fields are present
-        if 'object_name' not in result:
-            result['object_name'] = "Unknown object"
-        if 'description' not in result:
-            result['description'] = "No description available"
-        if 'confidence' not in result:
-            result['confidence'] = 0.5
-            
+        result = normalize_analysis_result(content)
+        result['usage'] = usage
         return result
     
     except Exception as e:
+        API_ERRORS.inc(model=model)
+        raise Exception(f"OpenAI API error: {str(e)}")
+
+def analyze_images_with_openai(base64_images, trace_id=None, client=None, model=ANALYSIS_MODEL, json_mode=True,
+                               detail=MULTI_IMAGE_DETAIL):
+    """
+    Analyze several images in one request
+    
+    Args:
+        base64_images (list): Base64-encoded images (see encode_image_for_multi_request)
+        trace_id (str): Trace the request belongs to (see metrics.new_trace_id)
+        client: OpenAI client to use (defaults to the module's client)
+        model (str): Model to request
+        json_mode (bool): Ask for a response matching MULTI_ANALYSIS_SCHEMA
+        detail (str): Image detail level
+        
+    Returns:
+        dict: Position of the image in the request -> result, for the images the
+            response covered. Each result carries its share of the request's
+            tokens in its usage.
+    """
+    client = client or openai_client
+    count = len(base64_images)
+    try:
+        with API_SECONDS.time(trace_id=trace_id, model=model) as timing:
+            raw_response = client.chat.completions.with_raw_response.create(
+                **build_multi_analysis_request(base64_images, model=model, json_mode=json_mode, detail=detail)
+            )
+        response = raw_response.parse()
+        API_IMAGES.observe(count)
+        if raw_response.retries_taken:
+            API_RETRIES.inc(raw_response.retries_taken, model=model)
+
+        usage = {"retries": raw_response.retries_taken, "seconds": timing.seconds, "images": count}
+        if response.usage is not None:
+            _record_tokens(model, response.usage.prompt_tokens, response.usage.completion_tokens)
+            # Split evenly; the API does not report tokens per image
+            usage["prompt_tokens"] = round(response.usage.prompt_tokens / count)
+            usage["completion_tokens"] = round(response.usage.completion_tokens / count)
+            cost = estimate_cost(model, response.usage.prompt_tokens, response.usage.completion_tokens)
+            usage["cost"] = cost / count if cost is not None else None
+
+        results = parse_multi_analysis_result(response.choices[0].message.content, count)
+        for result in results.values():
+            result['usage'] = dict(usage)
+        return results
+
+    except Exception as e:
+        API_ERRORS.inc(model=model)
+        raise Exception(f"OpenAI API error: {str(e)}")
+
+def triage_image_with_openai(base64_image, trace_id=None, client=None, model=TRIAGE_MODEL, json_mode=True):
+    """
+    Classify and score an image with a short, low-detail request
+    
+    Args:
+        base64_image (str): Base64-encoded image, ideally already downscaled
+        trace_id (str): Trace the request belongs to (see metrics.new_trace_id)
+        client: OpenAI client to use (defaults to the module's client)
+        model (str): Model to request
+        json_mode (bool): Ask for a JSON object response
+        
+    Returns:
+        dict: category, object_name, summary, quality, interest and confidence,
+            plus the request's usage
+    """
+    client = client or openai_client
+    try:
+        with API_SECONDS.time(trace_id=trace_id, model=model) as timing:
+            raw_response = client.chat.completions.with_raw_response.create(
+                **build_triage_request(base64_image, model=model, json_mode=json_mode)
+            )
+        response = raw_response.parse()
+        if raw_response.retries_taken:
+            API_RETRIES.inc(raw_response.retries_taken, model=model)
+
+        usage = {"retries": raw_response.retries_taken, "seconds": timing.seconds}
+        if response.usage is not None:
+            usage["prompt_tokens"] = response.usage.prompt_tokens
+            usage["completion_tokens"] = response.usage.completion_tokens
+            usage["cost"] = estimate_cost(model, usage["prompt_tokens"], usage["completion_tokens"])
+            _record_tokens(model, usage["prompt_tokens"], usage["completion_tokens"])
+
+        result = normalize_triage_result(_parse_json_object(response.choices[0].message.content))
+        result['usage'] = usage
+        return result
+
+    except Exception as e:
+        API_ERRORS.inc(model=model)
         raise Exception(f"OpenAI API error: {str(e)}")
 
 def process_single_image(image_path):
@@ -0,0 +1,250 @@
+import os
+import math
+import heapq
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import database as db
+from utils import compute_dhash
+from semantic_search import description_vectors
+
+# Similarity combines three signals, each between 0 and 1: description vector
+# cosine, metadata agreement (camera, capture time, location, image size) and
+# 1 - Hamming distance / 64 of the perceptual hashes. Signals missing for
+# either image of a pair are left out of that pair's weighted average.
+DEFAULT_WEIGHTS = {"description": 0.5, "metadata": 0.2, "visual": 0.3}
+
+# Scales at which the metadata proximities fall to 1/e
+CAPTURE_TIME_SCALE_DAYS = 1.0
+LOCATION_SCALE_KM = 1.0
+EARTH_RADIUS_KM = 6371.0088
+
+def ensure_dhashes(images, max_workers=None):
+    """
+    Compute and store perceptual hashes for images analyzed before hashes were recorded
+
+    Args:
+        images (list): Image objects; their dhash attribute is filled in place
+        max_workers (int): Processes used to hash the files
+
+    Returns:
+        int: Number of hashes computed
+    """
+    missing = [img for img in images if not img.dhash and os.path.exists(img.file_path)]
+    if not missing:
+        return 0
+
+    paths = [img.file_path for img in missing]
+    if max_workers is None:
+        max_workers = os.cpu_count() or 1
+    if max_workers > 1 and len(paths) > 1:
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            hashes = list(executor.map(compute_dhash, paths, chunksize=32))
+    else:
+        hashes = [compute_dhash(path) for path in paths]
+
+    computed = {}
+    for img, value in zip(missing, hashes):
+        if value:
+            img.dhash = value
+            computed[img.id] = value
+    db.update_image_dhashes(computed)
+    return len(computed)
+
+def build_features(images):
+    """
+    Collect the per-image arrays the similarity blocks are computed from
+
+    Args:
+        images (list): Image objects
+
+    Returns:
+        dict: NumPy arrays, one row per image, with has_* masks for optional values
+    """
+    n = len(images)
+    features = {
+        "vectors": description_vectors([(img.id, img.object_name, img.description) for img in images]),
+        "has_description": np.zeros(n, dtype=bool),
+        "hashes": np.zeros(n, dtype=np.uint64),
+        "has_hash": np.zeros(n, dtype=bool),
+        "camera": np.zeros(n, dtype=np.int32),
+        "has_camera": np.zeros(n, dtype=bool),
+        "days": np.zeros(n),
+        "has_date": np.zeros(n, dtype=bool),
+        "xyz": np.zeros((n, 3), dtype=np.float32),
+        "has_location": np.zeros(n, dtype=bool),
+        "log_area": np.zeros(n, dtype=np.float32),
+        "has_size": np.zeros(n, dtype=bool),
+    }
+
+    cameras = {}
+    for i, img in enumerate(images):
+        features["has_description"][i] = bool(img.description)
+        if img.dhash:
+            features["hashes"][i] = int(img.dhash, 16)
+            features["has_hash"][i] = True
+        if img.camera_make or img.camera_model:
+            features["camera"][i] = cameras.setdefault((img.camera_make, img.camera_model), len(cameras))
+            features["has_camera"][i] = True
+        if img.date_taken:
+            features["days"][i] = img.date_taken.timestamp() / 86400.0
+            features["has_date"][i] = True
+        if img.gps_latitude is not None and img.gps_longitude is not None:
+            lat, lon = math.radians(img.gps_latitude), math.radians(img.gps_longitude)
+            features["xyz"][i] = (math.cos(lat) * math.cos(lon), math.cos(lat) * math.sin(lon), math.sin(lat))
+            features["has_location"][i] = True
+        if img.width and img.height:
+            features["log_area"][i] = math.log(img.width * img.height)
+            features["has_size"][i] = True
+    return features
+
+def _pair_mask(mask, rows):
+    return mask[rows, None] & mask[None, :]
+
+def _metadata_block(features, rows):
+    """
+    Mean of the metadata agreements available for each pair in a row block
+    """
+    total = np.zeros((len(rows), len(features["camera"])), dtype=np.float32)
+    count = np.zeros_like(total)
+
+    available = _pair_mask(features["has_camera"], rows)
+    camera = features["camera"]
+    total += available & (camera[rows, None] == camera[None, :])
+    count += available
+
+    available = _pair_mask(features["has_date"], rows)
+    days = features["days"]
+    score = np.exp(-np.abs(days[rows, None] - days[None, :]).astype(np.float32) / CAPTURE_TIME_SCALE_DAYS)
+    total += np.where(available, score, 0)
+    count += available
+
+    # Chord length between unit vectors: |a - b|^2 = 2 - 2 a.b
+    available = _pair_mask(features["has_location"], rows)
+    xyz = features["xyz"]
+    chord = np.sqrt(np.clip(2 - 2 * (xyz[rows] @ xyz.T), 0, 4))
+    distance_km = 2 * EARTH_RADIUS_KM * np.arcsin(chord / 2)
+    total += np.where(available, np.exp(-distance_km / LOCATION_SCALE_KM), 0)
+    count += available
+
+    available = _pair_mask(features["has_size"], rows)
+    log_area = features["log_area"]
+    total += np.where(available, np.exp(-np.abs(log_area[rows, None] - log_area[None, :])), 0)
+    count += available
+
+    return np.divide(total, count, out=np.zeros_like(total), where=count > 0), count > 0
+
+def similarity_blocks(features, weights=None, block_size=256):
+    """
+    Yield the combined similarity matrix one block of rows at a time
+
+    Args:
+        features (dict): Output of build_features
+        weights (dict): Weight of each signal (see DEFAULT_WEIGHTS)
+        block_size (int): Rows per block
+
+    Yields:
+        tuple: (start, block) where block is a float32 array of rows start..start+len(block)
+    """
+    weights = {**DEFAULT_WEIGHTS, **(weights or {})}
+    n = len(features["camera"])
+    vectors = features["vectors"]
+    hashes = features["hashes"]
+
+    for start in range(0, n, block_size):
+        rows = np.arange(start, min(start + block_size, n))
+        total = np.zeros((len(rows), n), dtype=np.float32)
+        weight_sum = np.zeros_like(total)
+
+        if weights["description"]:
+            available = _pair_mask(features["has_description"], rows)
+            score = np.clip(vectors[rows] @ vectors.T, 0, 1)
+            total += weights["description"] * np.where(available, score, 0)
+            weight_sum += weights["description"] * available
+
+        if weights["metadata"]:
+            score, available = _metadata_block(features, rows)
+            total += weights["metadata"] * score
+            weight_sum += weights["metadata"] * available
+
+        if weights["visual"]:
+            available = _pair_mask(features["has_hash"], rows)
+            distance = np.bitwise_count(hashes[rows, None] ^ hashes[None, :])
+            total += weights["visual"] * np.where(available, 1 - distance / np.float32(64), 0)
+            weight_sum += weights["visual"] * available
+
+        block = np.divide(total, weight_sum, out=np.zeros_like(total), where=weight_sum > 0)
+        block[np.arange(len(rows)), rows] = 1.0
+        yield start, block
+
+def _find(parent, i):
+    while parent[i] != i:
+        parent[i] = parent[parent[i]]
+        i = parent[i]
+    return i
+
+def analyze_similarity(images, weights=None, threshold=0.9, top_pairs=50, tiles=100, block_size=256):
+    """
+    Compute groups of near-identical images, the most similar pairs and a heatmap
+
+    Args:
+        images (list): Image objects (with dhash filled in where available)
+        weights (dict): Weight of each signal (see DEFAULT_WEIGHTS)
+        threshold (float): Pairs at or above this similarity are grouped together
+        top_pairs (int): Number of most similar pairs to return
+        tiles (int): The heatmap is at most tiles x tiles; larger sets are averaged into tiles
+        block_size (int): Rows per block
+
+    Returns:
+        dict: groups (lists of image indices, largest first, only groups of 2+),
+            pairs ((similarity, i, j) tuples, best first), heatmap (tile means)
+            and tile_starts (first image index of each tile)
+    """
+    n = len(images)
+    features = build_features(images)
+
+    tile_count = min(tiles, n)
+    tile_of = np.arange(n) * tile_count // n
+    tile_starts = np.flatnonzero(np.r_[True, np.diff(tile_of) > 0])
+    tile_sums = np.zeros((tile_count, tile_count))
+    tile_sizes = np.bincount(tile_of, minlength=tile_count)
+
+    parent = list(range(n))
+    best = []
+
+    for start, block in similarity_blocks(features, weights, block_size):
+        rows = np.arange(start, start + len(block))
+
+        # Heatmap tiles: sum columns into tiles, then rows
+        np.add.at(tile_sums, tile_of[rows], np.add.reduceat(block, tile_starts, axis=1))
+
+        # Only the upper triangle, each pair once
+        upper = block.copy()
+        upper[np.arange(n)[None, :] <= rows[:, None]] = -1.0
+
+        for i, j in zip(*np.nonzero(upper >= threshold)):
+            root_i, root_j = _find(parent, start + i), _find(parent, j)
+            if root_i != root_j:
+                parent[root_j] = root_i
+
+        flat = upper.ravel()
+        k = min(top_pairs, flat.size)
+        for index in np.argpartition(flat, -k)[-k:]:
+            if flat[index] < 0:
+                continue
+            item = (float(flat[index]), start + int(index // n), int(index % n))
+            if len(best) < top_pairs:
+                heapq.heappush(best, item)
+            elif item > best[0]:
+                heapq.heapreplace(best, item)
+
+    members = {}
+    for i in range(n):
+        members.setdefault(_find(parent, i), []).append(i)
+    groups = sorted((group for group in members.values() if len(group) > 1), key=len, reverse=True)
+
+    return {
+        "groups": groups,
+        "pairs": sorted(best, reverse=True),
+        "heatmap": tile_sums / np.outer(tile_sizes, tile_sizes),
+        "tile_starts": tile_starts,
+    }
@@ -0,0 +1,237 @@
+"""
+Headless batch ingest: scan, analyze and persist image folders without the Streamlit UI
+
+Usage:
+    python ingest_cli.py /photos/2023 /photos/2024 --analyze-workers 8
+    python ingest_cli.py --resume 12 --retry-failed
+    python ingest_cli.py --list-jobs
+    python ingest_cli.py /photos/archive --batch        # submit to the OpenAI Batch API
+    python ingest_cli.py --poll --wait                   # ingest finished batches
+    python ingest_cli.py /photos --metrics-port 9108 --metrics-log ingest.jsonl --trace
+    python ingest_cli.py /photos/bulk --provider local   # self-hosted model at LOCAL_VISION_BASE_URL
+    python ingest_cli.py /photos/scans --images-per-request 8
+    python ingest_cli.py /photos/2025 --enqueue         # leave the job to ingest_worker.py
+    python ingest_cli.py /nas/photos --recursive        # the folder and every subfolder
+
+Progress is written to stdout as one JSON object per line; everything else
+(including library log output) goes to stderr.
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import threading
+
+def emit(stream, event, **fields):
+    """
+    Write one JSON progress event
+    """
+    stream.write(json.dumps({"event": event, "time": time.time(), **fields}, default=str) + "\n")
+    stream.flush()
+
+def parse_args(argv=None):
+    from vision_providers import DEFAULT_CONCURRENCY
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("folders", nargs="*", help="Folders of images to process")
+    parser.add_argument("--resume", type=int, metavar="JOB_ID", help="Resume an existing job instead of creating one")
+    parser.add_argument("--retry-failed", action="store_true", help="Also retry items that failed in earlier runs")
+    parser.add_argument("--max-retries", type=int, default=3, help="Maximum retries per failed image")
+    parser.add_argument("--list-jobs", action="store_true", help="List unfinished jobs and exit")
+    parser.add_argument("--name", help="Name for the new job")
+    parser.add_argument("--recursive", action="store_true", help="Also process every subfolder of the given folders")
+    parser.add_argument("--walk-workers", type=int, default=8, help="With --recursive, threads reading directories")
+    parser.add_argument("--scan-workers", type=int, default=1, help="Threads scanning folders")
+    parser.add_argument("--metadata-workers", type=int, default=None, help="Processes extracting metadata")
+    parser.add_argument("--analyze-workers", type=int, default=4, help="Concurrent vision API requests")
+    parser.add_argument("--provider", choices=list(DEFAULT_CONCURRENCY),
+                        help="Vision provider analyzing images (default: VISION_PROVIDER or openai)")
+    parser.add_argument("--images-per-request", type=int, default=1,
+                        help="Pack this many downscaled images from a folder into each vision request")
+    parser.add_argument("--persist-workers", type=int, default=1, help="Threads writing to the database")
+    parser.add_argument("--queue-size", type=int, default=64, help="Capacity of each queue between stages")
+    parser.add_argument("--batch", action="store_true",
+                        help="Submit the job to the OpenAI Batch API instead of analyzing synchronously")
+    parser.add_argument("--enqueue", action="store_true",
+                        help="Queue the job for ingest_worker.py processes instead of running it here")
+    parser.add_argument("--poll", action="store_true", help="Check submitted batches and ingest finished ones")
+    parser.add_argument("--wait", action="store_true", help="With --batch or --poll, keep polling until all batches finish")
+    parser.add_argument("--poll-interval", type=float, default=60.0, help="Seconds between batch polls")
+    parser.add_argument("--progress-interval", type=float, default=5.0,
+                        help="Seconds between progress events (0 reports every image)")
+    parser.add_argument("--metrics-port", type=int, help="Serve Prometheus metrics on this port while running")
+    parser.add_argument("--metrics-log", help="Append metrics snapshots (and spans with --trace) to this JSON lines file")
+    parser.add_argument("--trace", action="store_true", help="With --metrics-log, record a span per stage of each image")
+    args = parser.parse_args(argv)
+
+    if not args.folders and args.resume is None and not args.list_jobs and not args.poll:
+        parser.error("give at least one folder, --resume JOB_ID, --poll or --list-jobs")
+    return args
+
+def main(argv=None):
+    args = parse_args(argv)
+
+    # Keep stdout for JSON events only
+    out = sys.stdout
+    sys.stdout = sys.stderr
+
+    import metrics
+    import database as db
+    from utils import get_all_image_files
+    from ingest_pipeline import IngestPipeline
+    from ingest_jobs import create_folder_job, fill_tree_job, run_ingest_job, get_job_progress, get_job_state
+    from batch_analysis import submit_job_batches, poll_batches, wait_for_batches
+
+    if args.metrics_log:
+        metrics.configure(args.metrics_log, trace=args.trace)
+    if args.metrics_port:
+        metrics.start_http_server(args.metrics_port)
+
+    def on_batch_status(batch, ingested):
+        if ingested is None:
+            emit(out, "batch_status", job_id=batch.job_id, batch_id=batch.openai_batch_id, status=batch.status)
+        else:
+            emit(out, "batch_ingested", job_id=batch.job_id, batch_id=batch.openai_batch_id,
+                 status=batch.status, **ingested)
+
+    def poll(job_id=None):
+        if args.wait:
+            running = wait_for_batches(job_id, poll_interval=args.poll_interval, on_status=on_batch_status)
+        else:
+            running = poll_batches(job_id, on_status=on_batch_status)
+        emit(out, "batches_polled", job_id=job_id, running=running)
+        return running
+
+    if args.list_jobs:
+        for job in db.get_incomplete_ingest_jobs():
+            # Progress across every worker running the job
+            state = get_job_state(job.id)
+            emit(out, "job", job_id=job.id, name=job.name, status=job.status, created_at=job.created_at,
+                 nodes=state["nodes"], **state["progress"])
+        return 0
+
+    if args.poll and not args.folders and args.resume is None:
+        poll()
+        return 0
+
+    if args.resume is not None:
+        job = db.get_ingest_job(args.resume)
+        if not job:
+            emit(out, "error", message=f"Ingest job with ID {args.resume} not found")
+            return 2
+    else:
+        folders = []
+        for folder_path in args.folders:
+            folder_path = os.path.abspath(folder_path)
+            if not os.path.isdir(folder_path):
+                emit(out, "error", message=f"Invalid folder path: {folder_path}")
+                return 2
+            if args.recursive:
+                # Walked once the job exists, so analysis can start with the first directory
+                folders.append((os.path.basename(folder_path) or folder_path, folder_path, []))
+                continue
+            scan_start = time.perf_counter()
+            image_files = get_all_image_files(folder_path)
+            emit(out, "scanned", folder=folder_path, images=len(image_files),
+                 seconds=round(time.perf_counter() - scan_start, 3))
+            if image_files:
+                folders.append((os.path.basename(folder_path), folder_path, image_files))
+
+        if not folders:
+            emit(out, "finished", message="No valid images found", total=0, done=0, failed=0)
+            return 0
+        job = create_folder_job(folders, name=args.name)
+
+    emit(out, "job_started", job_id=job.id, name=job.name)
+
+    items_complete = None
+    if args.recursive and args.resume is None:
+        items_complete = threading.Event()
+
+        def walk():
+            try:
+                for _, folder_path, _ in folders:
+                    walk_start = time.perf_counter()
+                    stats = fill_tree_job(job.id, folder_path, walk_workers=args.walk_workers)
+                    emit(out, "scanned", folder=folder_path, seconds=round(time.perf_counter() - walk_start, 3),
+                         **stats)
+            except Exception as e:
+                emit(out, "error", message=f"Error walking folders: {str(e)}")
+            finally:
+                items_complete.set()
+
+        walker = threading.Thread(target=walk, name="tree-walk", daemon=True)
+        walker.start()
+        if args.batch or args.enqueue:
+            # Batches and workers get the whole tree at once
+            walker.join()
+
+    if args.batch:
+        for batch in submit_job_batches(job.id):
+            emit(out, "batch_submitted", job_id=job.id, batch_id=batch.openai_batch_id,
+                 requests=batch.request_count, status=batch.status)
+        if args.wait:
+            poll(job.id)
+        progress = get_job_progress(job.id)
+        emit(out, "finished" if progress["remaining"] == 0 else "submitted", job_id=job.id, **progress)
+        return 1 if progress["failed"] else 0
+
+    if args.enqueue:
+        options = {
+            "scan_workers": args.scan_workers,
+            "metadata_workers": args.metadata_workers,
+            "analyze_workers": args.analyze_workers,
+            "persist_workers": args.persist_workers,
+            "queue_size": args.queue_size,
+            "provider": args.provider,
+            "images_per_request": args.images_per_request,
+            "retry_failed": args.retry_failed,
+            "max_retries": args.max_retries,
+        }
+        db.enqueue_ingest_job(job.id, options)
+        workers = db.get_active_ingest_workers()
+        emit(out, "enqueued", job_id=job.id, workers=len(workers), **get_job_progress(job.id))
+        return 0
+
+    pipeline = IngestPipeline(
+        scan_workers=args.scan_workers,
+        metadata_workers=args.metadata_workers,
+        analyze_workers=args.analyze_workers,
+        persist_workers=args.persist_workers,
+        queue_size=args.queue_size,
+        provider=args.provider,
+        images_per_request=args.images_per_request
+    )
+
+    last_report = 0.0
+
+    def on_result(result, progress):
+        nonlocal last_report
+        if "error" in result:
+            emit(out, "image_failed", job_id=job.id, file_path=result["file_path"], error=result["error"])
+
+        now = time.perf_counter()
+        if now - last_report >= args.progress_interval:
+            last_report = now
+            emit(out, "progress", job_id=job.id, **progress)
+
+    try:
+        progress = run_ingest_job(
+            job.id,
+            pipeline=pipeline,
+            retry_failed=args.retry_failed,
+            max_retries=args.max_retries,
+            on_result=on_result,
+            items_complete=items_complete
+        )
+    except KeyboardInterrupt:
+        emit(out, "interrupted", job_id=job.id, **get_job_progress(job.id))
+        return 130
+
+    emit(out, "finished", job_id=job.id, bottleneck=pipeline.bottleneck(),
+         stages=pipeline.metrics(), **progress)
+    return 1 if progress["failed"] else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
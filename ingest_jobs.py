@@ -0,0 +1,528 @@
+import os
+import time
+import uuid
+import socket
+import datetime
+import threading
+from collections import deque
+from ingest_pipeline import IngestPipeline
+import database as db
+
+def estimate_progress(counts, processed, elapsed):
+    """
+    Build a progress snapshot with throughput and ETA
+
+    Args:
+        counts (dict): Item counts per status
+        processed (int): Items finished during the current run
+        elapsed (float): Seconds since the current run started
+
+    Returns:
+        dict: Progress including items_per_second and eta_seconds (None until measurable)
+    """
+    total = sum(counts.values())
+    remaining = counts[db.JOB_ITEM_PENDING] + counts[db.JOB_ITEM_IN_FLIGHT]
+    rate = processed / elapsed if elapsed > 0 and processed else 0.0
+
+    return {
+        "total": total,
+        "done": counts[db.JOB_ITEM_DONE],
+        "failed": counts[db.JOB_ITEM_FAILED],
+        "remaining": remaining,
+        "items_per_second": round(rate, 3),
+        "eta_seconds": round(remaining / rate, 1) if rate > 0 else None,
+    }
+
+def get_job_progress(job_id):
+    """
+    Get a progress snapshot for a job that is not currently running
+    """
+    return estimate_progress(db.get_ingest_job_counts(job_id), 0, 0)
+
+def new_lease_owner():
+    """
+    Get an ID to lease job items under for a run in this process
+    """
+    return f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+
+def run_ingest_job(job_id, pipeline=None, retry_failed=False, max_retries=3,
+                   chunk_size=100, flush_every=20, flush_seconds=2.0, on_result=None, stop_event=None,
+                   lease_owner=None, lease_seconds=db.ITEM_LEASE_SECONDS, max_leased=None, items_complete=None):
+    """
+    Run (or resume) an ingest job until no items are left to lease
+
+    Items are leased from the job table a chunk at a time as the pipeline asks
+    for more, so several processes (see ingest_worker.py) can run the same job
+    and split its items between them. Leases are renewed while this run holds
+    them; items left in flight by a run that died are leased again once their
+    lease expires. Each result is checkpointed to the job table in small
+    batches, so a crash loses at most the last few unflushed outcomes.
+
+    Args:
+        job_id (int): ID of the job to run
+        pipeline (IngestPipeline): Pipeline to run the items through (a default one if None)
+        retry_failed (bool): Also retry items that failed in an earlier run
+        max_retries (int): Maximum number of retries for a failed item
+        chunk_size (int): Number of items leased and handed to the pipeline at a time
+        flush_every (int): Checkpoint after this many results
+        flush_seconds (float): Checkpoint at least this often while results arrive
+        on_result (callable): Called as on_result(result, progress) for each finished image
+        stop_event (threading.Event): Once set, no more items are leased and the
+            job is left 'stopped'; stop the pipeline as well to drop the items it
+            has not analyzed yet (they go back to pending)
+        lease_owner (str): ID the items are leased under (one for this run if None)
+        lease_seconds (float): Seconds a lease lasts without renewal
+        max_leased (int): Most items this run holds at once; when workers share a
+            job, keeps one from leasing far more than it can analyze while the
+            others run out of work (no limit if None)
+        items_complete (threading.Event): For jobs whose items are still being
+            added (uploads, folder trees): until it is set, the run waits for
+            more items instead of finishing when none are left to lease
+
+    Returns:
+        dict: Final progress snapshot of the job (throughput is this run's)
+    """
+    job = db.get_ingest_job(job_id)
+    if not job:
+        raise ValueError(f"Ingest job with ID {job_id} not found")
+
+    if db.get_open_analysis_batches(job_id):
+        raise ValueError(f"Ingest job {job_id} has Batch API submissions in progress; poll them instead")
+
+    if pipeline is None:
+        pipeline = IngestPipeline()
+    # The job table already knows which images are done
+    pipeline.skip_existing = False
+    if lease_owner is None:
+        lease_owner = new_lease_owner()
+
+    db.reset_job_items(job_id, retry_failed=retry_failed, max_retries=max_retries)
+    db.update_ingest_job_status(job_id, 'running')
+
+    counts = db.get_ingest_job_counts(job_id)
+    folders = {folder.id: folder for folder in db.get_all_folders()}
+    item_ids = {}
+
+    def stopping():
+        return stop_event is not None and stop_event.is_set()
+
+    def chunks():
+        # Lease items as the pipeline asks for more and group them by folder
+        leased_total = 0
+        while not stopping():
+            if max_leased is not None and leased_total - processed >= max_leased:
+                time.sleep(0.05)
+                continue
+            adding = items_complete is not None and not items_complete.is_set()
+            leased = db.lease_job_items(job_id, lease_owner, chunk_size, lease_seconds)
+            if not leased:
+                if not adding:
+                    return
+                time.sleep(0.1)
+                continue
+            leased_total += len(leased)
+            batch = []
+            batch_folder_id = None
+            for item_id, folder_id, file_path in leased:
+                if batch and folder_id != batch_folder_id:
+                    yield folder_chunk(batch_folder_id, batch)
+                    batch = []
+                batch_folder_id = folder_id
+                item_ids[file_path] = item_id
+                batch.append(file_path)
+            yield folder_chunk(batch_folder_id, batch)
+
+    def folder_chunk(folder_id, file_paths):
+        if folder_id not in folders:
+            # Added after the run started (e.g. by a tree walk)
+            folders.update((folder.id, folder) for folder in db.get_all_folders())
+        folder = folders[folder_id]
+        return (folder.name, folder.path, file_paths)
+
+    done = []
+    failed = []
+    last_flush = time.perf_counter()
+    start = time.perf_counter()
+    processed = 0
+
+    def flush():
+        nonlocal done, failed, last_flush
+        db.complete_job_items(done, failed)
+        done, failed = [], []
+        last_flush = time.perf_counter()
+        if items_complete is not None:
+            # The job grows while it runs
+            counts.update(db.get_ingest_job_counts(job_id))
+
+    def handle_result(result, completed):
+        nonlocal processed
+        item_id = item_ids.get(result["file_path"])
+        if item_id is None:
+            return
+
+        processed += 1
+        counts[db.JOB_ITEM_PENDING] -= 1
+        if "error" in result:
+            failed.append((item_id, result["error"]))
+            counts[db.JOB_ITEM_FAILED] += 1
+        else:
+            done.append((item_id, result.get("image_id")))
+            counts[db.JOB_ITEM_DONE] += 1
+
+        if len(done) + len(failed) >= flush_every or time.perf_counter() - last_flush >= flush_seconds:
+            flush()
+
+        if on_result:
+            on_result(result, estimate_progress(counts, processed, time.perf_counter() - start))
+
+    finished = threading.Event()
+
+    def renew_leases():
+        while not finished.wait(lease_seconds / 3):
+            try:
+                db.renew_job_item_leases(job_id, lease_owner, lease_seconds)
+            except Exception as e:
+                print(f"Error renewing leases of ingest job {job_id}: {str(e)}")
+
+    threading.Thread(target=renew_leases, name=f"ingest-job-{job_id}-leases", daemon=True).start()
+    try:
+        if counts[db.JOB_ITEM_PENDING] or counts[db.JOB_ITEM_IN_FLIGHT] or items_complete is not None:
+            pipeline.run(chunks(), on_result=handle_result)
+    finally:
+        finished.set()
+        flush()
+        # Items the pipeline dropped when stopped go straight back to pending
+        db.release_job_item_leases(job_id, lease_owner)
+
+    counts = db.get_ingest_job_counts(job_id)
+    if counts[db.JOB_ITEM_PENDING] == 0 and counts[db.JOB_ITEM_IN_FLIGHT] == 0:
+        db.update_ingest_job_status(job_id, 'completed')
+    elif stopping():
+        db.update_ingest_job_status(job_id, 'stopped')
+
+    return estimate_progress(counts, processed, time.perf_counter() - start)
+
+class BackgroundIngestRun:
+    """
+    An ingest job running in a background thread
+
+    The app starts runs here so the Streamlit script thread stays free: pages
+    keep working during a long run and poll the run for progress instead.
+
+    Args:
+        job_id (int): ID of the job to run
+        pipeline (IngestPipeline): Pipeline to run the items through
+        retry_failed (bool): Also retry items that failed in an earlier run
+        max_retries (int): Maximum number of retries for a failed item
+        keep_results (int): Number of most recent results kept for display
+        items_complete (threading.Event): Set once every item of a job that is
+            still being filled has been added (see run_ingest_job)
+    """
+    def __init__(self, job_id, pipeline=None, retry_failed=False, max_retries=3, keep_results=500,
+                 items_complete=None):
+        self.job_id = job_id
+        self.pipeline = pipeline or IngestPipeline()
+        self.retry_failed = retry_failed
+        self.max_retries = max_retries
+        self.items_complete = items_complete
+        self.progress = get_job_progress(job_id)
+        self.completed = 0
+        self.error = None
+        self.started_at = None
+        self.finished_at = None
+        self._results = deque(maxlen=keep_results)
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+        self._thread = threading.Thread(target=self._run, name=f"ingest-job-{job_id}", daemon=True)
+
+    def start(self):
+        self.started_at = time.time()
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """
+        Stop the run; images already being analyzed finish, the rest stay for a later resume
+        """
+        self._stop.set()
+        self.pipeline.stop()
+
+    @property
+    def running(self):
+        return self._thread.is_alive()
+
+    @property
+    def stopping(self):
+        return self._stop.is_set() and self.running
+
+    def recent_results(self):
+        """
+        Get the most recent results, newest first
+        """
+        with self._lock:
+            return list(reversed(self._results))
+
+    def _on_result(self, result, progress):
+        with self._lock:
+            self._results.append(result)
+            self.completed += 1
+            self.progress = progress
+
+    def _run(self):
+        try:
+            self.progress = run_ingest_job(
+                self.job_id, pipeline=self.pipeline, retry_failed=self.retry_failed,
+                max_retries=self.max_retries, on_result=self._on_result, stop_event=self._stop,
+                items_complete=self.items_complete
+            )
+        except Exception as e:
+            self.error = str(e)
+            print(f"Error running ingest job {self.job_id}: {str(e)}")
+        finally:
+            self.finished_at = time.time()
+
+# Runs started in this process, by job ID
+_runs = {}
+_runs_lock = threading.Lock()
+
+def start_background_run(job_id, pipeline=None, retry_failed=False, max_retries=3, items_complete=None):
+    """
+    Start running a job in a background thread
+
+    Returns:
+        BackgroundIngestRun: The started run
+
+    Raises:
+        ValueError: If the job is already running in this process
+    """
+    with _runs_lock:
+        run = _runs.get(job_id)
+        if run is not None and run.running:
+            raise ValueError(f"Ingest job {job_id} is already running")
+        run = _runs[job_id] = BackgroundIngestRun(job_id, pipeline, retry_failed, max_retries,
+                                                  items_complete=items_complete)
+    return run.start()
+
+def get_background_run(job_id):
+    """
+    Get the most recent background run of a job in this process, if any
+    """
+    with _runs_lock:
+        return _runs.get(job_id)
+
+def running_job_ids():
+    """
+    Get the IDs of jobs with a background run in progress
+    """
+    with _runs_lock:
+        return {job_id for job_id, run in _runs.items() if run.running}
+
+# IngestPipeline arguments that can be passed to workers as job options
+PIPELINE_OPTIONS = ("scan_workers", "metadata_workers", "analyze_workers", "persist_workers",
+                    "queue_size", "provider", "images_per_request")
+
+def pipeline_from_options(options):
+    """
+    Build a pipeline from job options, ignoring options that are not pipeline arguments
+    """
+    return IngestPipeline(**{key: value for key, value in options.items() if key in PIPELINE_OPTIONS and value is not None})
+
+def get_job_state(job_id):
+    """
+    Get the live state of a job, whether it runs in this process or on ingest workers
+
+    When workers share a job, progress is aggregated across them: the counts
+    come from the job table and throughput is the sum of each node's.
+
+    Returns:
+        dict: active (bool), stopping (bool), runner ('app', the ID of the last
+            worker to join, or None while queued), nodes (per-node progress, see
+            database.get_job_node_progress), progress, and error (str or None)
+    """
+    run = get_background_run(job_id)
+    if run is not None and run.running:
+        return {"active": True, "stopping": run.stopping, "runner": "app", "nodes": [],
+                "progress": run.progress, "error": None}
+
+    job = db.get_ingest_job(job_id)
+    progress = get_job_progress(job_id)
+    inactive = {"active": False, "stopping": False, "runner": None, "nodes": [], "progress": progress, "error": None}
+    if job is None or job.enqueued_at is None or job.status not in ('queued', 'running'):
+        return {**inactive, "error": run.error if run is not None else None}
+
+    nodes = []
+    if job.status == 'running':
+        silent = (datetime.datetime.utcnow() - job.heartbeat_at).total_seconds() if job.heartbeat_at else None
+        if silent is None or silent > db.WORKER_HEARTBEAT_TIMEOUT:
+            if job.worker_id is None:
+                # Resumed in an app process after being queued
+                return inactive
+            return {**inactive, "runner": job.worker_id,
+                    "error": f"Ingest worker {job.worker_id} stopped responding; resume the job to continue"}
+        nodes = [node for node in db.get_job_node_progress(job_id) if node["in_flight"] or node["items_per_second"]]
+        rate = sum(node["items_per_second"] for node in nodes)
+        if rate:
+            progress["items_per_second"] = round(rate, 3)
+            progress["eta_seconds"] = round(progress["remaining"] / rate, 1)
+
+    return {
+        "active": True,
+        "stopping": bool(job.stop_requested),
+        "runner": job.worker_id or (nodes[0]["node"] if nodes else None),
+        "nodes": nodes,
+        "progress": progress,
+        "error": None,
+    }
+
+def get_recent_results(job_id, limit=200):
+    """
+    Get the most recently finished results of a job, newest first
+    """
+    run = get_background_run(job_id)
+    if run is not None and run.running:
+        return run.recent_results()[:limit]
+
+    results = []
+    for item, image in db.get_recent_job_results(job_id, limit):
+        if image is not None:
+            results.append({
+                "file_path": image.file_path,
+                "file_name": image.file_name,
+                "object_name": image.object_name,
+                "description": image.description,
+                "confidence": image.confidence,
+            })
+        else:
+            results.append({
+                "file_path": item.file_path,
+                "file_name": os.path.basename(item.file_path),
+                "object_name": "Error",
+                "description": f"Failed to process: {item.last_error}",
+                "confidence": 0,
+            })
+    return results
+
+def stop_job(job_id):
+    """
+    Stop a job running in this process, or ask its worker to stop it
+    """
+    run = get_background_run(job_id)
+    if run is not None and run.running:
+        run.stop()
+    else:
+        db.request_ingest_job_stop(job_id)
+
+def create_folder_job(folders, name=None):
+    """
+    Create an ingest job for a list of folders
+
+    Args:
+        folders (list): (folder_name, folder_path, image_files) tuples
+        name (str): Job name (defaults to the folder names)
+
+    Returns:
+        IngestJob: The created job
+    """
+    if name is None:
+        name = ", ".join(folder_name for folder_name, _, _ in folders)
+    return db.create_ingest_job(name, folders)
+
+def fill_tree_job(job_id, root, walk_workers=8):
+    """
+    Walk a folder tree and add its images to a job one directory at a time
+
+    Directories are read in parallel and each one's images are added as soon
+    as it has been read, so a run waiting on the job can start before the walk
+    finishes. Every directory holding images gets a folder row linked to its
+    parent; directories without images only get one when a subfolder needs it.
+
+    Args:
+        job_id (int): ID of a job created for the tree root
+        root (str): Root of the tree
+        walk_workers (int): Threads reading directories
+
+    Returns:
+        dict: directories walked, folders with images, images added
+    """
+    from utils import walk_image_tree
+
+    root = os.path.abspath(root)
+    folder_ids = {}
+    stats = {"directories": 0, "folders": 0, "images": 0}
+
+    def folder_id(path):
+        # Create the folder and any missing ancestors up to the root, top down
+        missing = []
+        while path not in folder_ids:
+            missing.append(path)
+            if path == root:
+                break
+            path = os.path.dirname(path)
+        for path in reversed(missing):
+            parent_id = None if path == root else folder_ids[os.path.dirname(path)]
+            folder_ids[path] = db.add_folder(os.path.basename(path) or path, path, parent_id=parent_id).id
+        return folder_ids[path]
+
+    for directory, _, image_files in walk_image_tree(root, max_workers=walk_workers):
+        stats["directories"] += 1
+        if not image_files:
+            continue
+        folder_id(directory)
+        for start in range(0, len(image_files), 1000):
+            stats["images"] += db.add_ingest_job_items(job_id, directory, image_files[start:start + 1000])
+        stats["folders"] += 1
+    return stats
+
+def start_tree_job(root, pipeline=None, walk_workers=8, name=None, enqueue_options=None):
+    """
+    Create a job for a folder and all of its subfolders
+
+    The tree is walked in a background thread. Without enqueue_options the
+    job runs in this process while the walk goes on, starting with the first
+    directory read. With enqueue_options it is queued for the ingest workers
+    once the walk has finished.
+
+    Args:
+        root (str): Root of the tree
+        pipeline (IngestPipeline): Pipeline to analyze the images with (in-process runs)
+        walk_workers (int): Threads reading directories
+        name (str): Job name (defaults to the root folder's name)
+        enqueue_options (dict): Pipeline options for the ingest workers, or None to run here
+
+    Returns:
+        IngestJob: The created job
+    """
+    root = os.path.abspath(root)
+    folder_name = os.path.basename(root) or root
+    job = create_folder_job([(folder_name, root, [])], name=name or folder_name)
+    items_complete = threading.Event()
+    if enqueue_options is None:
+        start_background_run(job.id, pipeline=pipeline, items_complete=items_complete)
+
+    def fill():
+        try:
+            fill_tree_job(job.id, root, walk_workers=walk_workers)
+        except Exception as e:
+            print(f"Error walking {root} for ingest job {job.id}: {str(e)}")
+        finally:
+            items_complete.set()
+        if enqueue_options is not None:
+            db.enqueue_ingest_job(job.id, enqueue_options)
+
+    threading.Thread(target=fill, name=f"tree-walk-{job.id}", daemon=True).start()
+    return job
+
+def format_eta(seconds):
+    """
+    Format an ETA in seconds for display
+    """
+    if seconds is None:
+        return "estimating..."
+    seconds = int(seconds)
+    hours, remainder = divmod(seconds, 3600)
+    minutes, seconds = divmod(remainder, 60)
+    if hours:
+        return f"{hours}h {minutes}m"
+    if minutes:
+        return f"{minutes}m {seconds}s"
+    return f"{seconds}s"
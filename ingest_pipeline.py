@@ -0,0 +1,562 @@
+import os
+import time
+import uuid
+import datetime
+import queue
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from utils import scan_folder, extract_image_metadata
+from image_processor import encode_image_to_base64, encode_image_for_multi_request
+from vision_providers import VisionProvider, get_provider
+from semantic_search import index_images
+import database as db
+import metrics
+
+# Marks the end of a stage's input
+_DONE = object()
+
+SCAN_SECONDS = metrics.histogram("ingest_scan_seconds", "Time to list a folder and look up its existing results")
+METADATA_SECONDS = metrics.histogram("ingest_metadata_seconds", "Time to extract metadata from an image")
+ENCODE_SECONDS = metrics.histogram("ingest_encode_seconds", "Time to read and base64-encode an image")
+DB_WRITE_SECONDS = metrics.histogram("db_write_seconds", "Latency of database writes")
+INDEX_SECONDS = metrics.histogram("ingest_index_seconds", "Time to add an analyzed image to the semantic index")
+IMAGES_TOTAL = metrics.counter("ingest_images_total", "Images that left the ingest pipeline")
+
+# Pipeline timings are written to the database in batches of this many images
+TIMINGS_BATCH_SIZE = 100
+
+class StageMetrics:
+    """
+    Throughput counters for a single pipeline stage
+    """
+    def __init__(self, name, workers):
+        self.name = name
+        self.workers = workers
+        self.processed = 0
+        self.emitted = 0
+        self.errors = 0
+        self.busy_seconds = 0.0
+        self.blocked_seconds = 0.0
+        self.started_at = None
+        self.finished_at = None
+        self.queue = None
+        self._lock = threading.Lock()
+
+    def record(self, busy_seconds, error=False):
+        with self._lock:
+            self.processed += 1
+            self.busy_seconds += busy_seconds
+            if error:
+                self.errors += 1
+
+    def record_emit(self, blocked_seconds):
+        with self._lock:
+            self.emitted += 1
+            self.blocked_seconds += blocked_seconds
+
+    @property
+    def elapsed(self):
+        if self.started_at is None:
+            return 0.0
+        return (self.finished_at or time.perf_counter()) - self.started_at
+
+    @property
+    def throughput(self):
+        """
+        Items passed downstream per second since the stage started
+        """
+        return self.emitted / self.elapsed if self.elapsed > 0 else 0.0
+
+    @property
+    def load(self):
+        """
+        Busy seconds per worker; the stage with the highest load limits the pipeline
+        """
+        return self.busy_seconds / self.workers
+
+    @property
+    def utilization(self):
+        """
+        Fraction of the stage's worker time spent doing work (1.0 = saturated)
+        """
+        capacity = self.elapsed * self.workers
+        return min(self.busy_seconds / capacity, 1.0) if capacity > 0 else 0.0
+
+    def as_dict(self):
+        return {
+            "stage": self.name,
+            "workers": self.workers,
+            "processed": self.processed,
+            "emitted": self.emitted,
+            "errors": self.errors,
+            "items_per_second": round(self.throughput, 3),
+            "avg_seconds_per_item": round(self.busy_seconds / self.processed, 4) if self.processed else 0.0,
+            "utilization": round(self.utilization, 3),
+            "load_seconds": round(self.load, 3),
+            "blocked_seconds": round(self.blocked_seconds, 3),
+            "queue_depth": self.queue.qsize() if self.queue is not None else 0,
+        }
+
+class _Stage:
+    """
+    A pool of worker threads reading from one bounded queue and writing to the next
+
+    flush, if given, is called as flush(emit) once the input is exhausted, before
+    the downstream stage is told there is nothing more to come.
+    """
+    def __init__(self, name, func, workers, input_queue, output_queue, flush=None):
+        self.name = name
+        self.func = func
+        self.flush = flush
+        self.workers = max(1, int(workers))
+        self.input_queue = input_queue
+        self.output_queue = output_queue
+        self.metrics = StageMetrics(name, self.workers)
+        self.metrics.queue = input_queue
+        self.downstream_workers = 1
+        self._remaining = self.workers
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._threads = []
+
+    def emit(self, item):
+        # Blocks while the downstream queue is full (backpressure)
+        start = time.perf_counter()
+        self.output_queue.put(item)
+        blocked = time.perf_counter() - start
+        self._local.blocked = getattr(self._local, "blocked", 0.0) + blocked
+        self.metrics.record_emit(blocked)
+
+    def start(self):
+        self.metrics.started_at = time.perf_counter()
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._work, name=f"ingest-{self.name}-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def _work(self):
+        while True:
+            item = self.input_queue.get()
+            if item is _DONE:
+                break
+
+            start = time.perf_counter()
+            self._local.blocked = 0.0
+            error = False
+            try:
+                self.func(item, self.emit)
+            except Exception as e:
+                # Pass the failure downstream so it is reported with the results
+                error = True
+                if isinstance(item, dict):
+                    item["error"] = f"{self.name}: {str(e)}"
+                    self.emit(item)
+                elif isinstance(item, list):
+                    for entry in item:
+                        entry.setdefault("error", f"{self.name}: {str(e)}")
+                        self.emit(entry)
+                elif isinstance(item, tuple) and item[2]:
+                    # A folder failed before its images were emitted: report each of
+                    # them, so callers tracking the files (e.g. leased job items) get
+                    # a result for every one
+                    for file_path in item[2]:
+                        self.emit({
+                            "file_path": file_path,
+                            "file_name": os.path.basename(file_path),
+                            "error": f"{self.name}: {str(e)}",
+                            "started_at": start,
+                            "timings": {},
+                        })
+                else:
+                    print(f"Error in {self.name} stage: {str(e)}")
+            # Time spent waiting on a full downstream queue is not work
+            busy = time.perf_counter() - start - self._local.blocked
+            self.metrics.record(busy, error=error)
+
+        with self._lock:
+            self._remaining -= 1
+            last_worker = self._remaining == 0
+
+        if last_worker:
+            if self.flush is not None:
+                try:
+                    self.flush(self.emit)
+                except Exception as e:
+                    print(f"Error flushing {self.name} stage: {str(e)}")
+            self.metrics.finished_at = time.perf_counter()
+            for _ in range(self.downstream_workers):
+                self.output_queue.put(_DONE)
+
+class IngestPipeline:
+    """
+    Staged ingest pipeline: scan -> metadata -> analyze -> persist
+
+    Each stage runs its own pool of workers and stages are connected by bounded
+    queues, so a slow stage applies backpressure instead of stalling the others.
+    Per-stage metrics show which stage limits throughput.
+
+    Args:
+        scan_workers (int): Threads validating folders for image files
+        metadata_workers (int): Processes extracting metadata (0 extracts in-thread)
+        analyze_workers (int): Threads calling the vision API (the provider's
+            concurrency limit still applies)
+        persist_workers (int): Threads writing results to the database
+        queue_size (int): Capacity of each queue between stages
+        skip_existing (bool): Reuse results for images already analyzed
+        provider (VisionProvider or str): Provider, or provider name, that analyzes
+            images (defaults to VISION_PROVIDER)
+        images_per_request (int): Images from the same folder packed, downscaled,
+            into each vision request when the provider supports it; 1 sends each
+            image on its own at full size
+    """
+    def __init__(self, scan_workers=1, metadata_workers=None, analyze_workers=4,
+                 persist_workers=1, queue_size=64, skip_existing=True, provider=None, images_per_request=1):
+        if metadata_workers is None:
+            metadata_workers = min(4, os.cpu_count() or 1)
+        self.scan_workers = scan_workers
+        self.metadata_workers = metadata_workers
+        self.analyze_workers = analyze_workers
+        self.persist_workers = persist_workers
+        self.queue_size = queue_size
+        self.skip_existing = skip_existing
+        self.provider = provider if isinstance(provider, VisionProvider) else get_provider(provider)
+        self.images_per_request = max(1, int(images_per_request))
+        self._groups = {}
+        self._stop = threading.Event()
+        self.stages = []
+        self.total_images = 0
+        self.scan_complete = False
+        self._executor = None
+        self._count_lock = threading.Lock()
+
+    # Stage functions
+
+    def _scan(self, folder, emit):
+        folder_name, folder_path, image_files = folder
+        with SCAN_SECONDS.time():
+            db_folder = db.add_folder(folder_name, folder_path)
+
+            if image_files is None:
+                manifest = scan_folder(folder_path)
+                image_files = manifest["image_files"] if manifest else []
+
+            existing = {}
+            if self.skip_existing:
+                existing = {
+                    img.file_path: img for img in db.get_images_by_folder_id(db_folder.id)
+                    if img.description is not None
+                }
+
+        with self._count_lock:
+            self.total_images += len(image_files)
+
+        for img_path in image_files:
+            if self._stop.is_set():
+                break
+            item = {
+                "folder_id": db_folder.id,
+                "file_path": img_path,
+                "file_name": os.path.basename(img_path),
+                "trace_id": metrics.new_trace_id(),
+                "started_at": time.perf_counter(),
+                "timings": {},
+            }
+            existing_image = existing.get(img_path)
+            if existing_image:
+                # Use existing result
+                item.update({
+                    "object_name": existing_image.object_name,
+                    "description": existing_image.description,
+                    "confidence": existing_image.confidence,
+                    "cached": True,
+                })
+            emit(item)
+
+    def _extract_metadata(self, item, emit):
+        if self._stop.is_set():
+            return
+        if not item.get("cached") and "error" not in item:
+            # Timed here rather than in the worker process, whose metrics would be lost
+            with METADATA_SECONDS.time(trace_id=item["trace_id"]) as timing:
+                if self._executor is not None:
+                    item["metadata"] = self._executor.submit(extract_image_metadata, item["file_path"]).result()
+                else:
+                    item["metadata"] = extract_image_metadata(item["file_path"])
+            item["timings"]["metadata_seconds"] = timing.seconds
+        emit(item)
+
+    def _analyze(self, item, emit):
+        if self._stop.is_set():
+            return
+        if not item.get("cached") and "error" not in item:
+            with ENCODE_SECONDS.time(trace_id=item["trace_id"]) as timing:
+                base64_image = encode_image_to_base64(item["file_path"])
+            item["timings"]["encode_seconds"] = timing.seconds
+            item["timings"]["encoded_bytes"] = len(base64_image)
+            result = self.provider.analyze(base64_image, trace_id=item["trace_id"])
+            item["timings"].update(_usage_timings(result.get("usage", {})))
+            item["object_name"] = result.get("object_name", "Unknown")
+            item["description"] = result.get("description", "No description available")
+            item["confidence"] = result.get("confidence", 0)
+        emit(item)
+
+    def _group(self, item, emit):
+        # Collect images needing analysis into per-folder groups of images_per_request
+        if self._stop.is_set():
+            return
+        if item.get("cached") or "error" in item:
+            emit([item])
+            return
+        with self._count_lock:
+            group = self._groups.setdefault(item["folder_id"], [])
+            group.append(item)
+            if len(group) < self.images_per_request:
+                return
+            del self._groups[item["folder_id"]]
+        emit(group)
+
+    def _flush_groups(self, emit):
+        with self._count_lock:
+            groups = list(self._groups.values())
+            self._groups = {}
+        for group in groups:
+            emit(group)
+
+    def _analyze_group(self, group, emit):
+        if self._stop.is_set():
+            return
+        pending = []
+        images = []
+        for item in group:
+            if item.get("cached") or "error" in item:
+                continue
+            try:
+                with ENCODE_SECONDS.time(trace_id=item["trace_id"]) as timing:
+                    base64_image = encode_image_for_multi_request(item["file_path"])
+            except Exception as e:
+                item["error"] = f"analyze: {str(e)}"
+                continue
+            item["timings"]["encode_seconds"] = timing.seconds
+            item["timings"]["encoded_bytes"] = len(base64_image)
+            pending.append(item)
+            images.append(base64_image)
+
+        # The request covers several images, so it is not traced under any one of them
+        results = self.provider.analyze_many(images) if images else []
+        for item, result in zip(pending, results):
+            if isinstance(result, Exception):
+                item["error"] = f"analyze: {str(result)}"
+                continue
+            item["timings"].update(_usage_timings(result.get("usage", {})))
+            item["object_name"] = result.get("object_name", "Unknown")
+            item["description"] = result.get("description", "No description available")
+            item["confidence"] = result.get("confidence", 0)
+
+        for item in group:
+            emit(item)
+
+    def _persist(self, item, emit):
+        if not item.get("cached") and "error" not in item:
+            with DB_WRITE_SECONDS.time(trace_id=item["trace_id"], operation="add_image_result") as timing:
+                image = db.add_image_result(
+                    folder_id=item["folder_id"],
+                    file_name=item["file_name"],
+                    file_path=item["file_path"],
+                    object_name=item["object_name"],
+                    description=item["description"],
+                    confidence=item["confidence"],
+                    metadata=item.get("metadata", {})
+                )
+            item["image_id"] = image.id
+            item["timings"]["db_write_seconds"] = timing.seconds
+            with INDEX_SECONDS.time(trace_id=item["trace_id"]) as timing:
+                index_images([(image.id, item["object_name"], item["description"])])
+            item["timings"]["index_seconds"] = timing.seconds
+        emit(item)
+
+    # Running
+
+    def stop(self):
+        """
+        Stop the current run early
+
+        Images already being analyzed are finished and saved; images that have
+        not reached the vision API are dropped without a result.
+        """
+        self._stop.set()
+
+    def run(self, folders, on_result=None):
+        """
+        Run the pipeline over one or more folders
+
+        Args:
+            folders (list): (folder_name, folder_path, image_files) tuples; image_files
+                may be None to scan the folder for images
+            on_result (callable): Called as on_result(result, completed) from the
+                calling thread as each image leaves the pipeline
+
+        Returns:
+            list: One result dictionary per image, in completion order
+        """
+        specs = [
+            ("scan", self._scan, self.scan_workers, None),
+            ("metadata", self._extract_metadata, max(1, self.metadata_workers), None),
+            ("analyze", self._analyze, self.analyze_workers, None),
+            ("persist", self._persist, self.persist_workers, None),
+        ]
+        self._groups = {}
+        if self.images_per_request > 1 and self.provider.supports_multi_image:
+            specs[2:3] = [
+                ("group", self._group, 1, self._flush_groups),
+                ("analyze", self._analyze_group, self.analyze_workers, None),
+            ]
+        queues = [queue.Queue(maxsize=self.queue_size) for _ in range(len(specs) + 1)]
+        self.stages = [
+            _Stage(name, func, workers, queues[i], queues[i + 1], flush=flush)
+            for i, (name, func, workers, flush) in enumerate(specs)
+        ]
+        for stage, downstream in zip(self.stages, self.stages[1:]):
+            stage.downstream_workers = downstream.workers
+
+        self.total_images = 0
+        self.scan_complete = False
+        self._stop.clear()
+        self.run_id = uuid.uuid4().hex
+        timings = []
+        cached = analyzed = 0
+
+        if self.metadata_workers > 0:
+            self._executor = ProcessPoolExecutor(max_workers=self.metadata_workers)
+
+        results = []
+        try:
+            for stage in self.stages:
+                stage.start()
+
+            # Feed the folders from a separate thread so results can be drained here
+            def feed():
+                for folder in folders:
+                    queues[0].put(folder)
+                for _ in range(self.stages[0].workers):
+                    queues[0].put(_DONE)
+
+            threading.Thread(target=feed, name="ingest-feed", daemon=True).start()
+
+            output = queues[-1]
+            while True:
+                item = output.get()
+                if item is _DONE:
+                    break
+                result = _format_result(item)
+                results.append(result)
+                status = "failed" if "error" in item else "cached" if item.get("cached") else "analyzed"
+                IMAGES_TOTAL.inc(status=status)
+                if status == "cached":
+                    cached += 1
+                else:
+                    analyzed += status == "analyzed"
+                    timings.append({
+                        "run_id": self.run_id,
+                        "provider": self.provider.name,
+                        "image_id": item.get("image_id"),
+                        "status": status,
+                        "recorded_at": datetime.datetime.utcnow(),
+                        "total_seconds": time.perf_counter() - item["started_at"],
+                        **item["timings"],
+                    })
+                    if len(timings) >= TIMINGS_BATCH_SIZE:
+                        self._record_timings(timings)
+                        timings = []
+                if on_result:
+                    self.scan_complete = self.stages[0].metrics.finished_at is not None
+                    on_result(result, len(results))
+        finally:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False, cancel_futures=True)
+                self._executor = None
+            self._record_timings(timings)
+            if cached or analyzed:
+                # Reuse of earlier results counts as hits of the "ingest" cache
+                self._record_cache_sample(cached, analyzed)
+            metrics.write_snapshot()
+
+        self.scan_complete = True
+        return results
+
+    def _record_timings(self, timings):
+        # Timings are informational; failing to store them must not stop the ingest
+        try:
+            db.add_pipeline_timings(timings)
+        except Exception as e:
+            print(f"Error recording pipeline timings: {str(e)}")
+
+    def _record_cache_sample(self, hits, misses):
+        try:
+            db.add_cache_sample("ingest", hits, misses)
+        except Exception as e:
+            print(f"Error recording cache sample: {str(e)}")
+
+    def metrics(self):
+        """
+        Get per-stage throughput metrics for the last run
+
+        Returns:
+            list: One dictionary per stage
+        """
+        return [stage.metrics.as_dict() for stage in self.stages]
+
+    def bottleneck(self):
+        """
+        Get the name of the stage that limits throughput (most busy time per worker)
+        """
+        if not self.stages:
+            return None
+        return max(self.stages, key=lambda stage: stage.metrics.load).name
+
+def _usage_timings(usage):
+    """
+    Pipeline timing columns for a provider result's usage
+    """
+    triage = usage.get("triage", {})
+    triage_tokens = triage.get("prompt_tokens")
+    if triage_tokens is not None:
+        triage_tokens += triage.get("completion_tokens") or 0
+    return {
+        "api_seconds": usage.get("seconds"),
+        "prompt_tokens": usage.get("prompt_tokens"),
+        "completion_tokens": usage.get("completion_tokens"),
+        "retries": usage.get("retries"),
+        "images_per_request": usage.get("images"),
+        "cost_usd": usage.get("cost"),
+        "tier": usage.get("tier"),
+        "triage_seconds": triage.get("seconds"),
+        "triage_tokens": triage_tokens,
+        "triage_cost_usd": triage.get("cost"),
+    }
+
+def _format_result(item):
+    """
+    Convert an internal pipeline item into the result dictionary used by the UI
+    """
+    if "error" in item:
+        return {
+            "file_path": item["file_path"],
+            "file_name": item["file_name"],
+            "object_name": "Error",
+            "description": f"Failed to process: {item['error']}",
+            "confidence": 0,
+            "error": item["error"],
+        }
+
+    result = {
+        "file_path": item["file_path"],
+        "file_name": item["file_name"],
+        "object_name": item.get("object_name", "Unknown"),
+        "description": item.get("description", "No description available"),
+        "confidence": item.get("confidence", 0),
+    }
+    if "metadata" in item:
+        result["metadata"] = item["metadata"]
+    if "image_id" in item:
+        result["image_id"] = item["image_id"]
+    return result
@@ -0,0 +1,240 @@
+"""
+Ingest worker: a long-running process that claims queued jobs from the database and runs them
+
+The app and ingest_cli.py --enqueue only put jobs in the queue, so processing
+does not depend on a browser session staying open. Several workers (on one
+machine or several sharing the database) form a pool. Workers share jobs:
+each one leases the job's items a few at a time, so a large archive is split
+between every worker running it. A worker that dies leaves leases that expire,
+and its items go to the others.
+
+Usage:
+    python ingest_worker.py                        # run until stopped (Ctrl+C or SIGTERM)
+    python ingest_worker.py --max-jobs 2           # run two jobs at a time
+    python ingest_worker.py --once                 # run the queued jobs, then exit
+    OPENAI_API_KEY=... python ingest_worker.py --requests-per-minute 500   # this node's API budget
+
+On shutdown the jobs in progress finish the images already at the vision API,
+and the items not yet analyzed go back to the queue for the other workers. Events are written to stdout as
+one JSON object per line.
+"""
+import os
+import sys
+import json
+import time
+import uuid
+import signal
+import socket
+import argparse
+import threading
+
+def emit(stream, event, **fields):
+    """
+    Write one JSON event
+    """
+    stream.write(json.dumps({"event": event, "time": time.time(), **fields}, default=str) + "\n")
+    stream.flush()
+
+def parse_args(argv=None):
+    from vision_providers import DEFAULT_CONCURRENCY
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--max-jobs", type=int, default=1, help="Jobs run at the same time")
+    parser.add_argument("--poll-interval", type=float, default=2.0, help="Seconds between checks of an empty queue")
+    parser.add_argument("--heartbeat-interval", type=float, default=2.0,
+                        help="Seconds between heartbeats (also how quickly stop requests are noticed)")
+    parser.add_argument("--once", action="store_true", help="Exit when the queue is empty")
+    parser.add_argument("--analyze-workers", type=int, help="Default concurrent vision API requests per job")
+    parser.add_argument("--metadata-workers", type=int, help="Default metadata processes per job")
+    parser.add_argument("--provider", choices=list(DEFAULT_CONCURRENCY),
+                        help="Default vision provider for jobs that do not choose one")
+    parser.add_argument("--requests-per-minute", type=float,
+                        help="Vision API requests this worker may send per minute, across all its jobs")
+    parser.add_argument("--lease-size", type=int, default=20, help="Items leased from a job at a time")
+    parser.add_argument("--lease-seconds", type=float, default=None,
+                        help="Seconds before the items of a worker that stopped responding go to other workers")
+    parser.add_argument("--metrics-port", type=int, help="Serve Prometheus metrics on this port")
+    return parser.parse_args(argv)
+
+class Worker:
+    """
+    Claims queued ingest jobs and runs them, max_jobs at a time
+
+    Args:
+        out: Stream for JSON events
+        max_jobs (int): Jobs run at the same time
+        poll_interval (float): Seconds between checks of an empty queue
+        heartbeat_interval (float): Seconds between heartbeats
+        once (bool): Exit when the queue is empty
+        defaults (dict): Pipeline options for jobs that do not set them
+        lease_size (int): Items leased from a job at a time
+        lease_seconds (float): Seconds a lease lasts without renewal
+    """
+    def __init__(self, out, max_jobs=1, poll_interval=2.0, heartbeat_interval=2.0, once=False, defaults=None,
+                 lease_size=20, lease_seconds=None):
+        self.out = out
+        self.max_jobs = max(1, max_jobs)
+        self.poll_interval = poll_interval
+        self.heartbeat_interval = heartbeat_interval
+        self.once = once
+        self.lease_size = max(1, lease_size)
+        self.lease_seconds = lease_seconds
+        self.defaults = {key: value for key, value in (defaults or {}).items() if value is not None}
+        self.id = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+        self._shutdown = threading.Event()
+        self._jobs = {}
+        self._lock = threading.Lock()
+
+    def shutdown(self):
+        """
+        Stop claiming jobs and hand the items in progress back to the queue
+        """
+        self._shutdown.set()
+
+    def run(self):
+        import database as db
+
+        db.register_ingest_worker(self.id, socket.gethostname(), os.getpid())
+        emit(self.out, "worker_started", worker_id=self.id, max_jobs=self.max_jobs)
+        slots = [threading.Thread(target=self._claim_loop, name=f"worker-slot-{i}", daemon=True)
+                 for i in range(self.max_jobs)]
+        for slot in slots:
+            slot.start()
+        try:
+            while any(slot.is_alive() for slot in slots):
+                with self._lock:
+                    current_job_id = next(iter(self._jobs), None)
+                try:
+                    db.heartbeat_ingest_worker(self.id, current_job_id)
+                except Exception as e:
+                    print(f"Error recording worker heartbeat: {str(e)}")
+                for slot in slots:
+                    slot.join(timeout=self.heartbeat_interval / len(slots))
+        finally:
+            db.remove_ingest_worker(self.id)
+            emit(self.out, "worker_stopped", worker_id=self.id)
+
+    def _claim_loop(self):
+        import database as db
+
+        while not self._shutdown.is_set():
+            with self._lock:
+                running = list(self._jobs)
+            try:
+                job = db.claim_next_ingest_job(self.id, exclude_ids=running)
+            except Exception as e:
+                print(f"Error claiming ingest job: {str(e)}")
+                job = None
+            if job is None:
+                if self.once:
+                    return
+                self._shutdown.wait(self.poll_interval)
+                continue
+            self._run_job(job)
+
+    def _run_job(self, job):
+        import database as db
+        from ingest_jobs import run_ingest_job, pipeline_from_options, get_job_progress
+
+        options = {**self.defaults, **json.loads(job.options or "{}")}
+        retry_failed = bool(options.pop("retry_failed", False))
+        max_retries = options.pop("max_retries", 3)
+        emit(self.out, "job_claimed", worker_id=self.id, job_id=job.id, name=job.name, options=options)
+
+        stop_event = threading.Event()
+        finished = threading.Event()
+        state = {"stop_requested": False}
+        with self._lock:
+            self._jobs[job.id] = state
+
+        try:
+            pipeline = pipeline_from_options(options)
+        except Exception as e:
+            emit(self.out, "job_failed", worker_id=self.id, job_id=job.id, error=str(e))
+            db.release_ingest_job(job.id, self.id, 'stopped')
+            with self._lock:
+                self._jobs.pop(job.id, None)
+            return
+
+        def heartbeat():
+            # Keeps the job marked live and watches for stop requests and shutdown
+            while not finished.wait(self.heartbeat_interval):
+                try:
+                    state["stop_requested"] = db.heartbeat_ingest_job(job.id, self.id)
+                except Exception as e:
+                    print(f"Error recording job heartbeat: {str(e)}")
+                if (state["stop_requested"] or self._shutdown.is_set()) and not stop_event.is_set():
+                    stop_event.set()
+                    pipeline.stop()
+
+        threading.Thread(target=heartbeat, name=f"job-{job.id}-heartbeat", daemon=True).start()
+        lease = {"lease_seconds": self.lease_seconds} if self.lease_seconds else {}
+        error = None
+        try:
+            progress = run_ingest_job(job.id, pipeline=pipeline, retry_failed=retry_failed, max_retries=max_retries,
+                                      chunk_size=self.lease_size, stop_event=stop_event, lease_owner=self.id,
+                                      max_leased=self.lease_size + 2 * pipeline.analyze_workers * pipeline.images_per_request,
+                                      **lease)
+        except Exception as e:
+            error = str(e)
+            progress = get_job_progress(job.id)
+        finally:
+            finished.set()
+            with self._lock:
+                self._jobs.pop(job.id, None)
+
+        if progress["remaining"] == 0 and error is None:
+            status = 'completed'
+        elif error is not None or state["stop_requested"]:
+            status = 'stopped'
+        elif self._shutdown.is_set() and not db.count_live_job_leases(job.id):
+            # Nobody else is on it; let the next worker continue it
+            status = 'queued'
+        else:
+            # The items left are leased by other workers, which finish the job
+            status = 'running'
+        db.release_ingest_job(job.id, self.id, status)
+        emit(self.out, "job_finished" if status == 'completed' else "job_released", worker_id=self.id,
+             job_id=job.id, status=status, error=error, bottleneck=pipeline.bottleneck(), **progress)
+
+def main(argv=None):
+    args = parse_args(argv)
+
+    # Keep stdout for JSON events only
+    out = sys.stdout
+    sys.stdout = sys.stderr
+
+    if args.requests_per_minute:
+        # Read when the providers are created; each worker process has its own budget
+        os.environ["VISION_REQUESTS_PER_MINUTE"] = str(args.requests_per_minute)
+
+    import metrics
+    if args.metrics_port:
+        metrics.start_http_server(args.metrics_port)
+
+    worker = Worker(
+        out,
+        max_jobs=args.max_jobs,
+        poll_interval=args.poll_interval,
+        heartbeat_interval=args.heartbeat_interval,
+        once=args.once,
+        defaults={
+            "analyze_workers": args.analyze_workers,
+            "metadata_workers": args.metadata_workers,
+            "provider": args.provider,
+        },
+        lease_size=args.lease_size,
+        lease_seconds=args.lease_seconds
+    )
+
+    def handle_signal(signum, frame):
+        emit(out, "shutting_down", worker_id=worker.id, signal=signum)
+        worker.shutdown()
+
+    signal.signal(signal.SIGINT, handle_signal)
+    signal.signal(signal.SIGTERM, handle_signal)
+    worker.run()
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
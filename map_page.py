@@ -0,0 +1,206 @@
+import math
+import streamlit as st
+import pandas as pd
+import pydeck as pdk
+import database as db
+from geo import precision_for_zoom, zoom_for_bbox
+from query_cache import QueryCache
+
+# Above this many photos in view, clusters are drawn instead of individual photos
+MAX_POINTS = 1000
+# Geotagged images backfilled without asking when the map opens
+AUTO_BACKFILL_LIMIT = 10000
+
+# Cluster queries are repeated on every rerun while exploring the same view
+map_cache = QueryCache(max_entries=32, ttl_seconds=300, name="map")
+
+def get_clusters(zoom, bbox):
+    """
+    Get the clusters for a view, reusing cached results
+    """
+    precision = precision_for_zoom(zoom)
+    return map_cache.get_or_compute(("clusters", precision, bbox), lambda: db.get_geo_clusters(precision, bbox))
+
+def get_points(bbox):
+    """
+    Get the individual photos in a view, reusing cached results
+    """
+    def load():
+        return pd.DataFrame([{
+            "id": img.id,
+            "file_name": img.file_name,
+            "object_name": img.object_name or "Unknown",
+            "folder": img.folder.name if img.folder else "Unknown",
+            "latitude": img.gps_latitude,
+            "longitude": img.gps_longitude,
+        } for img in db.get_images_in_bbox(bbox, limit=MAX_POINTS)])
+    return map_cache.get_or_compute(("points", bbox), load)
+
+def show_map_page():
+    """
+    Display geotagged images on a map, clustered by area
+    """
+    st.markdown("""
+    <div class="card">
+        <div class="card-header">
+            <h2>Photo Map</h2>
+            <p>Explore where your geotagged photos were taken</p>
+        </div>
+    </div>
+    """, unsafe_allow_html=True)
+
+    if 'map_bbox' not in st.session_state:
+        st.session_state.map_bbox = None
+        st.session_state.map_zoom = 1
+        st.session_state.map_trail = []
+
+    # Images analyzed before geohashes were stored need them computed once
+    missing = db.count_images_missing_geohash()
+    if missing:
+        if missing <= AUTO_BACKFILL_LIMIT:
+            with st.spinner(f"Indexing {missing} geotagged images..."):
+                db.backfill_geohashes()
+            map_cache.clear()
+        else:
+            st.warning(f"{missing} geotagged images are not on the map yet")
+            if st.button("Add them to the map"):
+                with st.spinner(f"Indexing {missing} geotagged images..."):
+                    db.backfill_geohashes()
+                map_cache.clear()
+                st.rerun()
+
+    bbox = st.session_state.map_bbox
+    zoom = st.session_state.map_zoom
+    clusters = get_clusters(zoom, bbox)
+    total = sum(cluster["count"] for cluster in clusters)
+
+    if total == 0:
+        st.info("No geotagged images found. Photos with GPS data in their EXIF metadata will appear here.")
+        return
+
+    show_points = bbox is not None and total <= MAX_POINTS
+    if show_points:
+        st.subheader(f"{total} photos in this area")
+    else:
+        st.subheader(f"{total} photos in {len(clusters)} areas")
+
+    show_map(clusters, bbox, zoom, get_points(bbox) if show_points else None)
+
+    # Navigation
+    col1, col2 = st.columns([3, 1])
+    with col1:
+        if not show_points:
+            cluster_by_hash = {cluster["geohash"]: cluster for cluster in clusters}
+            selected = st.selectbox(
+                "Zoom into area",
+                options=list(cluster_by_hash),
+                format_func=lambda cell: f"{cluster_by_hash[cell]['latitude']:.3f}, "
+                                         f"{cluster_by_hash[cell]['longitude']:.3f} "
+                                         f"({cluster_by_hash[cell]['count']} photos)"
+            )
+            if st.button("Zoom In"):
+                st.session_state.map_trail.append((bbox, zoom))
+                st.session_state.map_bbox = cluster_by_hash[selected]["bounds"]
+                st.session_state.map_zoom = zoom_for_bbox(st.session_state.map_bbox)
+                st.rerun()
+    with col2:
+        if st.session_state.map_trail and st.button("Zoom Out"):
+            st.session_state.map_bbox, st.session_state.map_zoom = st.session_state.map_trail.pop()
+            st.rerun()
+        if bbox is not None and st.button("Whole World"):
+            st.session_state.map_bbox = None
+            st.session_state.map_zoom = 1
+            st.session_state.map_trail = []
+            st.rerun()
+
+    if show_points:
+        st.dataframe(
+            get_points(bbox)[["file_name", "object_name", "folder", "latitude", "longitude"]],
+            use_container_width=True,
+            column_config={
+                "file_name": "Image Name",
+                "object_name": "Object Identified",
+                "folder": "Folder",
+            },
+            hide_index=True
+        )
+
+    show_radius_search()
+
+def show_map(clusters, bbox, zoom, points=None):
+    """
+    Render clusters (or individual photos when points is given) with pydeck
+    """
+    if bbox is not None:
+        min_lat, min_lon, max_lat, max_lon = bbox
+        view = pdk.ViewState(latitude=(min_lat + max_lat) / 2, longitude=(min_lon + max_lon) / 2, zoom=zoom)
+    else:
+        view = pdk.ViewState(latitude=20, longitude=0, zoom=zoom)
+
+    if points is not None:
+        layers = [pdk.Layer(
+            "ScatterplotLayer",
+            data=points,
+            get_position=["longitude", "latitude"],
+            get_radius=6,
+            radius_units="pixels",
+            get_fill_color=[30, 136, 229, 200],
+            pickable=True,
+        )]
+        tooltip = {"text": "{file_name}\n{object_name}"}
+    else:
+        data = pd.DataFrame([{
+            "latitude": cluster["latitude"],
+            "longitude": cluster["longitude"],
+            "count": cluster["count"],
+            "label": str(cluster["count"]),
+            "radius": 8 + 4 * math.log2(cluster["count"]),
+        } for cluster in clusters])
+        layers = [
+            pdk.Layer(
+                "ScatterplotLayer",
+                data=data,
+                get_position=["longitude", "latitude"],
+                get_radius="radius",
+                radius_units="pixels",
+                get_fill_color=[229, 57, 53, 160],
+                pickable=True,
+            ),
+            pdk.Layer(
+                "TextLayer",
+                data=data,
+                get_position=["longitude", "latitude"],
+                get_text="label",
+                get_size=12,
+                get_color=[255, 255, 255],
+            ),
+        ]
+        tooltip = {"text": "{count} photos"}
+
+    st.pydeck_chart(pdk.Deck(layers=layers, initial_view_state=view, tooltip=tooltip))
+
+def show_radius_search():
+    """
+    Find photos taken within a distance of a point
+    """
+    with st.expander("Find photos near a location"):
+        col1, col2, col3 = st.columns(3)
+        latitude = col1.number_input("Latitude", min_value=-90.0, max_value=90.0, value=0.0, format="%.5f")
+        longitude = col2.number_input("Longitude", min_value=-180.0, max_value=180.0, value=0.0, format="%.5f")
+        radius_km = col3.number_input("Radius (km)", min_value=0.1, max_value=20000.0, value=10.0)
+
+        if st.button("Search Nearby"):
+            nearby = db.get_images_within_radius(latitude, longitude, radius_km, limit=MAX_POINTS)
+            if not nearby:
+                st.info("No photos found within that distance")
+                return
+            st.dataframe(
+                pd.DataFrame([{
+                    "file_name": img.file_name,
+                    "object_name": img.object_name,
+                    "folder": img.folder.name if img.folder else "Unknown",
+                    "distance_km": round(distance, 2),
+                } for img, distance in nearby]),
+                use_container_width=True,
+                hide_index=True
+            )
@@ -0,0 +1,34 @@
+import os
+from utils import get_all_image_files, extract_metadata_parallel
+import database as db
+
+def ingest_folder_metadata(folder_path, max_workers=None, batch_size=500):
+    """
+    Extract metadata for every image in a folder and store it in the database
+    
+    Runs independently of the AI analysis: metadata is extracted in a process
+    pool and written with batched statements, creating metadata-only image rows
+    for files that have not been analyzed yet.
+    
+    Args:
+        folder_path (str): Path to the folder containing the images
+        max_workers (int): Number of worker processes (defaults to the CPU count)
+        batch_size (int): Number of images written per database batch
+        
+    Returns:
+        int: Number of images written
+    """
+    if not os.path.exists(folder_path) or not os.path.isdir(folder_path):
+        raise ValueError(f"Invalid folder path: {folder_path}")
+    
+    image_files = get_all_image_files(folder_path)
+    if not image_files:
+        return 0
+    
+    folder = db.add_folder(os.path.basename(os.path.normpath(folder_path)), folder_path)
+    
+    return db.bulk_upsert_image_metadata(
+        folder.id,
+        extract_metadata_parallel(image_files, max_workers=max_workers),
+        batch_size=batch_size
+    )
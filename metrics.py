@@ -0,0 +1,273 @@
+import os
+import json
+import time
+import uuid
+import bisect
+import threading
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Histogram buckets (upper bounds) used when none are given
+DEFAULT_SECONDS_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+BYTES_BUCKETS = tuple(2 ** power for power in range(10, 27, 2))
+TOKENS_BUCKETS = (100, 250, 500, 1000, 2000, 4000, 8000, 16000)
+
+_metrics = {}
+_registry_lock = threading.Lock()
+
+def _label_key(labels):
+    return tuple(sorted((name, str(value)) for name, value in labels.items()))
+
+def _format_labels(key, extra=()):
+    pairs = list(key) + list(extra)
+    if not pairs:
+        return ""
+    escaped = (value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, value in pairs)
+    return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + "}"
+
+class Counter:
+    """
+    Monotonically increasing count, optionally split by labels
+    """
+    kind = "counter"
+
+    def __init__(self, name, help_text):
+        self.name = name
+        self.help = help_text
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, value=1, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + value
+
+    def value(self, **labels):
+        with self._lock:
+            return self._values.get(_label_key(labels), 0)
+
+    def snapshot(self):
+        with self._lock:
+            return [{"labels": dict(key), "value": value} for key, value in self._values.items()]
+
+    def render(self):
+        with self._lock:
+            return [f"{self.name}{_format_labels(key)} {value}" for key, value in self._values.items()]
+
+class Timing:
+    """
+    Duration of a block timed with Histogram.time, available after the block exits
+    """
+    seconds = None
+
+class Histogram:
+    """
+    Distribution of observed values in cumulative buckets, optionally split by labels
+    """
+    kind = "histogram"
+
+    def __init__(self, name, help_text, buckets=DEFAULT_SECONDS_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.buckets = tuple(sorted(buckets))
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            series = self._values.get(key)
+            if series is None:
+                series = self._values[key] = {"counts": [0] * (len(self.buckets) + 1), "sum": 0.0, "count": 0}
+            series["counts"][bisect.bisect_left(self.buckets, value)] += 1
+            series["sum"] += value
+            series["count"] += 1
+
+    @contextmanager
+    def time(self, trace_id=None, **labels):
+        """
+        Observe the duration of a block in seconds, and write it as a trace span
+        when tracing is on and a trace_id is given
+
+        Yields:
+            Timing: Holds the duration in seconds once the block exits
+        """
+        timing = Timing()
+        started_at = time.time()
+        start = time.perf_counter()
+        error = None
+        try:
+            yield timing
+        except Exception as e:
+            error = str(e)
+            raise
+        finally:
+            duration = timing.seconds = time.perf_counter() - start
+            self.observe(duration, **labels)
+            if trace_id is not None:
+                record_span(self.name, trace_id, started_at, duration, error=error, **labels)
+
+    def snapshot(self):
+        with self._lock:
+            return [{
+                "labels": dict(key),
+                "count": series["count"],
+                "sum": round(series["sum"], 6),
+                "buckets": dict(zip([str(bound) for bound in self.buckets] + ["+Inf"], series["counts"])),
+            } for key, series in self._values.items()]
+
+    def render(self):
+        lines = []
+        with self._lock:
+            for key, series in self._values.items():
+                cumulative = 0
+                for bound, count in zip(list(self.buckets) + ["+Inf"], series["counts"]):
+                    cumulative += count
+                    lines.append(f"{self.name}_bucket{_format_labels(key, [('le', str(bound))])} {cumulative}")
+                lines.append(f"{self.name}_sum{_format_labels(key)} {series['sum']}")
+                lines.append(f"{self.name}_count{_format_labels(key)} {series['count']}")
+        return lines
+
+def _register(cls, name, help_text, **kwargs):
+    with _registry_lock:
+        metric = _metrics.get(name)
+        if metric is None:
+            metric = _metrics[name] = cls(name, help_text, **kwargs)
+        elif not isinstance(metric, cls):
+            raise ValueError(f"Metric {name} is already registered as a {metric.kind}")
+        return metric
+
+def counter(name, help_text):
+    """
+    Get or create a counter (Prometheus convention: the name ends in _total)
+    """
+    return _register(Counter, name, help_text)
+
+def histogram(name, help_text, buckets=DEFAULT_SECONDS_BUCKETS):
+    """
+    Get or create a histogram
+    """
+    return _register(Histogram, name, help_text, buckets=buckets)
+
+def reset():
+    """
+    Forget every recorded value (metrics stay registered)
+    """
+    with _registry_lock:
+        for metric in _metrics.values():
+            with metric._lock:
+                metric._values.clear()
+
+# Export
+
+def render_prometheus():
+    """
+    Render every metric in the Prometheus text exposition format
+    """
+    lines = []
+    with _registry_lock:
+        metrics = sorted(_metrics.values(), key=lambda metric: metric.name)
+    for metric in metrics:
+        lines.append(f"# HELP {metric.name} {metric.help}")
+        lines.append(f"# TYPE {metric.name} {metric.kind}")
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+def snapshot():
+    """
+    Get every metric's current values as plain data
+    """
+    with _registry_lock:
+        metrics = list(_metrics.values())
+    return {metric.name: {"type": metric.kind, "help": metric.help, "series": metric.snapshot()} for metric in metrics}
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] not in ("/", "/metrics"):
+            self.send_error(404)
+            return
+        body = render_prometheus().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+_server = None
+
+def start_http_server(port, host="0.0.0.0"):
+    """
+    Serve /metrics for Prometheus to scrape from a background thread
+
+    Calling it again returns the server already running.
+    """
+    global _server
+    with _registry_lock:
+        if _server is None:
+            _server = ThreadingHTTPServer((host, port), _MetricsHandler)
+            threading.Thread(target=_server.serve_forever, name="metrics-http", daemon=True).start()
+        return _server
+
+# JSON log and tracing
+
+_log_file = None
+_log_lock = threading.Lock()
+_tracing = False
+
+def configure(log_path=None, trace=False):
+    """
+    Set where the JSON log is written and whether per-image spans are recorded
+
+    Args:
+        log_path (str): File that spans and snapshots are appended to, one JSON object per line
+        trace (bool): Record a span for each timed stage of each image
+    """
+    global _log_file, _tracing
+    with _log_lock:
+        if _log_file is not None:
+            _log_file.close()
+            _log_file = None
+        if log_path:
+            _log_file = open(log_path, "a", encoding="utf-8")
+        _tracing = bool(trace and _log_file is not None)
+
+def tracing_enabled():
+    return _tracing
+
+def new_trace_id():
+    """
+    Get an ID to group the spans of one image, or None when tracing is off
+    """
+    return uuid.uuid4().hex if _tracing else None
+
+def _write_log(record):
+    with _log_lock:
+        if _log_file is not None:
+            _log_file.write(json.dumps(record, default=str) + "\n")
+            _log_file.flush()
+
+def record_span(name, trace_id, started_at, duration, **attributes):
+    """
+    Write one timed span to the JSON log
+    """
+    if _tracing and trace_id is not None:
+        _write_log({
+            "type": "span",
+            "trace_id": trace_id,
+            "span": name,
+            "start": round(started_at, 6),
+            "duration": round(duration, 6),
+            "thread": threading.current_thread().name,
+            **{key: value for key, value in attributes.items() if value is not None},
+        })
+
+def write_snapshot():
+    """
+    Append the current values of every metric to the JSON log
+    """
+    _write_log({"type": "metrics", "time": time.time(), "metrics": snapshot()})
+
+configure(os.environ.get("METRICS_LOG"), trace=os.environ.get("METRICS_TRACE", "").lower() in ("1", "true", "yes"))
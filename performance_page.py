@@ -0,0 +1,290 @@
+import datetime
+import streamlit as st
+import pandas as pd
+import altair as alt
+import database as db
+import metrics
+
+# Time window options and the chart bucket used for each
+TIME_WINDOWS = {
+    "Last hour": (datetime.timedelta(hours=1), "1min"),
+    "Last 24 hours": (datetime.timedelta(days=1), "15min"),
+    "Last 7 days": (datetime.timedelta(days=7), "1h"),
+    "Last 30 days": (datetime.timedelta(days=30), "6h"),
+    "All time": (None, "1D"),
+}
+
+# Timed pipeline stages: column in pipeline_timings -> label
+STAGES = {
+    "metadata_seconds": "Metadata extraction",
+    "encode_seconds": "Encode",
+    "triage_seconds": "Triage",
+    "api_seconds": "Vision API",
+    "db_write_seconds": "Database write",
+    "index_seconds": "Semantic index",
+    "total_seconds": "Total per image",
+}
+
+def format_bytes(size):
+    """
+    Format a byte count for display
+    """
+    for unit in ("B", "KB", "MB", "GB"):
+        if size < 1024 or unit == "GB":
+            return f"{size:.0f} {unit}" if unit == "B" else f"{size:.2f} {unit}"
+        size /= 1024
+
+def images_per_minute(timings):
+    """
+    Throughput while the pipeline was running: images over the summed duration of each run
+
+    Gaps between runs are left out, so idle time does not lower the rate.
+    """
+    seconds = 0.0
+    for _, run in timings.groupby("run_id"):
+        span = (run["recorded_at"].max() - run["recorded_at"].min()).total_seconds()
+        # A run's first image took about one image's total time to arrive
+        seconds += span + run["total_seconds"].median()
+    return len(timings) / seconds * 60 if seconds > 0 else 0.0
+
+def stage_latency_table(timings):
+    """
+    Per-stage latency percentiles in milliseconds
+    """
+    rows = []
+    for column, label in STAGES.items():
+        values = timings[column].dropna()
+        if values.empty:
+            continue
+        rows.append({
+            "Stage": label,
+            "Images": len(values),
+            "p50 (ms)": values.quantile(0.5) * 1000,
+            "p95 (ms)": values.quantile(0.95) * 1000,
+            "Mean (ms)": values.mean() * 1000,
+        })
+    return pd.DataFrame(rows)
+
+def provider_table(timings):
+    """
+    Images, failures and vision API latency for each provider
+    """
+    rows = []
+    # Timings recorded before providers were tracked all came from OpenAI
+    for provider, group in timings.groupby(timings["provider"].fillna("openai")):
+        api = group["api_seconds"].dropna()
+        tokens = group["prompt_tokens"].fillna(0) + group["completion_tokens"].fillna(0)
+        rows.append({
+            "Provider": provider,
+            "Images": len(group),
+            "Failed": int((group["status"] != "analyzed").sum()),
+            "API p50 (ms)": api.quantile(0.5) * 1000 if len(api) else None,
+            "API p95 (ms)": api.quantile(0.95) * 1000 if len(api) else None,
+            "Tokens per Image": tokens.mean(),
+            "Images per Request": group["images_per_request"].fillna(1).mean(),
+        })
+    return pd.DataFrame(rows)
+
+def tier_table(timings):
+    """
+    Images, latency, throughput and estimated cost for each tier of tiered analysis
+    """
+    rows = []
+    cost = timings["cost_usd"].fillna(0) + timings["triage_cost_usd"].fillna(0)
+    for tier, label in (("triage", "Triage only"), ("full", "Escalated to full analysis")):
+        group = timings[timings["tier"] == tier]
+        if group.empty:
+            continue
+        rows.append({
+            "Tier": label,
+            "Images": len(group),
+            "Share": len(group) / timings["tier"].notna().sum(),
+            "Triage p50 (ms)": group["triage_seconds"].quantile(0.5) * 1000,
+            "Full p50 (ms)": group["api_seconds"].quantile(0.5) * 1000 if tier == "full" else None,
+            "Images per Minute": images_per_minute(group),
+            "Cost per Image ($)": cost[group.index].mean(),
+        })
+    return pd.DataFrame(rows)
+
+def show_performance_page():
+    """
+    Display ingest pipeline throughput, stage latency and cache hit rates
+    """
+    st.markdown("""
+    <div class="card">
+        <div class="card-header">
+            <h2>Performance</h2>
+            <p>Pipeline throughput, stage latency, API usage and cache hit rates</p>
+        </div>
+    </div>
+    """, unsafe_allow_html=True)
+
+    window = st.selectbox("Time window", list(TIME_WINDOWS), index=1)
+    span, bucket = TIME_WINDOWS[window]
+    since = datetime.datetime.utcnow() - span if span else None
+
+    timings = pd.DataFrame(db.get_pipeline_timings(since))
+    if timings.empty:
+        st.info("No pipeline timings recorded in this window. Process some images to see performance data.")
+    else:
+        show_pipeline_performance(timings, bucket)
+
+    show_cache_performance(since, bucket)
+
+def show_pipeline_performance(timings, bucket):
+    """
+    Display throughput, API usage and per-stage latency from recorded pipeline timings
+    """
+    timings["recorded_at"] = pd.to_datetime(timings["recorded_at"])
+    analyzed = timings[timings["status"] == "analyzed"]
+    failed = len(timings) - len(analyzed)
+
+    col1, col2, col3, col4 = st.columns(4)
+    with col1:
+        st.metric("Images Analyzed", len(analyzed), f"{failed} failed" if failed else None, delta_color="inverse")
+    with col2:
+        st.metric("Images per Minute", f"{images_per_minute(timings):.1f}")
+    with col3:
+        tokens = analyzed["prompt_tokens"].fillna(0) + analyzed["completion_tokens"].fillna(0)
+        st.metric("API Tokens per Image", f"{tokens.mean():.0f}" if len(analyzed) else "0")
+    with col4:
+        uploaded = analyzed["encoded_bytes"].fillna(0)
+        st.metric("Bytes Uploaded", format_bytes(uploaded.sum()),
+                  f"{format_bytes(uploaded.mean())} per image" if len(analyzed) else None, delta_color="off")
+
+    retries = int(timings["retries"].fillna(0).sum())
+    if retries:
+        st.caption(f"{retries} API requests were retried")
+    cost = timings["cost_usd"].fillna(0) + timings["triage_cost_usd"].fillna(0)
+    if cost.sum() > 0:
+        st.caption(f"Estimated API cost: ${cost.sum():.4f} (${cost[analyzed.index].mean():.5f} per analyzed image)")
+
+    st.subheader("Stage Latency")
+    st.dataframe(
+        stage_latency_table(timings),
+        use_container_width=True,
+        column_config={
+            column: st.column_config.NumberColumn(column, format="%.1f")
+            for column in ("p50 (ms)", "p95 (ms)", "Mean (ms)")
+        },
+        hide_index=True
+    )
+
+    providers = provider_table(timings)
+    if len(providers) > 1 or timings["images_per_request"].fillna(1).max() > 1:
+        st.subheader("By Provider")
+        st.dataframe(
+            providers,
+            use_container_width=True,
+            column_config={
+                column: st.column_config.NumberColumn(column, format="%.1f")
+                for column in ("API p50 (ms)", "API p95 (ms)", "Tokens per Image", "Images per Request")
+            },
+            hide_index=True
+        )
+
+    tiered = timings[timings["tier"].notna()]
+    if not tiered.empty:
+        st.subheader("Tiered Analysis")
+        st.dataframe(
+            tier_table(tiered),
+            use_container_width=True,
+            column_config={
+                "Share": st.column_config.NumberColumn("Share", format="%.2f"),
+                "Triage p50 (ms)": st.column_config.NumberColumn("Triage p50 (ms)", format="%.1f"),
+                "Full p50 (ms)": st.column_config.NumberColumn("Full p50 (ms)", format="%.1f"),
+                "Images per Minute": st.column_config.NumberColumn("Images per Minute", format="%.1f"),
+                "Cost per Image ($)": st.column_config.NumberColumn("Cost per Image ($)", format="%.5f"),
+            },
+            hide_index=True
+        )
+        escalated = tiered[tiered["tier"] == "full"]
+        full_cost = escalated["cost_usd"].mean()
+        if len(escalated) and full_cost > 0:
+            actual = (tiered["cost_usd"].fillna(0) + tiered["triage_cost_usd"].fillna(0)).sum()
+            st.caption(f"Analyzing all {len(tiered)} images in full would have cost about "
+                       f"${full_cost * len(tiered):.4f}; tiering cost ${actual:.4f}.")
+
+    # Over time
+    buckets = timings.set_index("recorded_at").resample(bucket)
+    bucket_minutes = pd.Timedelta(bucket).total_seconds() / 60
+    over_time = pd.DataFrame({
+        "images_per_minute": buckets["status"].count() / bucket_minutes,
+        "api_p95_ms": buckets["api_seconds"].quantile(0.95) * 1000,
+        "total_p95_ms": buckets["total_seconds"].quantile(0.95) * 1000,
+    }).reset_index()
+
+    col1, col2 = st.columns(2)
+    with col1:
+        st.markdown("**Images per Minute**")
+        chart = alt.Chart(over_time).mark_line(point=True).encode(
+            x=alt.X("recorded_at:T", title="Time (UTC)"),
+            y=alt.Y("images_per_minute:Q", title="Images / minute"),
+            tooltip=[alt.Tooltip("recorded_at:T", title="Time"),
+                     alt.Tooltip("images_per_minute:Q", title="Images / minute", format=".1f")]
+        )
+        st.altair_chart(chart, use_container_width=True)
+    with col2:
+        st.markdown("**p95 Latency**")
+        latency = over_time.melt(
+            id_vars="recorded_at", value_vars=["api_p95_ms", "total_p95_ms"], var_name="stage", value_name="ms"
+        ).dropna()
+        latency["stage"] = latency["stage"].map({"api_p95_ms": "Vision API", "total_p95_ms": "Total per image"})
+        chart = alt.Chart(latency).mark_line(point=True).encode(
+            x=alt.X("recorded_at:T", title="Time (UTC)"),
+            y=alt.Y("ms:Q", title="Milliseconds"),
+            color=alt.Color("stage:N", title="Stage"),
+            tooltip=[alt.Tooltip("recorded_at:T", title="Time"), "stage", alt.Tooltip("ms:Q", format=".0f")]
+        )
+        st.altair_chart(chart, use_container_width=True)
+
+def show_cache_performance(since, bucket):
+    """
+    Display cache hit rates over time and since this server started
+    """
+    st.subheader("Cache Hit Rates")
+
+    samples = pd.DataFrame(db.get_cache_samples(since))
+    if samples.empty:
+        st.info("No cache samples recorded in this window yet. Caches record their hit rate about once a minute while in use.")
+    else:
+        samples["recorded_at"] = pd.to_datetime(samples["recorded_at"])
+        totals = samples.groupby("cache")[["hits", "misses"]].sum()
+        cols = st.columns(len(totals))
+        for col, (cache, row) in zip(cols, totals.iterrows()):
+            lookups = row["hits"] + row["misses"]
+            col.metric(f"{cache.title()} Cache", f"{row['hits'] / lookups:.0%}" if lookups else "n/a",
+                       f"{lookups} lookups", delta_color="off")
+
+        over_time = (
+            samples.set_index("recorded_at")
+            .groupby("cache")[["hits", "misses"]]
+            .resample(bucket).sum()
+            .reset_index()
+        )
+        over_time = over_time[over_time["hits"] + over_time["misses"] > 0]
+        over_time["hit_rate"] = over_time["hits"] / (over_time["hits"] + over_time["misses"])
+        chart = alt.Chart(over_time).mark_line(point=True).encode(
+            x=alt.X("recorded_at:T", title="Time (UTC)"),
+            y=alt.Y("hit_rate:Q", title="Hit rate", axis=alt.Axis(format="%"), scale=alt.Scale(domain=[0, 1])),
+            color=alt.Color("cache:N", title="Cache"),
+            tooltip=[alt.Tooltip("recorded_at:T", title="Time"), "cache",
+                     alt.Tooltip("hit_rate:Q", title="Hit rate", format=".0%"), "hits", "misses"]
+        )
+        st.altair_chart(chart, use_container_width=True)
+        st.caption("The ingest cache counts images whose earlier results were reused instead of re-analyzed.")
+
+    # Counts kept in memory by this server process, including lookups not yet sampled
+    series = metrics.snapshot().get("query_cache_requests_total", {}).get("series", [])
+    if series:
+        live = pd.DataFrame([{**entry["labels"], "count": entry["value"]} for entry in series])
+        live = live.pivot_table(index="cache", columns="result", values="count", aggfunc="sum", fill_value=0)
+        live = live.reindex(columns=["hit", "miss"], fill_value=0)
+        live["hit rate"] = live["hit"] / (live["hit"] + live["miss"])
+        with st.expander("Since this server started"):
+            st.dataframe(
+                live.rename(columns={"hit": "Hits", "miss": "Misses", "hit rate": "Hit Rate"}).reset_index(),
+                use_container_width=True,
+                column_config={"Hit Rate": st.column_config.NumberColumn("Hit Rate", format="%.2f")},
+                hide_index=True
+            )
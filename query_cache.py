@@ -0,0 +1,162 @@
+import time
+import weakref
+import threading
+from collections import OrderedDict
+import database as db
+import metrics
+
+CACHE_REQUESTS = metrics.counter("query_cache_requests_total", "Query cache lookups by cache and result")
+
+# Seconds between the hit/miss samples each cache records for the performance page
+SAMPLE_SECONDS = 60
+
+class QueryCache:
+    """
+    Bounded LRU cache with a TTL for query results
+
+    Entries are tagged with the database's data generation when stored, so any
+    write through the database module (new image results, favorites changes)
+    invalidates every cached result at once. The TTL covers writes made by
+    other processes, such as the command-line ingest.
+
+    Cached values should be plain data (dicts, DataFrames), not ORM objects
+    tied to a session.
+
+    Args:
+        max_entries (int): Maximum number of cached results
+        ttl_seconds (float): Seconds before an entry is recomputed
+        name (str): Name the cache's hits and misses are reported under
+
+    Hit and miss counts are written to the database for the performance page
+    by a background thread every SAMPLE_SECONDS, never by a lookup.
+    """
+    def __init__(self, max_entries=64, ttl_seconds=300, name="default"):
+        self.name = name
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._sampled = (0, 0)
+        _register_for_sampling(self)
+
+    def get(self, key):
+        """
+        Get a cached value
+
+        Returns:
+            tuple: (found, value)
+        """
+        with self._lock:
+            found, value = False, None
+            entry = self._entries.get(key)
+            if entry is not None:
+                cached_value, generation, stored_at = entry
+                if generation == db.get_data_generation() and time.monotonic() - stored_at < self.ttl_seconds:
+                    self._entries.move_to_end(key)
+                    found, value = True, cached_value
+                else:
+                    del self._entries[key]
+            if found:
+                self.hits += 1
+            else:
+                self.misses += 1
+        CACHE_REQUESTS.inc(cache=self.name, result="hit" if found else "miss")
+        return found, value
+
+    def record_sample(self):
+        """
+        Store the hits and misses since the last sample, if there were any lookups
+
+        Returns:
+            tuple: (hits, misses) recorded, or None
+        """
+        with self._lock:
+            hits, misses = self._sampled
+            sample = (self.hits - hits, self.misses - misses)
+            self._sampled = (self.hits, self.misses)
+        if sample == (0, 0):
+            return None
+        # Samples are informational; a failed write is reported and dropped
+        try:
+            db.add_cache_sample(self.name, *sample)
+        except Exception as e:
+            print(f"Error recording cache sample: {str(e)}")
+            return None
+        return sample
+
+    def put(self, key, value, generation=None):
+        """
+        Store a value, evicting the least recently used entries beyond max_entries
+
+        Args:
+            generation (int): Data generation the value was computed at (defaults to the current one)
+        """
+        if generation is None:
+            generation = db.get_data_generation()
+        with self._lock:
+            self._entries[key] = (value, generation, time.monotonic())
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def get_or_compute(self, key, compute):
+        """
+        Get a cached value, computing and storing it on a miss
+
+        Args:
+            key: Hashable cache key
+            compute (callable): Called with no arguments to produce the value
+        """
+        found, value = self.get(key)
+        if found:
+            return value
+        # Read the generation first so a write during compute() invalidates the result
+        generation = db.get_data_generation()
+        value = compute()
+        self.put(key, value, generation)
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+            }
+
+_sampled_caches = weakref.WeakSet()
+_sampler = None
+_sampler_lock = threading.Lock()
+
+def _register_for_sampling(cache):
+    """
+    Add a cache to those the sampler thread records, starting the thread on first use
+    """
+    global _sampler
+    with _sampler_lock:
+        _sampled_caches.add(cache)
+        if _sampler is None:
+            _sampler = threading.Thread(target=_sample_caches, name="query-cache-sampler", daemon=True)
+            _sampler.start()
+
+def _sample_caches():
+    while True:
+        time.sleep(SAMPLE_SECONDS)
+        with _sampler_lock:
+            caches = list(_sampled_caches)
+        for cache in caches:
+            cache.record_sample()
+
+def normalize_query(query):
+    """
+    Normalize a free-text query for use in a cache key
+    """
+    return " ".join((query or "").lower().split())
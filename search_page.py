@@ -1,10 +1,90 @@
 import streamlit as st
 import os
+import datetime
 import pandas as pd
+from types import SimpleNamespace
 from database import search_images, get_db, Image, FavoriteImage
 import database as db
+from semantic_search import semantic_search, sync_index, get_index
+from query_cache import QueryCache, normalize_query
 from export_utils import export_to_csv, export_to_excel, export_to_pdf_simple, export_to_pdf_detailed
 
+# Search results survive reruns (selecting a result, exporting) until the data changes
+search_cache = QueryCache(max_entries=64, ttl_seconds=300, name="search")
+
+def _image_row(image, similarity=None):
+    """
+    Copy the fields the search page needs out of an Image so they can be cached
+    """
+    row = {column.name: getattr(image, column.name) for column in Image.__table__.columns}
+    row["folder_name"] = image.folder.name if image.folder else "Unknown"
+    row["similarity"] = similarity
+    return row
+
+def _run_search(query, mode, max_results):
+    """
+    Run a search and build everything the page displays from it
+    
+    Returns:
+        tuple: (rows by image ID, results DataFrame)
+    """
+    if mode == "Semantic":
+        rows = [_image_row(img, score) for img, score in semantic_search(query, k=max_results)]
+    else:
+        rows = [_image_row(img) for img in search_images(query)]
+    return _build_results(rows)
+
+def _build_results(rows):
+    """
+    Attach favorite membership to result rows and build the results DataFrame
+    
+    Returns:
+        tuple: (rows by image ID, results DataFrame)
+    """
+    favorite_ids = db.get_favorite_ids_for_images([row["id"] for row in rows])
+    for row in rows:
+        row["favorite_id"] = favorite_ids.get(row["id"])
+    
+    result_df = pd.DataFrame([{
+        "id": row["id"],
+        "file_name": row["file_name"], 
+        "folder_name": row["folder_name"],
+        "object_name": row["object_name"], 
+        "confidence": row["confidence"],
+        "camera_info": f"{row['camera_make']} {row['camera_model'] or ''}".strip() if row["camera_make"] else "",
+        "file_type": row["file_type"].upper() if row["file_type"] else "",
+        "description_snippet": row["description"][:100] + "..." if len(row["description"]) > 100 else row["description"],
+        "similarity": row["similarity"]
+    } for row in rows])
+    
+    return {row["id"]: row for row in rows}, result_df
+
+def get_search_results(query, mode="Keyword", max_results=20):
+    """
+    Get search results, reusing cached results for the same normalized query
+    """
+    key = (mode, normalize_query(query), max_results if mode == "Semantic" else None)
+    return search_cache.get_or_compute(key, lambda: _run_search(query, mode, max_results))
+
+def _run_faceted_search(query, filters, limit):
+    """
+    Run a faceted search
+    
+    Returns:
+        tuple: (rows by image ID, results DataFrame, total matches, facet counts)
+    """
+    found = db.search_images_faceted(query=query or None, limit=limit, **filters)
+    results, result_df = _build_results([_image_row(img) for img in found["images"]])
+    return results, result_df, found["total"], found["facets"]
+
+def get_faceted_results(query, filters, limit=200):
+    """
+    Get faceted search results, reusing cached results for the same query and filters
+    """
+    key = ("Faceted", normalize_query(query), limit,
+           tuple(sorted((name, tuple(value) if isinstance(value, list) else value) for name, value in filters.items())))
+    return search_cache.get_or_compute(key, lambda: _run_faceted_search(query, filters, limit))
+
 def show_search_page():
     """
     Display a search interface for finding images by object name, description, or metadata
@@ -18,144 +98,274 @@ def show_search_page():
     </div>
     """, unsafe_allow_html=True)
 
+    # Search mode
+    search_mode = st.radio(
+        "Search mode",
+        ["Keyword", "Semantic", "Filters"],
+        horizontal=True,
+        help="Keyword matches the exact text; Semantic finds images with similar descriptions; "
+             "Filters drills down by camera, format, date, location and confidence"
+    )
+
+    if search_mode == "Filters":
+        show_faceted_search()
+        return
+
+    if search_mode == "Semantic":
+        show_semantic_index_status()
+
     # Search input
     search_query = st.text_input("Search for objects, descriptions, or metadata", 
                                 help="Enter keywords to search. Examples: 'cat', 'mountain', 'sunset', 'iPhone', 'Canon', 'JPEG', etc.")
 
     # Execute search when a query is entered
     if search_query:
-        results = search_images(search_query)
+        max_results = 20
+        if search_mode == "Semantic":
+            max_results = st.slider("Maximum results", min_value=5, max_value=200, value=20, step=5)
+        results, result_df = get_search_results(search_query, search_mode, max_results)
 
         if not results:
             st.info(f"No results found for '{search_query}'")
             return
 
-        # Convert to DataFrame for better display
-        result_data = [{
-            "id": img.id,
-            "file_name": img.file_name, 
-            "folder_name": img.folder.name if img.folder else "Unknown",
-            "object_name": img.object_name, 
-            "confidence": img.confidence,
-            "camera_info": f"{img.camera_make} {img.camera_model}".strip() if hasattr(img, 'camera_make') and img.camera_make else "",
-            "file_type": img.file_type.upper() if hasattr(img, 'file_type') and img.file_type else "",
-            "description_snippet": img.description[:100] + "..." if len(img.description) > 100 else img.description
-        } for img in results]
-
-        result_df = pd.DataFrame(result_data)
-
-        # Display results count
-        st.subheader(f"Found {len(results)} results")
-
-        # Display as a table
-        st.dataframe(
-            result_df[["file_name", "folder_name", "object_name", "confidence", "camera_info", "file_type", "description_snippet"]],
-            use_container_width=True, #Added for mobile optimization
-            column_config={
-                "file_name": "Image Name",
-                "folder_name": "Folder",
-                "object_name": "Object Identified",
-                "confidence": st.column_config.NumberColumn("Confidence", format="%.2f"),
-                "camera_info": "Camera",
-                "file_type": "Format",
-                "description_snippet": "Description Preview"
-            },
-            hide_index=True
-        )
-
-        # Add export options
-        st.subheader("Export Search Results")
-
-        st.markdown('<div class="export-options">', unsafe_allow_html=True)
-        export_format = st.selectbox("Export Format", 
-                                    ["CSV", "Excel", "PDF (Simple)", "PDF (Detailed)"],
-                                    key="search_export_format")
-
-        if export_format.startswith("PDF"):
-            include_images = st.checkbox("Include Images in PDF", value=True, 
-                                        help="Include image previews in the PDF export (may increase file size)",
-                                        key="search_include_images")
-        st.markdown('</div>', unsafe_allow_html=True)
-
-        # Add text area for folder description
-        folder_description = st.text_area(
-            "Folder Description (will be included in exports)",
-            value=f"Collection of images related to '{search_query}'",
-            height=100,
-            key="search_folder_description"
-        )
-
-        if st.button("Export Results", key="search_export_button"):
-            # Construct a proper dataframe for export with all fields
-            export_data = []
-            for img in results:
-                export_data.append({
-                    "file_name": img.file_name,
-                    "file_path": img.file_path,
-                    "folder_name": img.folder.name if img.folder else "Unknown",
-                    "object_name": img.object_name,
-                    "description": img.description,
-                    "confidence": img.confidence,
-                    "processed_at": img.processed_at.strftime("%Y-%m-%d %H:%M:%S"),
-                    "folder_description": folder_description,
-                    "item_description": f"Found in search for '{search_query}'"
-                })
-
-            export_df = pd.DataFrame(export_data)
-
-            if export_format == "CSV":
-                export_filename = export_to_csv(export_df, f"search_results_{search_query}")
-                st.success(f"Results exported to {export_filename}")
-
-            elif export_format == "Excel":
-                export_filename = export_to_excel(export_df, f"search_results_{search_query}")
-                st.success(f"Results exported to {export_filename}")
-
-            elif export_format == "PDF (Simple)":
-                with st.spinner("Generating PDF..."):
-                    export_filename = export_to_pdf_simple(export_df, f"search_results_{search_query}")
-                st.success(f"Results exported to {export_filename}")
-
-            elif export_format == "PDF (Detailed)":
-                with st.spinner("Generating detailed PDF report with images..."):
-                    include_imgs = include_images if 'include_images' in locals() else True
-                    export_filename = export_to_pdf_detailed(export_df, f"search_results_{search_query}", include_imgs)
-                st.success(f"Results exported to {export_filename}")
-
-            # Provide download link
-            with open(export_filename, "rb") as file:
-                btn = st.download_button(
-                    label="Download File",
-                    data=file,
-                    file_name=os.path.basename(export_filename),
-                    mime="application/octet-stream",
-                    key="search_download_button"
-                )
-
-        # Let user select an image to view details
-        st.subheader("View Image Details")
-        selected_image_id = st.selectbox(
-            "Select an image to view details",
-            options=result_df["id"].tolist(),
-            format_func=lambda x: f"{result_df[result_df['id'] == x]['file_name'].iloc[0]} ({result_df[result_df['id'] == x]['folder_name'].iloc[0]})"
-        )
-
-        if selected_image_id:
-            show_search_result_details(selected_image_id)
+        show_search_results(results, result_df, search_query, show_similarity=search_mode == "Semantic")
     else:
         st.info("Enter a search term to find images")
 
-def show_search_result_details(image_id):
+def _facet_filters_from_state():
     """
-    Display details for a specific image from search results
+    Read the faceted search filters from the widgets' state of the previous run
+    
+    Facet counts depend on the filters, and the filter widgets need the counts
+    for their options, so the filters are read before the widgets are drawn.
+    """
+    state = st.session_state
+    filters = {
+        "camera_make": state.get("facet_camera_make") or None,
+        "camera_model": state.get("facet_camera_model") or None,
+        "file_type": state.get("facet_file_type") or None,
+    }
+    
+    if state.get("facet_use_dates") and len(state.get("facet_dates") or ()) == 2:
+        date_from, date_to = state["facet_dates"]
+        filters["date_from"] = datetime.datetime.combine(date_from, datetime.time.min)
+        filters["date_to"] = datetime.datetime.combine(date_to, datetime.time.max)
+    
+    if state.get("facet_use_bbox"):
+        filters["bbox"] = (state.get("facet_min_lat", -90.0), state.get("facet_min_lon", -180.0),
+                           state.get("facet_max_lat", 90.0), state.get("facet_max_lon", 180.0))
+    
+    min_confidence, max_confidence = state.get("facet_confidence", (0.0, 1.0))
+    if min_confidence > 0.0:
+        filters["min_confidence"] = min_confidence
+    if max_confidence < 1.0:
+        filters["max_confidence"] = max_confidence
+    return filters
+
+def _facet_multiselect(label, key, counts):
     """
-    # Find the image in the database
-    db = next(get_db())
-    image = db.query(Image).filter(Image.id == image_id).first()
+    Multiselect for one facet, labelling each value with its match count
+    """
+    counts = {value or "": count for value, count in counts}
+    # Keep selected values selectable even when nothing else matches them
+    for value in st.session_state.get(key) or []:
+        counts.setdefault(value, 0)
+    return st.multiselect(
+        label,
+        options=list(counts),
+        format_func=lambda value: f"{value or 'Unknown'} ({counts[value]})",
+        key=key
+    )
 
-    if not image:
-        st.error("Image not found")
+def show_faceted_search():
+    """
+    Display structured filters with per-value counts and the matching images
+    """
+    query = st.text_input("Text in object name or description (optional)", key="facet_query")
+    limit = 200
+    results, result_df, total, facets = get_faceted_results(query, _facet_filters_from_state(), limit)
+    
+    col1, col2, col3 = st.columns(3)
+    with col1:
+        _facet_multiselect("Camera Make", "facet_camera_make", facets["camera_make"])
+    with col2:
+        _facet_multiselect("Camera Model", "facet_camera_model", facets["camera_model"])
+    with col3:
+        _facet_multiselect("File Type", "facet_file_type", facets["file_type"])
+    
+    st.slider("Confidence", min_value=0.0, max_value=1.0, value=(0.0, 1.0), step=0.05, key="facet_confidence")
+    
+    col1, col2 = st.columns(2)
+    with col1:
+        if st.checkbox("Filter by date taken", key="facet_use_dates"):
+            today = datetime.date.today()
+            st.date_input("Date taken between", value=(today - datetime.timedelta(days=365), today), key="facet_dates")
+    with col2:
+        if st.checkbox("Filter by GPS area", key="facet_use_bbox"):
+            lat1, lat2 = st.columns(2)
+            lat1.number_input("Min latitude", min_value=-90.0, max_value=90.0, value=-90.0, key="facet_min_lat")
+            lat2.number_input("Max latitude", min_value=-90.0, max_value=90.0, value=90.0, key="facet_max_lat")
+            lon1, lon2 = st.columns(2)
+            lon1.number_input("Min longitude", min_value=-180.0, max_value=180.0, value=-180.0, key="facet_min_lon")
+            lon2.number_input("Max longitude", min_value=-180.0, max_value=180.0, value=180.0, key="facet_max_lon")
+    
+    if not results:
+        st.info("No images match the selected filters")
         return
+    
+    show_search_results(results, result_df, query or "filtered images", total=total)
+
+def show_search_results(results, result_df, search_label, show_similarity=False, total=None):
+    """
+    Display search results with export options and a detail view
+    
+    Args:
+        results: Cached result rows by image ID
+        result_df: Results DataFrame for the table
+        search_label: Description of the search, used in export names
+        show_similarity: Show the semantic similarity column
+        total: Total number of matches when only the first ones were fetched
+    """
+    # Display results count
+    if total is not None and total > len(results):
+        st.subheader(f"Found {total} results (showing the newest {len(results)})")
+    else:
+        st.subheader(f"Found {len(results)} results")
+
+    display_columns = ["file_name", "folder_name", "object_name", "confidence", "camera_info", "file_type", "description_snippet"]
+    if show_similarity:
+        display_columns.insert(0, "similarity")
+
+    # Display as a table
+    st.dataframe(
+        result_df[display_columns],
+        use_container_width=True, #Added for mobile optimization
+        column_config={
+            "file_name": "Image Name",
+            "folder_name": "Folder",
+            "object_name": "Object Identified",
+            "confidence": st.column_config.NumberColumn("Confidence", format="%.2f"),
+            "camera_info": "Camera",
+            "file_type": "Format",
+            "description_snippet": "Description Preview",
+            "similarity": st.column_config.NumberColumn("Similarity", format="%.2f")
+        },
+        hide_index=True
+    )
+
+    # Add export options
+    st.subheader("Export Search Results")
+
+    st.markdown('<div class="export-options">', unsafe_allow_html=True)
+    export_format = st.selectbox("Export Format", 
+                                ["CSV", "Excel", "PDF (Simple)", "PDF (Detailed)"],
+                                key="search_export_format")
+
+    if export_format.startswith("PDF"):
+        include_images = st.checkbox("Include Images in PDF", value=True, 
+                                    help="Include image previews in the PDF export (may increase file size)",
+                                    key="search_include_images")
+    st.markdown('</div>', unsafe_allow_html=True)
+
+    # Add text area for folder description
+    folder_description = st.text_area(
+        "Folder Description (will be included in exports)",
+        value=f"Collection of images related to '{search_label}'",
+        height=100,
+        key="search_folder_description"
+    )
+
+    if st.button("Export Results", key="search_export_button"):
+        # Construct a proper dataframe for export with all fields
+        export_data = []
+        for row in results.values():
+            export_data.append({
+                "file_name": row["file_name"],
+                "file_path": row["file_path"],
+                "folder_name": row["folder_name"],
+                "object_name": row["object_name"],
+                "description": row["description"],
+                "confidence": row["confidence"],
+                "processed_at": row["processed_at"].strftime("%Y-%m-%d %H:%M:%S"),
+                "folder_description": folder_description,
+                "item_description": f"Found in search for '{search_label}'"
+            })
+
+        export_df = pd.DataFrame(export_data)
+
+        if export_format == "CSV":
+            export_filename = export_to_csv(export_df, f"search_results_{search_label}")
+            st.success(f"Results exported to {export_filename}")
+
+        elif export_format == "Excel":
+            export_filename = export_to_excel(export_df, f"search_results_{search_label}")
+            st.success(f"Results exported to {export_filename}")
+
+        elif export_format == "PDF (Simple)":
+            with st.spinner("Generating PDF..."):
+                export_filename = export_to_pdf_simple(export_df, f"search_results_{search_label}")
+            st.success(f"Results exported to {export_filename}")
+
+        elif export_format == "PDF (Detailed)":
+            with st.spinner("Generating detailed PDF report with images..."):
+                include_imgs = include_images if 'include_images' in locals() else True
+                export_filename = export_to_pdf_detailed(export_df, f"search_results_{search_label}", include_imgs)
+            st.success(f"Results exported to {export_filename}")
+
+        # Provide download link
+        with open(export_filename, "rb") as file:
+            btn = st.download_button(
+                label="Download File",
+                data=file,
+                file_name=os.path.basename(export_filename),
+                mime="application/octet-stream",
+                key="search_download_button"
+            )
+
+    # Let user select an image to view details
+    st.subheader("View Image Details")
+    selected_image_id = st.selectbox(
+        "Select an image to view details",
+        options=list(results),
+        format_func=lambda x: f"{results[x]['file_name']} ({results[x]['folder_name']})"
+    )
+
+    if selected_image_id:
+        show_search_result_details(results[selected_image_id])
+
+def show_semantic_index_status():
+    """
+    Show the state of the semantic index and let the user bring it up to date
+    """
+    index = get_index()
+    stats = index.stats()
+    analyzed = db.get_image_count()
+    
+    with st.expander(f"Semantic Index ({stats['images']} of {analyzed} images indexed)"):
+        st.markdown(f"**Embedding model:** {stats['embedder']} ({stats['dimension']} dimensions)")
+        st.markdown(f"**Index size:** {stats['size_mb']} MB, {stats['lists']} IVF lists")
+        
+        col1, col2 = st.columns(2)
+        with col1:
+            if st.button("Index Missing Images", disabled=stats['images'] >= analyzed):
+                progress_bar = st.progress(0)
+                added = sync_index(on_progress=lambda done, total: progress_bar.progress(done / total))
+                st.success(f"Indexed {added} images")
+        with col2:
+            if st.button("Rebuild Index Lists", help="Re-cluster the index after large imports to keep searches fast"):
+                with st.spinner("Rebuilding index..."):
+                    index.train()
+                st.success("Index rebuilt")
+
+def show_search_result_details(row):
+    """
+    Display details for a specific image from search results
+    
+    Args:
+        row: Cached result row for the image (see _image_row)
+    """
+    image = SimpleNamespace(**row)
 
     # Display image details
     col1, col2 = st.columns([1, 2])
@@ -173,7 +383,7 @@ def show_search_result_details(image_id):
     with col2:
         st.subheader("Analysis Results")
         st.markdown(f"**File:** {image.file_name}")
-        st.markdown(f"**Folder:** {image.folder.name if image.folder else 'Unknown'}")
+        st.markdown(f"**Folder:** {image.folder_name}")
         st.markdown(f"**Object Identified:** {image.object_name}")
         st.markdown(f"**Confidence:** {image.confidence:.2f}")
         st.markdown("### Description")
@@ -199,20 +409,11 @@ def show_search_result_details(image_id):
         col_btn1, col_btn2 = st.columns(2)
         
         with col_btn1:
-            # Check if image is already in favorites
-            existing_favorite = None
-            try:
-                db_session = db.get_db()
-                existing_favorite = db_session.query(db.FavoriteImage).filter(
-                    db.FavoriteImage.image_id == image.id
-                ).first()
-            except:
-                pass
-        
-            if existing_favorite:
+            # Favorite membership was looked up with the search results
+            if image.favorite_id:
                 st.success("This image is in your dashboard")
                 if st.button("Remove from Dashboard"):
-                    db.remove_from_favorites(existing_favorite.id)
+                    db.remove_from_favorites(image.favorite_id)
                     st.success("Removed from dashboard")
                     st.rerun()
             else:
@@ -229,7 +430,7 @@ def show_search_result_details(image_id):
                     "Confidence": image.confidence,
                     "File Name": image.file_name,
                     "File Path": image.file_path,
-                    "Folder": image.folder.name if image.folder else "Unknown",
+                    "Folder": image.folder_name,
                 }]
                 df = pd.DataFrame(image_data)
                 
@@ -0,0 +1,600 @@
+"""
+Semantic search over image descriptions
+
+Each analyzed image gets one float32 vector built from its object name and
+description. Vectors are kept in append-only files on disk and searched with an
+inverted-file (IVF) index: k-means centroids partition the vectors into lists,
+and a query only scores the vectors in its closest lists. Small collections are
+searched exhaustively.
+
+Embeddings come from a local sentence-transformers model when one is configured
+and installed, otherwise from a feature-hashing model that needs no downloads.
+"""
+import os
+import re
+import json
+import zlib
+import threading
+from contextlib import contextmanager
+import numpy as np
+import database as db
+
+try:
+    import fcntl
+except ImportError:
+    # Not available on Windows: there, only one process may write to an index
+    fcntl = None
+
+try:
+    from sentence_transformers import SentenceTransformer
+except ImportError:
+    SentenceTransformer = None
+
+INDEX_DIR = os.environ.get("SEMANTIC_INDEX_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "semantic_index"))
+EMBEDDER = os.environ.get("SEMANTIC_EMBEDDER", "hashing")
+EMBEDDING_MODEL = os.environ.get("SEMANTIC_EMBEDDING_MODEL", "all-MiniLM-L6-v2")
+
+# Below this many vectors an exhaustive scan is fast enough
+IVF_MIN_VECTORS = 20000
+# Vectors sampled to train the centroids
+TRAIN_SAMPLE_PER_LIST = 32
+TRAIN_SAMPLE_MAX = 65536
+
+STOP_WORDS = {
+    "a", "an", "and", "the", "of", "in", "on", "with", "to", "for", "is", "are",
+    "it", "its", "this", "that", "at", "by", "from", "as", "or", "be", "has", "image", "photo",
+}
+
+class HashingEmbedder:
+    """
+    Feature-hashing text embedder
+
+    Words, word pairs and character 4-grams are hashed into a fixed number of
+    signed buckets, so different forms of a word ("watch", "watches") and
+    reordered phrases land close together. Deterministic across processes.
+    """
+    def __init__(self, dim=256):
+        self.dim = dim
+        self.name = f"hashing-{dim}"
+
+    def _features(self, text):
+        words = [w for w in re.findall(r"[a-z0-9]+", text.lower()) if w not in STOP_WORDS]
+        features = []
+        for word in words:
+            features.append(("w:" + word, 1.0))
+            padded = f"#{word}#"
+            for i in range(max(1, len(padded) - 3)):
+                features.append(("c:" + padded[i:i + 4], 0.5))
+        for first, second in zip(words, words[1:]):
+            features.append((f"b:{first} {second}", 0.7))
+        return features
+
+    def embed(self, texts):
+        vectors = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            for feature, weight in self._features(text or ""):
+                h = zlib.crc32(feature.encode())
+                vectors[row, h % self.dim] += weight if h & 0x80000000 else -weight
+        return _normalize(vectors)
+
+class SentenceTransformerEmbedder:
+    """
+    Embedder backed by a local sentence-transformers model
+    """
+    def __init__(self, model_name=EMBEDDING_MODEL):
+        self.model = SentenceTransformer(model_name)
+        self.dim = self.model.get_sentence_embedding_dimension()
+        self.name = f"st-{model_name}"
+
+    def embed(self, texts):
+        vectors = self.model.encode(list(texts), batch_size=64, convert_to_numpy=True)
+        return _normalize(vectors.astype(np.float32))
+
+def _normalize(vectors):
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+def get_embedder():
+    """
+    Create the configured embedder, falling back to hashing if the model is unavailable
+    """
+    if EMBEDDER == "sentence-transformers":
+        if SentenceTransformer is not None:
+            try:
+                return SentenceTransformerEmbedder()
+            except Exception as e:
+                print(f"Error loading embedding model {EMBEDDING_MODEL}: {str(e)}")
+        else:
+            print("sentence-transformers is not installed; using the hashing embedder")
+    return HashingEmbedder()
+
+def image_text(object_name, description):
+    """
+    Text that represents an image in the index
+    """
+    return f"{object_name or ''}. {description or ''}"
+
+def _kmeans(vectors, k, iterations=10, seed=0):
+    """
+    Spherical k-means on unit vectors
+
+    Returns:
+        numpy.ndarray: k x dim array of unit-length centroids
+    """
+    rng = np.random.default_rng(seed)
+    centroids = vectors[rng.choice(len(vectors), size=k, replace=False)].copy()
+    for _ in range(iterations):
+        labels = np.argmax(vectors @ centroids.T, axis=1)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, labels, vectors)
+        counts = np.bincount(labels, minlength=k)
+        empty = counts == 0
+        # Reseed empty lists from random vectors
+        sums[empty] = vectors[rng.choice(len(vectors), size=int(empty.sum()))]
+        centroids = _normalize(sums)
+    return centroids
+
+class VectorIndex:
+    """
+    Append-only vector store with an IVF index, persisted in a directory
+
+    Files:
+        meta.json       embedder name, dimension and training info
+        vectors.f32     one float32 row per entry
+        ids.i64         image ID per row
+        lists.i32       IVF list per row (-1 before the index is trained)
+        centroids.npy   IVF centroids
+
+    Re-indexing an image appends a new row; the newest row for an ID wins.
+    Rows appended since the inverted lists were last sorted are kept in a small
+    tail that is scanned directly, so appends stay cheap.
+
+    Several processes (the app, the CLI, ingest workers) can share a directory:
+    writes take an exclusive lock on its .lock file and reads a shared one, so
+    an append is never interleaved with another or read half-written.
+    """
+    # Re-sort the inverted lists once this many rows have been appended
+    MAX_TAIL = 4096
+
+    def __init__(self, path=INDEX_DIR, embedder=None):
+        self.path = path
+        self.embedder = embedder or get_embedder()
+        self.dim = self.embedder.dim
+        self._lock = threading.Lock()
+        self._loaded_rows = 0
+        self._trained_at = None
+        self._clear()
+
+    def _file(self, name):
+        return os.path.join(self.path, name)
+
+    @contextmanager
+    def _locked(self, exclusive=False):
+        # Lock against other threads, then against other processes using the directory
+        with self._lock:
+            if fcntl is None:
+                yield
+                return
+            os.makedirs(self.path, exist_ok=True)
+            with open(self._file(".lock"), "a") as lock_file:
+                fcntl.flock(lock_file, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _clear(self):
+        self._size = 0
+        self._vectors = np.zeros((0, self.dim), dtype=np.float32)
+        self._ids = np.zeros(0, dtype=np.int64)
+        self._lists = np.zeros(0, dtype=np.int32)
+        self._valid = np.zeros(0, dtype=bool)
+        self._row_by_id = {}
+        self.centroids = None
+        self.trained_rows = 0
+        self._list_order = None
+        self._list_offsets = None
+        self._sorted_rows = 0
+
+    @property
+    def vectors(self):
+        return self._vectors[:self._size]
+
+    @property
+    def ids(self):
+        return self._ids[:self._size]
+
+    @property
+    def lists(self):
+        return self._lists[:self._size]
+
+    @property
+    def valid(self):
+        return self._valid[:self._size]
+
+    def _reserve(self, rows):
+        # Grow the buffers geometrically so appends are amortized O(1)
+        if rows <= len(self._ids):
+            return
+        capacity = max(rows, 2 * len(self._ids), 1024)
+        for name, shape in (("_vectors", (capacity, self.dim)), ("_ids", (capacity,)),
+                            ("_lists", (capacity,)), ("_valid", (capacity,))):
+            old = getattr(self, name)
+            grown = np.zeros(shape, dtype=old.dtype)
+            grown[:self._size] = old[:self._size]
+            setattr(self, name, grown)
+
+    def _append(self, ids, vectors, lists):
+        start = self._size
+        self._reserve(start + len(ids))
+        end = start + len(ids)
+        self._vectors[start:end] = vectors
+        self._ids[start:end] = ids
+        self._lists[start:end] = lists
+        self._valid[start:end] = True
+        self._size = end
+        for row, image_id in enumerate(ids.tolist(), start):
+            previous = self._row_by_id.get(image_id)
+            if previous is not None:
+                self._valid[previous] = False
+            self._row_by_id[image_id] = row
+
+    # Persistence
+
+    def _rows_on_disk(self):
+        try:
+            return os.path.getsize(self._file("ids.i64")) // 8
+        except OSError:
+            return 0
+
+    def _centroids_mtime(self):
+        try:
+            return os.path.getmtime(self._file("centroids.npy"))
+        except OSError:
+            return None
+
+    def _read_meta(self):
+        try:
+            with open(self._file("meta.json")) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _meta_matches(self, meta):
+        return bool(meta) and meta.get("embedder") == self.embedder.name and meta.get("dim") == self.dim
+
+    def _write_meta(self):
+        os.makedirs(self.path, exist_ok=True)
+        tmp = self._file("meta.json.tmp")
+        with open(tmp, "w") as f:
+            json.dump({"embedder": self.embedder.name, "dim": self.dim, "trained_rows": self.trained_rows}, f)
+        os.replace(tmp, self._file("meta.json"))
+
+    def _read_rows(self, start, stop):
+        """
+        Read rows [start, stop) from the data files
+        """
+        count = stop - start
+        with open(self._file("ids.i64"), "rb") as f:
+            f.seek(start * 8)
+            ids = np.fromfile(f, dtype=np.int64, count=count)
+        with open(self._file("vectors.f32"), "rb") as f:
+            f.seek(start * self.dim * 4)
+            vectors = np.fromfile(f, dtype=np.float32, count=count * self.dim)
+        with open(self._file("lists.i32"), "rb") as f:
+            f.seek(start * 4)
+            lists = np.fromfile(f, dtype=np.int32, count=count)
+        # A crash mid-append can leave the files with different row counts
+        rows = min(len(ids), len(vectors) // self.dim, len(lists))
+        return ids[:rows], vectors[:rows * self.dim].reshape(rows, self.dim), lists[:rows]
+
+    def load(self):
+        """
+        Load the index from disk, or start empty if it was built with another embedder
+        """
+        with self._locked():
+            self._load()
+
+    def _load(self):
+        self._clear()
+        self._loaded_rows = self._rows_on_disk()
+        self._trained_at = self._centroids_mtime()
+        meta = self._read_meta()
+        if not self._meta_matches(meta) or self._loaded_rows == 0:
+            return
+
+        self.trained_rows = meta.get("trained_rows", 0)
+        if self._trained_at is not None:
+            self.centroids = np.load(self._file("centroids.npy"))
+        self._load_rows(0, self._loaded_rows)
+        self._build_lists()
+
+    def _load_rows(self, start, stop):
+        ids, vectors, lists = self._read_rows(start, stop)
+        if self.centroids is not None:
+            untrained = lists < 0
+            if untrained.any():
+                lists[untrained] = self._assign(vectors[untrained])
+        self._append(ids, vectors, lists)
+
+    def _refresh(self):
+        # Pick up changes made by other processes (e.g. the CLI ingest)
+        rows = self._rows_on_disk()
+        if self._centroids_mtime() != self._trained_at or rows < self._loaded_rows:
+            self._load()
+        elif rows > self._loaded_rows:
+            if not self._meta_matches(self._read_meta()):
+                self._load()
+                return
+            self._load_rows(self._loaded_rows, rows)
+            self._loaded_rows = rows
+
+    def _build_lists(self):
+        if self.centroids is None:
+            self._list_order = None
+            self._list_offsets = None
+            self._sorted_rows = 0
+            return
+        self._list_order = np.argsort(self.lists, kind="stable")
+        counts = np.bincount(self.lists, minlength=len(self.centroids))
+        self._list_offsets = np.concatenate([[0], np.cumsum(counts)])
+        self._sorted_rows = self._size
+
+    def _assign(self, vectors, chunk_size=8192):
+        lists = np.empty(len(vectors), dtype=np.int32)
+        for start in range(0, len(vectors), chunk_size):
+            lists[start:start + chunk_size] = np.argmax(vectors[start:start + chunk_size] @ self.centroids.T, axis=1)
+        return lists
+
+    # Updates
+
+    def add(self, image_ids, texts):
+        """
+        Embed texts and append them to the index
+
+        Args:
+            image_ids (list): Image ID for each text
+            texts (list): Text to embed for each image
+        """
+        if not image_ids:
+            return
+        vectors = self.embedder.embed(texts)
+        ids = np.asarray(image_ids, dtype=np.int64)
+
+        with self._locked(exclusive=True):
+            self._refresh()
+            if not self._meta_matches(self._read_meta()):
+                # Vectors from another embedder are not comparable; start over
+                self._remove_files()
+                self._clear()
+                self._write_meta()
+            self._truncate_uncommitted()
+
+            lists = self._assign(vectors) if self.centroids is not None else np.full(len(ids), -1, dtype=np.int32)
+            with open(self._file("vectors.f32"), "ab") as f:
+                f.write(vectors.tobytes())
+            with open(self._file("lists.i32"), "ab") as f:
+                f.write(lists.tobytes())
+            # IDs last: their file length is the committed row count
+            with open(self._file("ids.i64"), "ab") as f:
+                f.write(ids.tobytes())
+
+            self._append(ids, vectors, lists)
+            self._loaded_rows = self._rows_on_disk()
+
+            if self.centroids is None and len(self._row_by_id) >= IVF_MIN_VECTORS:
+                self._train()
+            elif self.centroids is not None and self._size - self._sorted_rows > self.MAX_TAIL:
+                self._build_lists()
+
+    def train(self, nlist=None):
+        """
+        (Re)train the IVF centroids and reassign every vector
+
+        Args:
+            nlist (int): Number of lists (defaults to about sqrt of the vector count)
+        """
+        with self._locked(exclusive=True):
+            self._refresh()
+            self._train(nlist)
+
+    def _train(self, nlist=None):
+        rows = np.flatnonzero(self.valid)
+        if len(rows) == 0:
+            return
+        if nlist is None:
+            nlist = int(np.sqrt(len(rows)))
+        nlist = max(1, min(nlist, len(rows)))
+
+        rng = np.random.default_rng(0)
+        sample_size = min(len(rows), max(nlist, min(TRAIN_SAMPLE_MAX, nlist * TRAIN_SAMPLE_PER_LIST)))
+        sample = self.vectors[rng.choice(rows, size=sample_size, replace=False)]
+        self.centroids = _kmeans(sample, nlist)
+        self._lists[:self._size] = self._assign(self.vectors)
+        self.trained_rows = len(rows)
+
+        np.save(self._file("centroids.tmp.npy"), self.centroids)
+        os.replace(self._file("centroids.tmp.npy"), self._file("centroids.npy"))
+        with open(self._file("lists.i32.tmp"), "wb") as f:
+            f.write(self.lists.tobytes())
+        os.replace(self._file("lists.i32.tmp"), self._file("lists.i32"))
+        self._write_meta()
+        self._trained_at = self._centroids_mtime()
+        self._build_lists()
+
+    def reset(self):
+        """
+        Delete the index files
+        """
+        with self._locked(exclusive=True):
+            self._remove_files()
+            self._clear()
+            self._loaded_rows = 0
+            self._trained_at = None
+
+    def _truncate_uncommitted(self):
+        # A writer that died mid-append can leave vectors or lists past the committed
+        # rows (the length of ids.i64); cut them off so new rows line up again
+        rows = self._rows_on_disk()
+        for name, row_bytes in (("vectors.f32", self.dim * 4), ("lists.i32", 4)):
+            try:
+                if os.path.getsize(self._file(name)) > rows * row_bytes:
+                    os.truncate(self._file(name), rows * row_bytes)
+            except OSError:
+                continue
+
+    def _remove_files(self):
+        for name in ("meta.json", "vectors.f32", "ids.i64", "lists.i32", "centroids.npy"):
+            if os.path.exists(self._file(name)):
+                os.remove(self._file(name))
+
+    # Queries
+
+    def search(self, query, k=20, nprobe=16):
+        """
+        Find the images whose descriptions are closest to a query
+
+        Args:
+            query (str): Free-text query
+            k (int): Number of results
+            nprobe (int): IVF lists scanned per query (more is slower but more exact)
+
+        Returns:
+            list: (image_id, score) tuples, best match first
+        """
+        vector = self.embedder.embed([query])[0]
+        with self._locked():
+            self._refresh()
+            if self.centroids is not None and len(self.centroids) > nprobe:
+                closest = np.argpartition(self.centroids @ vector, -nprobe)[-nprobe:]
+                tail = np.arange(self._sorted_rows, self._size)
+                rows = np.concatenate(
+                    [self._list_order[self._list_offsets[c]:self._list_offsets[c + 1]] for c in closest]
+                    + [tail[np.isin(self.lists[tail], closest)]]
+                )
+                rows = rows[self.valid[rows]]
+            else:
+                rows = np.flatnonzero(self.valid)
+
+            if len(rows) == 0:
+                return []
+            scores = self.vectors[rows] @ vector
+            ids = self.ids[rows]
+
+        k = min(k, len(rows))
+        top = np.argpartition(scores, -k)[-k:]
+        top = top[np.argsort(scores[top])[::-1]]
+        return [(int(ids[i]), float(scores[i])) for i in top]
+
+    def get_vectors(self, image_ids):
+        """
+        Look up the stored vectors of several images
+
+        Returns:
+            tuple: (len(image_ids) x dim array, boolean mask of the IDs that were found)
+        """
+        with self._locked():
+            self._refresh()
+            rows = np.array([self._row_by_id.get(image_id, -1) for image_id in image_ids], dtype=np.int64)
+            found = rows >= 0
+            vectors = np.zeros((len(rows), self.dim), dtype=np.float32)
+            vectors[found] = self.vectors[rows[found]]
+            return vectors, found
+
+    def indexed_ids(self):
+        with self._locked():
+            self._refresh()
+            return set(self._row_by_id)
+
+    def stats(self):
+        with self._locked():
+            self._refresh()
+            return {
+                "embedder": self.embedder.name,
+                "dimension": self.dim,
+                "images": len(self._row_by_id),
+                "rows": self._size,
+                "lists": len(self.centroids) if self.centroids is not None else 0,
+                "trained_on": self.trained_rows,
+                "size_mb": round(self.vectors.nbytes / (1024 * 1024), 1),
+            }
+
+_index = None
+_index_lock = threading.Lock()
+
+def get_index():
+    """
+    Get the shared vector index, loading it on first use
+    """
+    global _index
+    with _index_lock:
+        if _index is None:
+            _index = VectorIndex()
+            _index.load()
+        return _index
+
+def index_images(images):
+    """
+    Add analyzed images to the semantic index
+
+    Args:
+        images (list): (image_id, object_name, description) tuples
+    """
+    images = [image for image in images if image[2]]
+    if not images:
+        return
+    try:
+        get_index().add([image_id for image_id, _, _ in images],
+                        [image_text(object_name, description) for _, object_name, description in images])
+    except Exception as e:
+        print(f"Error updating semantic index: {str(e)}")
+
+def description_vectors(images):
+    """
+    Get a description vector for each image, embedding any that are not indexed yet
+
+    Args:
+        images (list): (image_id, object_name, description) tuples
+
+    Returns:
+        numpy.ndarray: One unit-length float32 row per image
+    """
+    index = get_index()
+    vectors, found = index.get_vectors([image_id for image_id, _, _ in images])
+    missing = np.flatnonzero(~found)
+    if len(missing):
+        vectors[missing] = index.embedder.embed([image_text(images[i][1], images[i][2]) for i in missing])
+    return vectors
+
+def sync_index(batch_size=1000, on_progress=None):
+    """
+    Index every analyzed image in the database that is missing from the index
+
+    Args:
+        batch_size (int): Images embedded per batch
+        on_progress (callable): Called as on_progress(indexed, total)
+
+    Returns:
+        int: Number of images added
+    """
+    index = get_index()
+    indexed = index.indexed_ids()
+    missing = [row for row in db.get_image_texts() if row[0] not in indexed]
+
+    for start in range(0, len(missing), batch_size):
+        index_images(missing[start:start + batch_size])
+        if on_progress:
+            on_progress(min(start + batch_size, len(missing)), len(missing))
+    return len(missing)
+
+def semantic_search(query, k=20, nprobe=16):
+    """
+    Search analyzed images by meaning rather than exact words
+
+    Returns:
+        list: (Image, score) tuples, best match first
+    """
+    matches = get_index().search(query, k=k, nprobe=nprobe)
+    images = {image.id: image for image in db.get_images_by_ids([image_id for image_id, _ in matches])}
+    return [(images[image_id], score) for image_id, score in matches if image_id in images]
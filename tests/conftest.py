@@ -0,0 +1,12 @@
+import os
+import sys
+import tempfile
+
+# The database engine is created on import, so point it at a scratch SQLite file first
+_scratch = tempfile.mkdtemp(prefix="ai-imager-tests-")
+os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(_scratch, 'test.db')}"
+os.environ["SEMANTIC_INDEX_DIR"] = os.path.join(_scratch, "semantic_index")
+# image_processor builds its OpenAI client on import; the tests never call the API
+os.environ.setdefault("OPENAI_API_KEY", "test")
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,34 @@
+import os
+import database as db
+from metadata_ingest import ingest_folder_metadata
+from test_metadata_search import _make_images
+
+def _summary(summaries, path):
+    return next(folder for folder in summaries if folder["path"] == path)
+
+def test_folder_summaries_count_analyzed_images_only(tmp_path):
+    parent = str(tmp_path / "library")
+    child = os.path.join(parent, "2024")
+    parent_paths = _make_images(parent, 5)
+    child_paths = _make_images(child, 3)
+    ingest_folder_metadata(parent, max_workers=1)
+    ingest_folder_metadata(child, max_workers=1)
+    parent_id = db.get_folder_by_path(parent).id
+    child_id = db.add_folder("2024", child, parent_id=parent_id).id
+
+    # Metadata only: the folders are listed, with nothing counted yet
+    summary = _summary(db.get_folder_summaries(), parent)
+    assert (summary["image_count"], summary["total_bytes"], summary["avg_confidence"]) == (0, 0, None)
+    assert db.get_images_by_folder_id(parent_id, analyzed_only=True) == []
+
+    db.add_image_result(parent_id, os.path.basename(parent_paths[0]), parent_paths[0], "Mug", "A mug", 0.9)
+    db.add_image_result(child_id, os.path.basename(child_paths[0]), child_paths[0], "Pen", "A pen", 0.5)
+
+    summary = _summary(db.get_folder_summaries(), parent)
+    assert summary["image_count"] == len(db.get_images_by_folder_id(parent_id, analyzed_only=True)) == 1
+    assert summary["total_bytes"] == os.path.getsize(parent_paths[0])
+
+    tree = _summary(db.get_folder_tree_summaries(), parent)
+    assert tree["subtree_image_count"] == 2
+    assert tree["subtree_total_bytes"] == os.path.getsize(parent_paths[0]) + os.path.getsize(child_paths[0])
+    assert abs(tree["subtree_avg_confidence"] - 0.7) < 1e-9
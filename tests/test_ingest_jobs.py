@@ -0,0 +1,53 @@
+import datetime
+import database as db
+
+def test_claim_skips_jobs_with_open_batches(tmp_path):
+    image_path = str(tmp_path / "a.jpg")
+    job = db.create_ingest_job("batched", [("batched", str(tmp_path), [image_path])])
+    db.enqueue_ingest_job(job.id)
+    batch = db.add_analysis_batch(job.id, "batch_123", "file_123", "in_progress", [])
+
+    assert db.claim_next_ingest_job("worker-a") is None
+
+    db.update_analysis_batch(batch.id, status="completed", ingested_at=datetime.datetime.utcnow())
+    claimed = db.claim_next_ingest_job("worker-a")
+    assert claimed is not None and claimed.id == job.id
+
+def test_failed_items_are_retried_max_retries_times(tmp_path):
+    job = db.create_ingest_job("retries", [("retries", str(tmp_path), [str(tmp_path / "b.jpg")])])
+    (item_id,) = [item.id for item in db.get_pending_job_items(job.id)]
+
+    attempts = 1
+    db.complete_job_items([], [(item_id, "boom")])
+    while db.reset_job_items(job.id, retry_failed=True, max_retries=2):
+        attempts += 1
+        db.complete_job_items([], [(item_id, "boom")])
+
+    # The first attempt plus two retries
+    assert attempts == 3
+    with db.session_scope() as session:
+        item = session.get(db.IngestJobItem, item_id)
+        assert item.status == db.JOB_ITEM_FAILED and item.retry_count == 2
+
+def test_failed_folder_fails_its_items_instead_of_stalling(tmp_path, monkeypatch):
+    import threading
+    from ingest_jobs import run_ingest_job
+    from ingest_pipeline import IngestPipeline
+
+    image_files = [str(tmp_path / f"{i}.jpg") for i in range(6)]
+    job = db.create_ingest_job("broken folder", [("broken", str(tmp_path), image_files)])
+
+    def add_folder(*args, **kwargs):
+        raise RuntimeError("database unavailable")
+    monkeypatch.setattr(db, "add_folder", add_folder)
+
+    pipeline = IngestPipeline(metadata_workers=0, analyze_workers=1, provider="offline")
+    outcome = {}
+    # Two items per chunk and at most two leased: stalls unless failed chunks produce results
+    run = threading.Thread(target=lambda: outcome.update(
+        run_ingest_job(job.id, pipeline=pipeline, chunk_size=2, max_leased=2)), daemon=True)
+    run.start()
+    run.join(timeout=30)
+
+    assert not run.is_alive()
+    assert outcome["failed"] == 6 and outcome["remaining"] == 0
@@ -0,0 +1,49 @@
+import os
+from PIL import Image as PILImage
+import database as db
+import search_page
+from metadata_ingest import ingest_folder_metadata
+
+def _make_images(folder, count):
+    os.makedirs(folder, exist_ok=True)
+    paths = []
+    for i in range(count):
+        path = os.path.join(folder, f"photo_{i}.jpg")
+        PILImage.new("RGB", (32, 32), (i * 40 % 256, 80, 160)).save(path)
+        paths.append(path)
+    return paths
+
+def test_search_skips_metadata_only_images(tmp_path):
+    folder = str(tmp_path / "metadata_only")
+    paths = _make_images(folder, 3)
+    assert ingest_folder_metadata(folder, max_workers=1) == 3
+
+    # One of the images gets analyzed; the others stay metadata-only
+    folder_id = db.get_folder_by_path(folder).id
+    db.add_image_result(folder_id, os.path.basename(paths[0]), paths[0], "Mug",
+                        "A blue mug on a desk", 0.9)
+
+    rows, result_df = search_page._run_search("jpg", "Keyword", 20)
+    # Other tests share the database; look at this folder's images
+    assert [row["file_path"] for row in rows.values() if row["file_path"] in paths] == [paths[0]]
+    assert "A blue mug on a desk" in result_df["description_snippet"].tolist()
+    assert all(row["description"] is not None for row in rows.values())
+
+def test_faceted_search_counts_only_analyzed_images(tmp_path):
+    folder = str(tmp_path / "faceted")
+    paths = _make_images(folder, 4)
+    ingest_folder_metadata(folder, max_workers=1)
+    folder_id = db.get_folder_by_path(folder).id
+    db.add_image_result(folder_id, os.path.basename(paths[1]), paths[1], "Lamp",
+                        "A desk lamp", 0.8)
+
+    rows, result_df, total, facets = search_page._run_faceted_search("lamp", {}, 200)
+    assert total == 1
+    assert [row["file_path"] for row in rows.values()] == [paths[1]]
+
+    # Unfiltered: no metadata-only rows in the totals or the facet counts
+    found = db.search_images_faceted()
+    assert found["total"] == db.get_image_count()
+    assert all(image.description is not None for image in found["images"])
+    assert sum(count for _, count in found["facets"]["file_type"]) == found["total"]
+    search_page._build_results([search_page._image_row(image) for image in found["images"]])
@@ -0,0 +1,17 @@
+import database as db
+from query_cache import QueryCache
+
+def test_lookups_never_write_samples(monkeypatch):
+    recorded = []
+    monkeypatch.setattr(db, "add_cache_sample", lambda *args: recorded.append(args))
+
+    cache = QueryCache(name="lookups")
+    cache.get_or_compute("a", lambda: 1)
+    for _ in range(5):
+        assert cache.get("a") == (True, 1)
+    assert recorded == []
+
+    # The sampler thread records the counts since the last sample
+    assert cache.record_sample() == (5, 1)
+    assert recorded == [("lookups", 5, 1)]
+    assert cache.record_sample() is None
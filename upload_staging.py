@@ -0,0 +1,213 @@
+import os
+import uuid
+import shutil
+import hashlib
+import tempfile
+import threading
+import metrics
+import database as db
+from utils import is_valid_image
+
+# Staging configuration:
+#   UPLOAD_STAGING_DIR        where uploaded files are kept (default: <temp dir>/ai-imager-uploads)
+#   UPLOAD_STAGING_QUOTA_MB   size the staging area is trimmed to after each upload (default 2048)
+
+CHUNK_SIZE = 1024 * 1024
+UPLOAD_FOLDER_NAME = "Uploaded_Images"
+
+STAGED_BYTES = metrics.counter("upload_staged_bytes_total", "Bytes of uploaded files written to the staging area")
+STAGED_FILES = metrics.counter("upload_staged_files_total", "Uploaded files staged, by whether their content was already staged")
+EVICTED_BYTES = metrics.counter("upload_evicted_bytes_total", "Bytes removed from the staging area to stay under its quota")
+
+class UploadStaging:
+    """
+    Content-addressed storage for uploaded images
+
+    Each file is streamed to disk in chunks while it is hashed, and kept as
+    <root>/<sha256>/<original name>. Uploading the same content again (under
+    any name) reuses the staged file, so it is neither written twice nor
+    analyzed twice.
+
+    Args:
+        root (str): Staging directory
+        quota_bytes (int): Size collect_garbage trims the staging area to
+    """
+    def __init__(self, root=None, quota_bytes=None):
+        self.root = os.path.abspath(root or os.environ.get("UPLOAD_STAGING_DIR")
+                                    or os.path.join(tempfile.gettempdir(), "ai-imager-uploads"))
+        if quota_bytes is None:
+            quota_bytes = int(float(os.environ.get("UPLOAD_STAGING_QUOTA_MB", 2048)) * 1024 * 1024)
+        self.quota_bytes = quota_bytes
+        self._incoming = os.path.join(self.root, ".incoming")
+        os.makedirs(self._incoming, exist_ok=True)
+        self._lock = threading.Lock()
+
+    def stage(self, fileobj, file_name):
+        """
+        Stream a file into the staging area
+
+        Args:
+            fileobj: Readable binary file object (e.g. a Streamlit UploadedFile)
+            file_name (str): Original file name, kept for display
+
+        Returns:
+            tuple: (path of the staged file, sha256 hex digest, whether the content was already staged)
+        """
+        digest = hashlib.sha256()
+        part_path = os.path.join(self._incoming, f"{uuid.uuid4().hex}.part")
+        size = 0
+        if hasattr(fileobj, "seek"):
+            fileobj.seek(0)
+        try:
+            with open(part_path, "wb") as f:
+                while True:
+                    chunk = fileobj.read(CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    digest.update(chunk)
+                    f.write(chunk)
+                    size += len(chunk)
+
+            content_dir = os.path.join(self.root, digest.hexdigest())
+            with self._lock:
+                existing = self._staged_file(content_dir)
+                if existing is not None:
+                    # Touch it so garbage collection sees it as recently used
+                    os.utime(content_dir)
+                    STAGED_FILES.inc(duplicate="true")
+                    return existing, digest.hexdigest(), True
+
+                os.makedirs(content_dir, exist_ok=True)
+                path = os.path.join(content_dir, os.path.basename(file_name) or "upload")
+                os.replace(part_path, path)
+        finally:
+            if os.path.exists(part_path):
+                os.remove(part_path)
+
+        STAGED_BYTES.inc(size)
+        STAGED_FILES.inc(duplicate="false")
+        return path, digest.hexdigest(), False
+
+    def usage(self):
+        """
+        Get the total size of the staged files in bytes
+        """
+        return sum(size for _, _, size in self._content_dirs())
+
+    def collect_garbage(self, keep=()):
+        """
+        Remove the least recently staged files until the staging area fits its quota
+
+        Args:
+            keep (iterable): Paths that must stay, e.g. files unfinished jobs still need
+
+        Returns:
+            tuple: (number of files removed, bytes freed)
+        """
+        keep_dirs = {os.path.dirname(os.path.abspath(path)) for path in keep}
+        with self._lock:
+            content_dirs = self._content_dirs()
+            total = sum(size for _, _, size in content_dirs)
+            removed = freed = 0
+            for content_dir, _, size in sorted(content_dirs, key=lambda entry: entry[1]):
+                if total <= self.quota_bytes:
+                    break
+                if content_dir in keep_dirs:
+                    continue
+                shutil.rmtree(content_dir, ignore_errors=True)
+                total -= size
+                removed += 1
+                freed += size
+        EVICTED_BYTES.inc(freed)
+        return removed, freed
+
+    def _staged_file(self, content_dir):
+        try:
+            names = os.listdir(content_dir)
+        except FileNotFoundError:
+            return None
+        return os.path.join(content_dir, names[0]) if names else None
+
+    def _content_dirs(self):
+        # (path, last used, size in bytes) of each staged content directory
+        entries = []
+        with os.scandir(self.root) as it:
+            for entry in it:
+                if not entry.is_dir() or entry.name.startswith("."):
+                    continue
+                size = 0
+                with os.scandir(entry.path) as files:
+                    for f in files:
+                        if f.is_file():
+                            size += f.stat().st_size
+                entries.append((entry.path, entry.stat().st_mtime, size))
+        return entries
+
+_staging = None
+_staging_lock = threading.Lock()
+
+def get_upload_staging():
+    """
+    Get the staging area configured by UPLOAD_STAGING_DIR and UPLOAD_STAGING_QUOTA_MB
+    """
+    global _staging
+    with _staging_lock:
+        if _staging is None:
+            _staging = UploadStaging()
+        return _staging
+
+def start_upload_job(uploaded_files, pipeline=None, staging=None, name=UPLOAD_FOLDER_NAME):
+    """
+    Create a job for uploaded files and start analyzing them while they are still being staged
+
+    The files are staged one at a time in a background thread. Each file is
+    added to the job as soon as it is on disk, so analysis starts with the
+    first file rather than after the last. Once a file is staged the list no
+    longer references it, so its upload buffer can be freed.
+
+    Args:
+        uploaded_files (list): File objects with a name attribute; emptied as they are staged
+        pipeline (IngestPipeline): Pipeline to analyze the files with
+        staging (UploadStaging): Staging area (the configured one if None)
+        name (str): Job name
+
+    Returns:
+        IngestJob: The created job
+    """
+    from ingest_jobs import create_folder_job, start_background_run
+
+    staging = staging or get_upload_staging()
+    job = create_folder_job([(UPLOAD_FOLDER_NAME, staging.root, [])], name=name)
+    items_complete = threading.Event()
+    start_background_run(job.id, pipeline=pipeline, items_complete=items_complete)
+    threading.Thread(target=_stage_into_job, args=(staging, job.id, uploaded_files, items_complete),
+                     name=f"upload-staging-{job.id}", daemon=True).start()
+    return job
+
+def _stage_into_job(staging, job_id, uploaded_files, items_complete):
+    try:
+        while uploaded_files:
+            uploaded_file = uploaded_files.pop(0)
+            try:
+                path, _, duplicate = staging.stage(uploaded_file, uploaded_file.name)
+            except Exception as e:
+                print(f"Error staging upload {uploaded_file.name}: {str(e)}")
+                continue
+            finally:
+                uploaded_file.close()
+
+            if not is_valid_image(path):
+                print(f"Skipping upload {uploaded_file.name}: not a valid image")
+                if not duplicate:
+                    shutil.rmtree(os.path.dirname(path), ignore_errors=True)
+                continue
+            db.add_ingest_job_items(job_id, staging.root, [path])
+    except Exception as e:
+        print(f"Error staging uploads for ingest job {job_id}: {str(e)}")
+    finally:
+        items_complete.set()
+
+    try:
+        staging.collect_garbage(keep=db.get_unfinished_job_item_paths(staging.root + os.sep))
+    except Exception as e:
+        print(f"Error cleaning up the upload staging area: {str(e)}")
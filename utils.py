@@ -1,23 +1,29 @@
 import os
 import json
+import time
+import queue
 import datetime
+import threading
+from collections import OrderedDict
 from PIL import Image
 from pillow_heif import register_heif_opener
 import exifread
+from concurrent.futures import ProcessPoolExecutor
+import metrics
 
 # Register the HEIF opener to support HEIC format
 register_heif_opener()
 
+# Supported image extensions
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp', '.gif', '.webp', '.heic', '.heif')
+
 def is_valid_image(file_path):
     """
     Check if a file is a valid image supported by the application
     """
-    # Supported image extensions
-    supported_extensions = ['.jpg', '.jpeg', '.png', '.bmp', '.gif', '.webp', '.heic', '.heif']
-    
     # Check file extension
     file_ext = os.path.splitext(file_path)[1].lower()
-    if file_ext not in supported_extensions:
+    if file_ext not in IMAGE_EXTENSIONS:
         return False
     
     # Try to open the image to validate it
@@ -48,6 +54,135 @@ def get_all_image_files(folder_path):
     
     return image_files
 
+def walk_image_tree(root, max_workers=8):
+    """
+    Walk a folder tree with several threads, yielding each directory's image files as it is read
+
+    Directories are listed with os.scandir by max_workers threads at once,
+    which keeps a network share or a RAID busy where a single os.walk waits on
+    one directory at a time. Files are matched by extension only; invalid
+    images fail later, in the pipeline, rather than being opened here. Hidden
+    directories and NAS metadata directories (names starting with "." or "@",
+    such as @eaDir) are skipped, and symlinked directories are not followed.
+
+    Args:
+        root (str): Top of the tree
+        max_workers (int): Directories listed at the same time
+
+    Yields:
+        tuple: (directory path, parent directory path or None for root, sorted
+            image file paths). A directory is always yielded before its subdirectories.
+    """
+    root = os.path.abspath(root)
+    pending = queue.Queue()
+    found = queue.Queue()
+    done = object()
+    lock = threading.Lock()
+    outstanding = 1
+    stop = threading.Event()
+
+    def list_directories():
+        nonlocal outstanding
+        while True:
+            item = pending.get()
+            if item is None:
+                return
+            path, parent = item
+            image_files = []
+            subdirs = []
+            if not stop.is_set():
+                try:
+                    with os.scandir(path) as entries:
+                        for entry in entries:
+                            try:
+                                if entry.is_dir(follow_symlinks=False):
+                                    if not entry.name.startswith((".", "@")):
+                                        subdirs.append(entry.path)
+                                elif entry.name.lower().endswith(IMAGE_EXTENSIONS) and entry.is_file():
+                                    image_files.append(entry.path)
+                            except OSError:
+                                continue
+                except OSError as e:
+                    print(f"Error reading directory {path}: {str(e)}")
+            # Yield the directory before any of its subdirectories can be listed
+            found.put((path, parent, sorted(image_files)))
+            with lock:
+                outstanding += len(subdirs) - 1
+                finished = outstanding == 0
+            for subdir in subdirs:
+                pending.put((subdir, path))
+            if finished:
+                found.put(done)
+                for _ in range(max_workers):
+                    pending.put(None)
+
+    threads = [threading.Thread(target=list_directories, name=f"tree-walk-{i}", daemon=True)
+               for i in range(max(1, max_workers))]
+    max_workers = len(threads)
+    pending.put((root, None))
+    for thread in threads:
+        thread.start()
+    try:
+        while True:
+            item = found.get()
+            if item is done:
+                return
+            yield item
+    finally:
+        # The caller stopped early: let the threads drain the remaining directories without reading them
+        stop.set()
+
+# Scan manifests by folder path (see scan_folder)
+SCAN_MANIFEST_ENTRIES = 32
+SCAN_MANIFEST_REQUESTS = metrics.counter("scan_manifest_requests_total",
+                                         "Folder scans answered from a cached manifest (hit) or by scanning (miss)")
+_scan_manifests = OrderedDict()
+_scan_manifests_lock = threading.Lock()
+
+def scan_folder(folder_path):
+    """
+    Get a scan manifest of a folder, scanning it only if it changed since the last scan
+
+    Scans validate every file with Pillow, so they are kept keyed by the
+    folder's path and modification time. Adding, removing or renaming a file
+    changes the folder's mtime and forces a new scan; a file edited in place
+    does not.
+
+    Args:
+        folder_path (str): Folder to scan
+
+    Returns:
+        dict: path, name, mtime_ns, image_files (tuple of valid image paths) and
+            scanned_at, or None if the folder does not exist
+    """
+    folder_path = os.path.abspath(folder_path)
+    try:
+        mtime_ns = os.stat(folder_path).st_mtime_ns
+    except OSError:
+        return None
+
+    with _scan_manifests_lock:
+        manifest = _scan_manifests.get(folder_path)
+        if manifest is not None and manifest["mtime_ns"] == mtime_ns:
+            _scan_manifests.move_to_end(folder_path)
+            SCAN_MANIFEST_REQUESTS.inc(result="hit")
+            return manifest
+
+    SCAN_MANIFEST_REQUESTS.inc(result="miss")
+    manifest = {
+        "path": folder_path,
+        "name": os.path.basename(folder_path),
+        "mtime_ns": mtime_ns,
+        "image_files": tuple(get_all_image_files(folder_path)),
+        "scanned_at": time.time(),
+    }
+    with _scan_manifests_lock:
+        _scan_manifests[folder_path] = manifest
+        _scan_manifests.move_to_end(folder_path)
+        while len(_scan_manifests) > SCAN_MANIFEST_ENTRIES:
+            _scan_manifests.popitem(last=False)
+    return manifest
+
 def get_image_dimensions(file_path):
     """
     Get the dimensions of an image
@@ -58,6 +193,37 @@ def get_image_dimensions(file_path):
     except Exception:
         return (0, 0)
 
+def compute_dhash(file_path, hash_size=8):
+    """
+    Compute a perceptual difference hash (dHash) of an image
+    
+    The image is shrunk to (hash_size + 1) x hash_size grayscale pixels and each
+    bit records whether a pixel is brighter than its right neighbour, so
+    resized or recompressed copies of a photo get the same or a close hash.
+    
+    Args:
+        file_path (str): Path to the image file
+        hash_size (int): Hash is hash_size * hash_size bits
+        
+    Returns:
+        str: The hash as a hex string, or None if the image can't be read
+    """
+    try:
+        with Image.open(file_path) as img:
+            # Let JPEG decode at reduced size; the hash only needs a thumbnail
+            img.draft('L', (hash_size * 8, hash_size * 8))
+            small = img.convert('L').resize((hash_size + 1, hash_size), Image.Resampling.LANCZOS)
+        pixels = list(small.getdata())
+    except Exception:
+        return None
+    
+    value = 0
+    for row in range(hash_size):
+        offset = row * (hash_size + 1)
+        for col in range(hash_size):
+            value = (value << 1) | (pixels[offset + col + 1] > pixels[offset + col])
+    return f"{value:0{hash_size * hash_size // 4}x}"
+
 def get_file_size(file_path):
     """
     Get the file size in bytes
@@ -91,6 +257,7 @@ def extract_image_metadata(file_path):
         'iso_speed': None,
         'gps_latitude': None,
         'gps_longitude': None,
+        'dhash': None,
     }
     
     try:
@@ -104,6 +271,9 @@ def extract_image_metadata(file_path):
         metadata['width'] = width
         metadata['height'] = height
         
+        # Perceptual hash for finding near-identical images
+        metadata['dhash'] = compute_dhash(file_path)
+        
         # Extract EXIF data
         with open(file_path, 'rb') as f:
             exif_tags = exifread.process_file(f, details=False)
@@ -179,6 +349,41 @@ def extract_image_metadata(file_path):
     
     return metadata
 
+def extract_metadata_parallel(file_paths, max_workers=None, chunksize=32):
+    """
+    Extract metadata for many image files using a pool of worker processes
+    
+    EXIF parsing and header decoding are CPU-bound, so spreading the files over
+    processes lets metadata extraction scale with the number of cores. Results
+    are yielded as they complete so they can be fed straight into batched writes.
+    
+    Args:
+        file_paths (list): Paths to the image files
+        max_workers (int): Number of worker processes (defaults to the CPU count)
+        chunksize (int): Number of files handed to a worker process at a time
+        
+    Yields:
+        tuple: (file_path, metadata) in the same order as file_paths
+    """
+    file_paths = list(file_paths)
+    if not file_paths:
+        return
+    
+    if max_workers is None:
+        max_workers = os.cpu_count() or 1
+    max_workers = min(max_workers, len(file_paths))
+    
+    # Not worth starting a pool for a single worker
+    if max_workers <= 1:
+        for file_path in file_paths:
+            yield file_path, extract_image_metadata(file_path)
+        return
+    
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        results = executor.map(extract_image_metadata, file_paths, chunksize=chunksize)
+        for file_path, metadata in zip(file_paths, results):
+            yield file_path, metadata
+
 def _get_gps_coord(exif_tags, coord_tag, ref_tag):
     """
     Convert GPS coordinates from EXIF format to decimal degrees
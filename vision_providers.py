@@ -0,0 +1,568 @@
+import os
+import io
+import time
+import base64
+import threading
+import numpy as np
+from PIL import Image
+from openai import OpenAI
+import metrics
+import image_processor
+from image_processor import (
+    analyze_image_with_openai, analyze_images_with_openai, triage_image_with_openai, downscale_base64_image,
+    API_SECONDS, API_ERRORS
+)
+
+# Provider configuration (see README "Vision Providers"):
+#   VISION_PROVIDER           default provider: openai, local, offline or tiered
+#   VISION_MODEL              model for the openai provider (default gpt-4o)
+#   TRIAGE_MODEL              model the openai provider triages with (default gpt-4o-mini)
+#   LOCAL_VISION_BASE_URL     OpenAI-compatible server for the local provider
+#   LOCAL_VISION_MODEL        model name on that server
+#   LOCAL_VISION_API_KEY      key for that server, if it needs one
+#   LOCAL_VISION_JSON_MODE    set to 0 if the server rejects response_format
+#   OFFLINE_MODEL_PATH        ONNX image classifier for the offline provider
+#   OFFLINE_LABELS_PATH       class labels for that model, one per line
+#   <NAME>_MAX_CONCURRENCY    concurrent requests per provider, e.g. LOCAL_MAX_CONCURRENCY=2
+#   <NAME>_REQUESTS_PER_MINUTE  request budget of this process for the openai or local provider
+#   VISION_REQUESTS_PER_MINUTE  budget for both when the provider has none of its own
+#   TIERED_TRIAGE_PROVIDER    provider the tiered provider triages with (default openai)
+#   TIERED_FULL_PROVIDER      provider escalated images are analyzed with (default openai)
+#   TRIAGE_MIN_QUALITY, TRIAGE_MIN_INTEREST, TRIAGE_SKIP_CATEGORIES   escalation rules (see EscalationRules)
+
+# The tiered provider's own limit only bounds the images in flight; its two
+# providers keep their own limits
+DEFAULT_CONCURRENCY = {"openai": 8, "local": 2, "offline": os.cpu_count() or 1, "tiered": 64}
+
+TIER_IMAGES = metrics.counter("vision_tier_images_total",
+                              "Images triaged by the tiered provider, by whether they escalated to the full analysis")
+BUDGET_WAIT = metrics.histogram("vision_budget_wait_seconds",
+                                "Time vision requests waited for the provider's request budget")
+RESUBMITTED = metrics.counter("vision_multi_image_resubmits_total",
+                              "Images re-submitted after a multi-image request failed or left them without a result")
+
+class RequestBudget:
+    """
+    Token bucket limiting how many requests this process sends per minute
+
+    Each ingest worker process has its own budget, so several workers sharing a
+    database can each use the rate limit of their own API key.
+
+    Args:
+        requests_per_minute (float): Sustained request rate
+        burst (int): Requests allowed back to back after an idle period
+    """
+    def __init__(self, requests_per_minute, burst=None):
+        self.requests_per_minute = float(requests_per_minute)
+        self.rate = self.requests_per_minute / 60.0
+        self.capacity = max(1.0, float(burst) if burst else self.rate)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, provider=None):
+        """
+        Wait until a request may be sent
+
+        Returns:
+            float: Seconds waited
+        """
+        waited = 0.0
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    if provider is not None:
+                        BUDGET_WAIT.observe(waited, provider=provider)
+                    return waited
+                delay = (1 - self._tokens) / self.rate
+            time.sleep(delay)
+            waited += delay
+
+    def __repr__(self):
+        return f"<RequestBudget(requests_per_minute={self.requests_per_minute:g})>"
+
+class VisionProvider:
+    """
+    Analyzes images, allowing at most max_concurrency analyses at a time
+
+    Pipelines can run more workers than a provider allows; the extra workers
+    wait for a free slot, so a slow local model is not overloaded.
+
+    Args:
+        name (str): Provider name (openai, local, offline)
+        model (str): Model used, recorded with metrics
+        max_concurrency (int): Analyses allowed to run at once
+    """
+    # Whether several images can be analyzed in one request (see analyze_many)
+    supports_multi_image = False
+    # Requests per minute this process may send (see RequestBudget); None for no limit
+    budget = None
+
+    def __init__(self, name, model, max_concurrency):
+        self.name = name
+        self.model = model
+        self.max_concurrency = max(1, int(max_concurrency))
+        self._slots = threading.BoundedSemaphore(self.max_concurrency)
+
+    def analyze(self, base64_image, trace_id=None):
+        """
+        Analyze an image
+
+        Args:
+            base64_image (str): Base64-encoded image
+            trace_id (str): Trace the analysis belongs to (see metrics.new_trace_id)
+
+        Returns:
+            dict: object_name, description, confidence and usage
+        """
+        self._spend()
+        with self._slots:
+            return self._analyze(base64_image, trace_id)
+
+    def analyze_many(self, base64_images, trace_id=None):
+        """
+        Analyze several images, in one request if the provider supports it
+
+        A request that fails is split in half and each half re-submitted; images
+        a response left out are re-submitted on their own. A single image left
+        over is analyzed with analyze().
+
+        Args:
+            base64_images (list): Base64-encoded images, downscaled for multi-image requests
+            trace_id (str): Trace the requests belong to
+
+        Returns:
+            list: Result dictionary, or the exception that ended its analysis, for each image
+        """
+        results = [None] * len(base64_images)
+        if self.supports_multi_image:
+            pending = [list(range(len(base64_images)))]
+        else:
+            pending = [[i] for i in range(len(base64_images))]
+
+        while pending:
+            group = pending.pop()
+            if len(group) == 1:
+                try:
+                    results[group[0]] = self.analyze(base64_images[group[0]], trace_id)
+                except Exception as e:
+                    results[group[0]] = e
+                continue
+
+            try:
+                self._spend()
+                with self._slots:
+                    found = self._analyze_group([base64_images[i] for i in group], trace_id)
+            except Exception:
+                # Counted in the API error metrics; the halves are retried below
+                found = {}
+            for position, result in found.items():
+                results[group[position]] = result
+
+            missing = [i for position, i in enumerate(group) if position not in found]
+            RESUBMITTED.inc(len(missing))
+            if len(missing) == len(group):
+                middle = len(group) // 2
+                pending.extend([group[middle:], group[:middle]])
+            elif missing:
+                pending.append(missing)
+        return results
+
+    def triage(self, base64_image, trace_id=None):
+        """
+        Quickly classify and score an image (see TieredProvider)
+
+        Args:
+            base64_image (str): Base64-encoded image, downscaled
+            trace_id (str): Trace the triage belongs to
+
+        Returns:
+            dict: category, object_name, summary, quality, interest, confidence and usage
+        """
+        self._spend()
+        with self._slots:
+            return self._triage(base64_image, trace_id)
+
+    def set_request_budget(self, requests_per_minute):
+        """
+        Limit the requests per minute this process sends to the provider (None or 0 for no limit)
+        """
+        self.budget = RequestBudget(requests_per_minute) if requests_per_minute else None
+
+    def _spend(self):
+        if self.budget is not None:
+            self.budget.acquire(self.name)
+
+    def _analyze(self, base64_image, trace_id):
+        raise NotImplementedError
+
+    def _triage(self, base64_image, trace_id):
+        raise NotImplementedError(f"The {self.name} provider cannot triage images")
+
+    def _analyze_group(self, base64_images, trace_id):
+        """
+        Analyze several images in one request
+
+        Returns:
+            dict: Position in base64_images -> result, for the images the response covered
+        """
+        raise NotImplementedError
+
+    def __repr__(self):
+        return f"<{type(self).__name__}(model='{self.model}', max_concurrency={self.max_concurrency})>"
+
+class OpenAIProvider(VisionProvider):
+    """
+    OpenAI's hosted vision models
+
+    Uses image_processor's client unless one is given, so swapping that client
+    (as the benchmarks do) affects this provider too.
+    """
+    supports_multi_image = True
+
+    def __init__(self, model=image_processor.ANALYSIS_MODEL, client=None, max_concurrency=DEFAULT_CONCURRENCY["openai"],
+                 json_mode=True, name="openai", triage_model=image_processor.TRIAGE_MODEL):
+        super().__init__(name, model, max_concurrency)
+        self.client = client
+        self.json_mode = json_mode
+        self.triage_model = triage_model
+
+    def _analyze(self, base64_image, trace_id):
+        return analyze_image_with_openai(
+            base64_image, trace_id=trace_id, client=self.client or image_processor.openai_client,
+            model=self.model, json_mode=self.json_mode
+        )
+
+    def _analyze_group(self, base64_images, trace_id):
+        return analyze_images_with_openai(
+            base64_images, trace_id=trace_id, client=self.client or image_processor.openai_client,
+            model=self.model, json_mode=self.json_mode
+        )
+
+    def _triage(self, base64_image, trace_id):
+        return triage_image_with_openai(
+            base64_image, trace_id=trace_id, client=self.client or image_processor.openai_client,
+            model=self.triage_model, json_mode=self.json_mode
+        )
+
+class LocalOpenAIProvider(OpenAIProvider):
+    """
+    A self-hosted vision model behind an OpenAI-compatible API (vLLM, Ollama, LM Studio, llama.cpp)
+
+    Args:
+        base_url (str): API root, e.g. http://localhost:11434/v1
+        model (str): Model name on the server, e.g. llava
+        api_key (str): Key, for servers that require one
+        json_mode (bool): Whether the server supports response_format; without
+            it the JSON object is parsed out of the text reply
+    """
+    def __init__(self, base_url, model, api_key="local", max_concurrency=DEFAULT_CONCURRENCY["local"],
+                 json_mode=True, timeout=300.0):
+        client = OpenAI(base_url=base_url, api_key=api_key, timeout=timeout, max_retries=1)
+        super().__init__(model=model, client=client, max_concurrency=max_concurrency,
+                         json_mode=json_mode, name="local", triage_model=model)
+        self.base_url = base_url
+
+class OfflineProvider(VisionProvider):
+    """
+    CPU-only analysis that needs no network
+
+    With an ONNX image classifier (and onnxruntime installed) the top class
+    becomes the object name. Without one, images get a basic description of
+    their colour, brightness and shape, with a low confidence, so they can be
+    catalogued now and re-analyzed with a vision model later.
+
+    Args:
+        model_path (str): ONNX classifier taking a 1x3xHxW ImageNet-normalized input
+        labels_path (str): Text file with one class label per line
+    """
+    IMAGENET_MEAN = np.array([0.485, 0.456, 0.406], dtype=np.float32)
+    IMAGENET_STD = np.array([0.229, 0.224, 0.225], dtype=np.float32)
+
+    def __init__(self, model_path=None, labels_path=None, max_concurrency=DEFAULT_CONCURRENCY["offline"]):
+        self.session = None
+        self.labels = None
+        model = "image-properties"
+        if model_path:
+            try:
+                import onnxruntime
+            except ImportError:
+                raise ImportError("The offline classifier needs onnxruntime: pip install onnxruntime")
+            self.session = onnxruntime.InferenceSession(model_path, providers=["CPUExecutionProvider"])
+            self.input = self.session.get_inputs()[0]
+            if labels_path:
+                with open(labels_path, encoding="utf-8") as f:
+                    self.labels = [line.strip() for line in f if line.strip()]
+            model = os.path.splitext(os.path.basename(model_path))[0]
+        super().__init__("offline", model, max_concurrency)
+
+    def _analyze(self, base64_image, trace_id):
+        try:
+            with API_SECONDS.time(trace_id=trace_id, model=self.model) as timing:
+                with Image.open(io.BytesIO(base64.b64decode(base64_image))) as img:
+                    img.draft("RGB", (448, 448))
+                    img = img.convert("RGB")
+                    result = self._classify(img) if self.session is not None else self._describe(img)
+        except Exception as e:
+            API_ERRORS.inc(model=self.model)
+            raise Exception(f"Offline analysis error: {str(e)}")
+        result["usage"] = {"retries": 0, "seconds": timing.seconds}
+        return result
+
+    def _triage(self, base64_image, trace_id):
+        try:
+            with API_SECONDS.time(trace_id=trace_id, model="image-properties") as timing:
+                with Image.open(io.BytesIO(base64.b64decode(base64_image))) as img:
+                    img.draft("RGB", (256, 256))
+                    img = img.convert("RGB")
+                    description = self._describe(img)
+                    pixels = np.asarray(img.resize((128, 128)), dtype=np.float32)
+        except Exception as e:
+            API_ERRORS.inc(model="image-properties")
+            raise Exception(f"Offline triage error: {str(e)}")
+
+        gray = pixels.mean(axis=2)
+        # Variance of the Laplacian: low for blurry images
+        laplacian = 4 * gray[1:-1, 1:-1] - gray[:-2, 1:-1] - gray[2:, 1:-1] - gray[1:-1, :-2] - gray[1:-1, 2:]
+        sharpness = min(laplacian.var() / 300.0, 1.0)
+        exposure = 1.0 - min(abs(gray.mean() / 255.0 - 0.5) * 2, 1.0) ** 2
+        # Screenshots and scanned documents are mostly a few flat colours
+        quantized = (pixels // 32).astype(np.int32)
+        codes = quantized[..., 0] * 64 + quantized[..., 1] * 8 + quantized[..., 2]
+        flat = np.sort(np.bincount(codes.ravel(), minlength=512))[::-1][:4].sum() / codes.size
+
+        if gray.std() < 8:
+            category = "blank"
+        elif flat > 0.75:
+            category = "document" if gray.mean() > 180 else "screenshot"
+        else:
+            category = "photo"
+        return {
+            "category": category,
+            "object_name": description["object_name"],
+            "summary": description["description"],
+            "quality": round(float(sharpness * exposure), 3),
+            "interest": 0.5,
+            "confidence": 0.1,
+            "usage": {"retries": 0, "seconds": timing.seconds},
+        }
+
+    def _classify(self, img):
+        # Dynamic dimensions are reported as strings or None; fall back to 224
+        height, width = [dim if isinstance(dim, int) else 224 for dim in self.input.shape[2:4]]
+        pixels = np.asarray(img.resize((width, height), Image.Resampling.BILINEAR), dtype=np.float32) / 255.0
+        pixels = ((pixels - self.IMAGENET_MEAN) / self.IMAGENET_STD).transpose(2, 0, 1)[None]
+        logits = self.session.run(None, {self.input.name: pixels.astype(np.float32)})[0][0]
+        probabilities = np.exp(logits - logits.max())
+        probabilities /= probabilities.sum()
+
+        top = np.argsort(probabilities)[::-1][:3]
+        names = [self.labels[i] if self.labels and i < len(self.labels) else f"class {i}" for i in top]
+        return {
+            "object_name": names[0].capitalize(),
+            "description": f"Classified offline as {names[0]} ({probabilities[top[0]]:.0%}). "
+                           f"Other candidates: {', '.join(names[1:])}.",
+            "confidence": round(float(probabilities[top[0]]), 3),
+        }
+
+    def _describe(self, img):
+        small = np.asarray(img.resize((64, 64)), dtype=np.float32)
+        brightness = small.mean() / 255.0
+        detail = np.abs(np.diff(small.mean(axis=2), axis=1)).mean() / 255.0
+        colour = _colour_name(small.reshape(-1, 3).mean(axis=0))
+        orientation = "landscape" if img.width > img.height * 1.1 else "portrait" if img.height > img.width * 1.1 else "square"
+        tone = "dark" if brightness < 0.3 else "bright" if brightness > 0.7 else "evenly lit"
+        texture = "highly detailed" if detail > 0.08 else "smooth" if detail < 0.02 else "moderately detailed"
+        return {
+            "object_name": f"{colour.capitalize()} {orientation} image",
+            "description": f"{'An' if tone[0] in 'aeiou' else 'A'} {tone}, {texture} {orientation} image in predominantly {colour} tones. "
+                           f"Analyzed offline without object recognition.",
+            "confidence": 0.1,
+        }
+
+class EscalationRules:
+    """
+    Decide from an image's triage whether it gets the full analysis
+
+    Args:
+        min_quality (float): Images scoring lower (blurry, dark) are not escalated
+        min_interest (float): Images scoring lower are not escalated
+        skip_categories (iterable): Categories that are never escalated
+    """
+    def __init__(self, min_quality=0.3, min_interest=0.0, skip_categories=("screenshot", "document", "blank")):
+        self.min_quality = min_quality
+        self.min_interest = min_interest
+        self.skip_categories = set(skip_categories)
+
+    @classmethod
+    def from_env(cls):
+        """
+        Rules from TRIAGE_MIN_QUALITY, TRIAGE_MIN_INTEREST and TRIAGE_SKIP_CATEGORIES (comma-separated)
+        """
+        rules = cls()
+        rules.min_quality = float(os.environ.get("TRIAGE_MIN_QUALITY", rules.min_quality))
+        rules.min_interest = float(os.environ.get("TRIAGE_MIN_INTEREST", rules.min_interest))
+        if "TRIAGE_SKIP_CATEGORIES" in os.environ:
+            rules.skip_categories = {
+                category.strip().lower() for category in os.environ["TRIAGE_SKIP_CATEGORIES"].split(",") if category.strip()
+            }
+        return rules
+
+    def check(self, triage):
+        """
+        Returns:
+            str: Why the image is not escalated, or None to escalate it
+        """
+        if triage["category"] in self.skip_categories:
+            return f"{triage['category']} images are skipped"
+        if triage["quality"] < self.min_quality:
+            return f"quality {triage['quality']:.2f} below {self.min_quality:.2f}"
+        if triage["interest"] < self.min_interest:
+            return f"interest {triage['interest']:.2f} below {self.min_interest:.2f}"
+        return None
+
+class TieredProvider(VisionProvider):
+    """
+    Two-tier analysis: a cheap triage of every image, then the full analysis
+    only for images that pass the escalation rules
+
+    Images that are not escalated keep the triage's object name and summary.
+    Usage reports the tier each image ended in, with the triage's latency and
+    cost kept apart from the full analysis's.
+
+    Args:
+        triage_provider (VisionProvider): Provider for the triage pass
+        full_provider (VisionProvider): Provider for the full analysis
+        rules (EscalationRules): Which images to escalate
+        triage_max_side (int): Images are downscaled to this size for triage
+    """
+    def __init__(self, triage_provider, full_provider, rules=None, triage_max_side=512,
+                 max_concurrency=DEFAULT_CONCURRENCY["tiered"]):
+        triage_model = getattr(triage_provider, "triage_model", triage_provider.model)
+        super().__init__("tiered", f"{triage_model} > {full_provider.model}", max_concurrency)
+        self.triage_provider = triage_provider
+        self.full_provider = full_provider
+        self.rules = rules or EscalationRules()
+        self.triage_max_side = triage_max_side
+
+    def _analyze(self, base64_image, trace_id):
+        small = downscale_base64_image(base64_image, self.triage_max_side)
+        triage = self.triage_provider.triage(small, trace_id=trace_id)
+        triage_usage = triage.pop("usage", {})
+        reason = self.rules.check(triage)
+        TIER_IMAGES.inc(outcome="triage_only" if reason else "escalated")
+
+        if reason:
+            result = {
+                "object_name": triage["object_name"],
+                "description": f"{triage['summary']} (Triaged as {triage['category']}; "
+                               f"not analyzed in detail: {reason}.)",
+                "confidence": triage["confidence"],
+                "usage": {"tier": "triage"},
+            }
+        else:
+            result = self.full_provider.analyze(base64_image, trace_id=trace_id)
+            result["usage"] = {**result.get("usage", {}), "tier": "full"}
+        result["triage"] = triage
+        result["usage"]["triage"] = triage_usage
+        return result
+
+_COLOURS = {
+    "red": (200, 40, 40), "orange": (230, 140, 40), "yellow": (230, 210, 60), "green": (60, 160, 70),
+    "blue": (50, 90, 200), "purple": (130, 60, 160), "pink": (230, 140, 180), "brown": (120, 80, 50),
+    "black": (20, 20, 20), "grey": (128, 128, 128), "white": (235, 235, 235),
+}
+
+def _colour_name(rgb):
+    """
+    Name of the reference colour closest to an RGB value
+    """
+    return min(_COLOURS, key=lambda name: sum((a - b) ** 2 for a, b in zip(rgb, _COLOURS[name])))
+
+# Provider registry
+
+_providers = {}
+# Reentrant: creating the tiered provider gets the providers it combines
+_providers_lock = threading.RLock()
+
+def _concurrency(name):
+    return int(os.environ.get(f"{name.upper()}_MAX_CONCURRENCY", DEFAULT_CONCURRENCY[name]))
+
+def _requests_per_minute(name):
+    # Only API providers are budgeted; the tiered provider's tiers have their own budgets
+    if name not in ("openai", "local"):
+        return None
+    value = os.environ.get(f"{name.upper()}_REQUESTS_PER_MINUTE") or os.environ.get("VISION_REQUESTS_PER_MINUTE")
+    return float(value) if value else None
+
+def available_providers():
+    """
+    Get the names of the providers that are configured
+    """
+    names = ["openai"]
+    if os.environ.get("LOCAL_VISION_BASE_URL"):
+        names.append("local")
+    names.extend(["offline", "tiered"])
+    return names
+
+def default_provider_name():
+    name = os.environ.get("VISION_PROVIDER", "openai").lower()
+    if name not in DEFAULT_CONCURRENCY:
+        raise ValueError(f"Unknown vision provider: {name}")
+    return name
+
+def get_provider(name=None):
+    """
+    Get a configured provider, creating it on first use
+
+    Args:
+        name (str): openai, local or offline (defaults to VISION_PROVIDER)
+
+    Returns:
+        VisionProvider: Shared instance, so its concurrency limit applies across pipelines
+    """
+    name = (name or default_provider_name()).lower()
+    with _providers_lock:
+        provider = _providers.get(name)
+        if provider is None:
+            if name == "openai":
+                provider = OpenAIProvider(
+                    model=os.environ.get("VISION_MODEL", image_processor.ANALYSIS_MODEL),
+                    max_concurrency=_concurrency(name),
+                    triage_model=os.environ.get("TRIAGE_MODEL", image_processor.TRIAGE_MODEL)
+                )
+            elif name == "local":
+                base_url = os.environ.get("LOCAL_VISION_BASE_URL")
+                if not base_url:
+                    raise ValueError("Set LOCAL_VISION_BASE_URL to use the local vision provider")
+                provider = LocalOpenAIProvider(
+                    base_url=base_url,
+                    model=os.environ.get("LOCAL_VISION_MODEL", "llava"),
+                    api_key=os.environ.get("LOCAL_VISION_API_KEY", "local"),
+                    max_concurrency=_concurrency(name),
+                    json_mode=os.environ.get("LOCAL_VISION_JSON_MODE", "1").lower() not in ("0", "false", "no")
+                )
+            elif name == "offline":
+                provider = OfflineProvider(
+                    model_path=os.environ.get("OFFLINE_MODEL_PATH"),
+                    labels_path=os.environ.get("OFFLINE_LABELS_PATH"),
+                    max_concurrency=_concurrency(name)
+                )
+            elif name == "tiered":
+                triage_name = os.environ.get("TIERED_TRIAGE_PROVIDER", "openai").lower()
+                full_name = os.environ.get("TIERED_FULL_PROVIDER", "openai").lower()
+                if "tiered" in (triage_name, full_name):
+                    raise ValueError("The tiered provider cannot use itself as a tier")
+                provider = TieredProvider(
+                    get_provider(triage_name), get_provider(full_name),
+                    rules=EscalationRules.from_env(), max_concurrency=_concurrency(name)
+                )
+            else:
+                raise ValueError(f"Unknown vision provider: {name}")
+            provider.set_request_budget(_requests_per_minute(name))
+            _providers[name] = provider
+        return provider